@@ -1,25 +1,43 @@
 import calendar
 import contextlib
+import csv
 import datetime as dt
 import functools
+import hashlib
 import io
+import itertools
 import json
 import logging
 import pathlib
 import secrets
 import signal
 import sys
+import tempfile
+import time
 import types
 import typing
+import urllib.parse
 
 import flask
 import waitress
 import werkzeug.exceptions
+import werkzeug.http
 import whitenoise
 import xlsxwriter
 
-from e2_spy import config, tasks, versions
-from e2_spy.db import AppDatabase, E2Database
+from e2_spy import config, exports, paperless, tasks, versions, xlsx
+from e2_spy.db import (
+    AppDatabase,
+    E2Database,
+    MirrorDatabase,
+    app_database,
+    cache,
+    mirror,
+    parts,
+    pool,
+    schedule,
+    timing,
+)
 
 log = logging.getLogger(__name__)
 
@@ -30,70 +48,305 @@ logging.basicConfig(
     level=logging.INFO,
 )
 
+slow_query_handler = logging.FileHandler(
+    str(getattr(config, "SLOW_QUERY_LOG", "slow-queries.log"))
+)
+slow_query_handler.setFormatter(
+    logging.Formatter("%(asctime)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+)
+timing.slow_log.addHandler(slow_query_handler)
+timing.slow_log.propagate = False
+
+# how many rows a streamed xlsx export reads from the database at a time
+XLSX_BATCH_ROWS = 1000
+
+# how many rows a streamed CSV or NDJSON export sends at a time
+CSV_CHUNK_ROWS = 500
+
+EXPORT_MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# how many rows (invoices for the sales summary) each page of a long report shows,
+# later pages load as the user scrolls
+PAGE_SIZE = 200
+
+
+def _write_sheet(
+    workbook: xlsxwriter.Workbook,
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    data: list | typing.Iterable[dict],
+    col_names: list,
+    headers: list,
+    table_name: str,
+) -> None:
+    """Write report rows to a worksheet as an Excel table
+
+    In a constant_memory workbook, tables are not available, so the sheet gets a
+    bold header row with filters instead.
+    """
+    constant_memory = workbook.constant_memory
+    if constant_memory:
+        worksheet.write_row(0, 0, headers, workbook.add_format({"bold": True}))
+    writer = xlsx.RowWriter(workbook, worksheet, col_names, headers)
+    # look up job notes for a batch of rows at a time, or all rows of a list at once
+    batches = itertools.batched(data, XLSX_BATCH_ROWS) if constant_memory else [data]
+    i = 0
+    for batch in batches:
+        if writer.needs_job_notes:
+            writer.job_notes.clear()
+            writer.job_notes.update(
+                flask.g.db.job_notes_get_many(r["job_number"] for r in batch)
+            )
+        i = writer.write_rows(batch, i + 1)
+        _export_progress(len(batch))
+    for j, width in enumerate(writer.widths):
+        worksheet.set_column(j, j, width)
+    if constant_memory:
+        worksheet.autofilter(0, 0, i, len(headers) - 1)
+        worksheet.freeze_panes(1, 0)
+    else:
+        table_options = {
+            "name": table_name,
+            "columns": [{"header": h} for h in headers],
+        }
+        worksheet.add_table(0, 0, i, len(headers) - 1, table_options)
+
 
 def _make_xlsx(
-    data: list, col_names: list, headers: list, table_name: str, filename: str
+    data: list | typing.Iterable[dict],
+    col_names: list,
+    headers: list,
+    table_name: str,
+    filename: str,
+    stream: bool = False,
 ) -> werkzeug.Response:
-    output = io.BytesIO()
+    """Build an xlsx file from report rows
+
+    With stream=True, data can be an iterator straight from the database. The
+    workbook is built in xlsxwriter's constant_memory mode in a temporary file, one
+    row at a time, and the response streams that file, so memory use does not grow
+    with the number of rows.
+    """
+    output = tempfile.TemporaryFile() if stream else io.BytesIO()
     workbook_options = {
         "default_date_format": "yyyy-mm-dd",
-        "in_memory": True,
+        "constant_memory": stream,
+        "in_memory": not stream,
     }
     workbook = xlsxwriter.Workbook(output, workbook_options)
-    text_wrap = workbook.add_format({"text_wrap": True})
-    money = workbook.add_format({"num_format": "$#,##0.00;[Red]$#,##0.00"})
     worksheet = workbook.add_worksheet()
-    col_widths = [len(h) for h in headers]
-    for i, row in enumerate(data, start=1):
-        for j, col_name in enumerate(col_names):
-            if col_name in ("amount", "unit_price"):
-                col_data = row[col_name]
-                worksheet.write_number(i, j, col_data, money)
-                col_widths[j] = max(col_widths[j], len(str(col_data)))
-            elif col_name == "gl_account":
-                col_data = row[col_name]
-                worksheet.write(i, j, col_data)
-                col_widths[j] = max(10, len(str(col_data)))
-            elif col_name == "job_notes":
-                col_data = flask.g.db.job_notes_get(row["job_number"])
-                worksheet.write_string(i, j, col_data, text_wrap)
-                col_widths[j] = 40
-            elif col_name == "job_number":
-                col_data = row[col_name]
-                worksheet.write(i, j, col_data)
-                col_widths[j] = max(
-                    14, len(col_data)
-                )  # 14 is a good width for 'Job Number'
-            elif col_name == "part_active":
-                col_data = row[col_name]
-                worksheet.write(i, j, col_data)
-                # column header is 'Active', it is longer than any value (TRUE or FALSE)
-                col_widths[j] = 9
-            elif col_name == "part_description":
-                col_data = row[col_name]
-                worksheet.write_string(i, j, col_data)
-                col_widths[j] = 100
-            else:
-                col_data = row[col_name]
-                worksheet.write(i, j, col_data)
-                col_widths[j] = max(col_widths[j], len(str(col_data)))
-    for i, width in enumerate(col_widths):
-        worksheet.set_column(i, i, width)
-    table_options = {"name": table_name, "columns": [{"header": h} for h in headers]}
-    worksheet.add_table(0, 0, len(data), len(headers) - 1, table_options)
+    _write_sheet(workbook, worksheet, data, col_names, headers, table_name)
     workbook.close()
+    mimetype = EXPORT_MIMETYPES["xlsx"]
+    if stream:
+        output.seek(0)
+        return flask.send_file(
+            output, mimetype, as_attachment=True, download_name=filename
+        )
     response = flask.make_response(output.getvalue())
     response.headers.update(
         {
             "Content-Disposition": f'attachment; filename="{filename}"',
-            "Content-Type": (
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            ),
+            "Content-Type": mimetype,
         }
     )
     return response
 
 
+def _export_format() -> str:
+    """Get the format an export route was asked for, from the extension in the URL"""
+    return flask.request.path.rpartition(".")[2]
+
+
+def _export_streams() -> bool:
+    """Decide whether an export reads its rows as a stream from the database
+
+    CSV and NDJSON exports always stream. xlsx exports of reports that are not
+    unbounded read a list, so they can share a cached result with the report page.
+    """
+    return _export_format() != "xlsx"
+
+
+def _export_progress(rows: int) -> None:
+    """Count rows written by an export that is running as a background export job"""
+    job = flask.g.get("export_job")
+    if job is not None:
+        job.rows += rows
+
+
+def _export_rows(
+    data: typing.Iterable[dict], col_names: list
+) -> typing.Iterator[tuple[dict, dict[str, str]]]:
+    """Yield rows with the job notes for their batch, looked up one batch at a time"""
+    if "job_notes" not in col_names:
+        for row in data:
+            yield row, {}
+        return
+    for batch in itertools.batched(data, XLSX_BATCH_ROWS):
+        job_notes = flask.g.db.job_notes_get_many(r["job_number"] for r in batch)
+        for row in batch:
+            yield row, job_notes
+
+
+def _export_value(col_name: str, row: dict, job_notes: dict[str, str]) -> typing.Any:  # noqa: ANN401
+    if col_name == "job_notes":
+        return job_notes.get(row["job_number"], "")
+    return row[col_name]
+
+
+def _json_default(o: object) -> str:
+    if isinstance(o, dt.date):
+        return o.isoformat()
+    return str(o)
+
+
+def _make_csv(
+    data: typing.Iterable[dict], col_names: list, headers: list
+) -> typing.Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    yield buffer.getvalue()
+    for rows in itertools.batched(_export_rows(data, col_names), CSV_CHUNK_ROWS):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            [_export_value(c, row, job_notes) for c in col_names]
+            for row, job_notes in rows
+        )
+        _export_progress(len(rows))
+        yield buffer.getvalue()
+
+
+def _make_ndjson(data: typing.Iterable[dict], col_names: list) -> typing.Iterator[str]:
+    for rows in itertools.batched(_export_rows(data, col_names), CSV_CHUNK_ROWS):
+        yield "".join(
+            json.dumps(
+                {c: _export_value(c, row, job_notes) for c in col_names},
+                default=_json_default,
+            )
+            + "\n"
+            for row, job_notes in rows
+        )
+        _export_progress(len(rows))
+
+
+def _make_export(export: exports.Export) -> werkzeug.Response:
+    """Build an export in the format the route was asked for: xlsx, csv or ndjson
+
+    CSV and NDJSON responses are generated while they are sent, straight from the
+    database cursor, so the first bytes go out right away and the full result is
+    never held in memory.
+    """
+    export_format = _export_format()
+    data = export.query(stream=export.stream or _export_streams())
+    col_names, headers = export.col_names, export.headers
+    if export_format == "xlsx":
+        return _make_xlsx(
+            data, col_names, headers, export.table_name, export.filename, export.stream
+        )
+    if export_format == "csv":
+        body = _make_csv(data, col_names, headers)
+    else:
+        body = _make_ndjson(data, col_names)
+    filename = str(pathlib.PurePath(export.filename).with_suffix(f".{export_format}"))
+    return flask.Response(
+        flask.stream_with_context(body),
+        mimetype=EXPORT_MIMETYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _export_cache_key() -> str:
+    """Identify an export file by its URL, its parameters and a fingerprint of the
+    data in it
+
+    The fingerprint is the E2 database and whether it is read through the mirror,
+    the current window of exports.CACHE_SECONDS, and the version of the job notes.
+    """
+    db = flask.g.db
+    args = sorted((k, v) for k, v in flask.request.values.items(multi=True) if v)
+    cnx_details = db.e2_cnx_details
+    fingerprint = (
+        cnx_details.get("server"),
+        cnx_details.get("database"),
+        db.e2_mirror_enabled,
+        int(time.time() // exports.CACHE_SECONDS),
+        db.job_notes_version,
+    )
+    key = repr((flask.request.path, args, fingerprint))
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _run_export(job: exports.ExportJob, output: typing.BinaryIO) -> None:
+    """Request the export route of a background export job and write the file
+
+    The route runs in a request context of its own, as if the user that submitted
+    the job had requested it, and its response is written to output as it is
+    generated.
+    """
+    query_string = urllib.parse.urlencode(job.args)
+    with app.test_request_context(job.path, query_string=query_string):
+        flask.g.versions = versions
+        flask.g.db = get_database()
+        flask.g.session_id = f"export {job.id}"
+        flask.g.unlocked_pages = job.unlocked_pages
+        flask.g.export_job = job
+        response = app.make_response(app.dispatch_request())
+        try:
+            if response.mimetype == "text/html":
+                msg = "The page for this export is locked"
+                raise PermissionError(msg)
+            output.writelines(response.iter_encoded())
+        finally:
+            response.close()
+    _, options = werkzeug.http.parse_options_header(
+        response.headers.get("Content-Disposition", "")
+    )
+    job.filename = options.get("filename", pathlib.PurePath(job.path).name)
+
+
+def _closed_after() -> tuple[dt.date | None, str] | None:
+    """Get the keyset cursor for the next page of a report of closed jobs"""
+    job_number = flask.request.values.get("after_job")
+    if job_number is None:
+        return None
+    after_date = flask.request.values.get("after_date")
+    return str_to_date(after_date) if after_date else None, job_number
+
+
+def _closed_next_page(rows: list, endpoint: str, **values: dt.date) -> str | None:
+    """Build the URL for the page after rows of a report of closed jobs, if any"""
+    if len(rows) < PAGE_SIZE:
+        return None
+    date_closed = rows[-1]["date_closed"]
+    if isinstance(date_closed, dt.datetime):
+        date_closed = date_closed.date()
+    return flask.url_for(
+        endpoint,
+        after_date=date_closed or "",
+        after_job=rows[-1]["job_number"],
+        **values,
+    )
+
+
+def _render_page(template: str, rows_template: str) -> str:
+    """Render a paged report, or only its next page of table rows for htmx"""
+    if flask.request.headers.get("HX-Request") == "true":
+        return flask.render_template(rows_template)
+    return flask.render_template(template)
+
+
+def load_job_notes(rows: list[dict]) -> None:
+    """Look up notes for every job in a report at once, for the job notes column"""
+    flask.g.job_notes_map = flask.g.db.job_notes_get_many(
+        row["job_number"] for row in rows
+    )
+
+
 def str_to_date(s: str | None) -> dt.date:
     if s is None:
         s = "1970-01-01"
@@ -101,18 +354,18 @@ def str_to_date(s: str | None) -> dt.date:
 
 
 def get_database() -> AppDatabase:
-    """Get a connection to the database"""
-    return AppDatabase(str(config.APP_DB_PATH))
+    """Get this thread's connection to the database"""
+    return app_database(str(config.APP_DB_PATH))
 
 
 def get_e2_database(_db: AppDatabase) -> E2Database:
-    cnx_details = {
-        "server": _db.e2_hostname,
-        "user": _db.e2_user,
-        "password": _db.e2_password,
-        "database": _db.e2_database,
-    }
-    return E2Database(cnx_details)
+    if _db.e2_mirror_enabled:
+        e2db = MirrorDatabase(_db.e2_cnx_details)
+    else:
+        e2db = E2Database(_db.e2_cnx_details)
+    # templates show how old the data is when it came from the mirror
+    flask.g.e2db = e2db
+    return e2db
 
 
 app = flask.Flask(__name__)
@@ -142,23 +395,111 @@ def before_request() -> None:
     flask.g.db = get_database()
     flask.session.permanent = True
     flask.g.session_id = flask.session.setdefault("session_id", secrets.token_urlsafe())
-    flask.g.unlocked_pages = flask.g.db.get_unlocked_pages(flask.g.session_id)
+    flask.g.unlocked_pages = get_unlocked_pages()
+
+
+def get_unlocked_pages() -> set[str]:
+    """Get the pages this session has unlocked
+
+    Unlocked pages and their expiry times are kept in the signed session cookie, so
+    this does not query the database unless unlocks have been revoked on the server
+    since the session last loaded them.
+    """
+    epoch = flask.g.db.page_unlocks_epoch
+    if (
+        "unlocked_pages" not in flask.session
+        or flask.session.get("page_unlocks_epoch") != epoch
+    ):
+        flask.session["unlocked_pages"] = flask.g.db.get_unlocked_pages(
+            flask.g.session_id
+        )
+        flask.session["page_unlocks_epoch"] = epoch
+    now = time.time()
+    return {
+        page_key
+        for page_key, expires_at in flask.session["unlocked_pages"].items()
+        if expires_at > now
+    }
 
 
-def page_lock(f: typing.Callable) -> typing.Callable:
+def page_lock(
+    f: typing.Callable | None = None, *, page_key: str | None = None
+) -> typing.Callable:
+    """Only run a route for sessions that have unlocked its page, and ask for the
+    password otherwise
+
+    The page is the route's endpoint, or page_key for routes that share one password.
+    Once unlocked, the session goes back to the locked page, or for a POST, to the
+    page the request came from.
+    """
+
+    def decorator(f: typing.Callable) -> typing.Callable:
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs) -> str | werkzeug.Response:  # noqa: ANN002, ANN003
+            flask.g.page_key = page_key or flask.request.endpoint
+            log.debug(
+                f"Checking if session {flask.g.session_id} "
+                f"has unlocked page {flask.g.page_key}"
+            )
+            if flask.g.page_key in flask.g.unlocked_pages:
+                log.debug("Page is unlocked")
+                flask.g.unlocked = True
+            else:
+                log.debug("Page is locked")
+                if flask.request.method == "GET":
+                    flask.g.unlock_next = flask.request.full_path.rstrip("?")
+                else:
+                    referrer = urllib.parse.urlsplit(flask.request.referrer or "")
+                    flask.g.unlock_next = referrer.path or flask.url_for("index")
+                return flask.render_template("locked-page.html")
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    if f is not None:
+        return decorator(f)
+    return decorator
+
+
+def export_cached(f: typing.Callable) -> typing.Callable:
+    """Serve an export route from the on-disk export cache
+
+    A cached file goes out with its ETag and Content-Length, and requests that
+    already have it get 304 Not Modified. Otherwise the route runs and its response
+    is saved to the cache as it is sent, with the ETag but without Content-Length.
+    """
+
     @functools.wraps(f)
-    def decorated_function(*args, **kwargs) -> str | werkzeug.Response:  # noqa: ANN002, ANN003
-        log.debug(
-            f"Checking if session {flask.g.session_id} "
-            f"has unlocked page {flask.request.endpoint}"
+    def decorated_function(*args, **kwargs) -> werkzeug.Response:  # noqa: ANN002, ANN003
+        key = _export_cache_key()
+        file = exports.cache.get(key)
+        if file is not None:
+            try:
+                # send_file opens the file, evicting it after that does not matter
+                response = flask.send_file(
+                    file,
+                    EXPORT_MIMETYPES[_export_format()],
+                    as_attachment=True,
+                    download_name=file.name,
+                    etag=key,
+                )
+            except FileNotFoundError:
+                log.debug(f"Export cache {key} was evicted before it could be sent")
+            else:
+                log.debug(f"Serving {flask.request.path} from export cache {key}")
+                return response
+        response = flask.make_response(f(*args, **kwargs))
+        _, options = werkzeug.http.parse_options_header(
+            response.headers.get("Content-Disposition", "")
         )
-        if flask.request.endpoint in flask.g.unlocked_pages:
-            log.debug("Page is unlocked")
-            flask.g.unlocked = True
-        else:
-            log.debug("Page is locked")
-            return flask.render_template("locked-page.html")
-        return f(*args, **kwargs)
+        if response.status_code != 200 or "filename" not in options:
+            return response
+        response.set_etag(key)
+        response.response = exports.cache.put(
+            key, options["filename"], response.iter_encoded()
+        )
+        response.direct_passthrough = False
+        return response
 
     return decorated_function
 
@@ -196,22 +537,27 @@ def action_summary() -> str:
     flask.g.start_date = start_date
     flask.g.end_date = end_date
     flask.g.selected_users = flask.request.values.getlist("users")
-    flask.g.rows = e2db.action_summary(start_date, end_date, flask.g.selected_users)
-    flask.g.available_users = e2db.get_followup_user_code_list()
+    flask.g.rows, flask.g.available_users = e2db.gather(
+        functools.partial(
+            e2db.action_summary, start_date, end_date, flask.g.selected_users
+        ),
+        e2db.get_followup_user_code_list,
+    )
     return flask.render_template("action-summary.html")
 
 
 @app.get("/closed-jobs")
 def closed_jobs() -> str:
     e2db = get_e2_database(flask.g.db)
-    flask.g.rows = e2db.closed_jobs()
-    return flask.render_template("closed-jobs.html")
+    flask.g.rows = e2db.closed_jobs(_closed_after(), PAGE_SIZE)
+    load_job_notes(flask.g.rows)
+    flask.g.next_page_url = _closed_next_page(flask.g.rows, "closed_jobs")
+    return _render_page("closed-jobs.html", "closed-jobs-rows.html")
 
 
-@app.get("/closed-jobs.xlsx")
-def closed_jobs_xlsx() -> werkzeug.Response:
+def closed_jobs_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
-    rows = e2db.closed_jobs()
+    query = e2db.closed_jobs
     headers = [
         "Job Number",
         "Part Number",
@@ -232,7 +578,17 @@ def closed_jobs_xlsx() -> werkzeug.Response:
         "date_closed",
         "job_notes",
     ]
-    return _make_xlsx(rows, col_names, headers, "ClosedJobs", "Closed Jobs.xlsx")
+    return exports.Export(
+        query, col_names, headers, "ClosedJobs", "Closed Jobs.xlsx", stream=True
+    )
+
+
+@app.get("/closed-jobs.csv")
+@app.get("/closed-jobs.ndjson")
+@app.get("/closed-jobs.xlsx")
+@export_cached
+def closed_jobs_xlsx() -> werkzeug.Response:
+    return _make_export(closed_jobs_export())
 
 
 @app.get("/contacts")
@@ -242,10 +598,9 @@ def contacts() -> str:
     return flask.render_template("contacts.html")
 
 
-@app.get("/contacts.xlsx")
-def contacts_xlsx() -> werkzeug.Response:
+def contacts_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
-    rows = e2db.contacts_list()
+    query = e2db.contacts_list
     headers = [
         "Contact Type",
         "Customer Name",
@@ -264,7 +619,15 @@ def contacts_xlsx() -> werkzeug.Response:
         "email",
         "title",
     ]
-    return _make_xlsx(rows, col_names, headers, "Contacts", "Contacts.xlsx")
+    return exports.Export(query, col_names, headers, "Contacts", "Contacts.xlsx")
+
+
+@app.get("/contacts.csv")
+@app.get("/contacts.ndjson")
+@app.get("/contacts.xlsx")
+@export_cached
+def contacts_xlsx() -> werkzeug.Response:
+    return _make_export(contacts_export())
 
 
 @app.get("/customers")
@@ -274,10 +637,9 @@ def customers() -> str:
     return flask.render_template("customers.html")
 
 
-@app.get("/customers.xlsx")
-def customers_xlsx() -> werkzeug.Response:
+def customers_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
-    rows = e2db.customer_list()
+    query = e2db.customer_list
     headers = [
         "Customer ID",
         "Customer Name",
@@ -296,20 +658,28 @@ def customers_xlsx() -> werkzeug.Response:
         "postal_code",
         "address_type",
     ]
-    return _make_xlsx(rows, col_names, headers, "Customers", "Customers.xlsx")
+    return exports.Export(query, col_names, headers, "Customers", "Customers.xlsx")
+
+
+@app.get("/customers.csv")
+@app.get("/customers.ndjson")
+@app.get("/customers.xlsx")
+@export_cached
+def customers_xlsx() -> werkzeug.Response:
+    return _make_export(customers_export())
 
 
 @app.get("/days-since-last-activity")
 def days_since_last_activity() -> str:
     e2db = get_e2_database(flask.g.db)
     flask.g.rows = e2db.days_since_last_activity()
+    load_job_notes(flask.g.rows)
     return flask.render_template("days-since-last-activity.html")
 
 
-@app.get("/days-since-last-activity.xlsx")
-def days_since_last_activity_xlsx() -> werkzeug.Response:
+def days_since_last_activity_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
-    rows = e2db.days_since_last_activity()
+    query = e2db.days_since_last_activity
     headers = [
         "Job Number",
         "Part Number",
@@ -332,8 +702,8 @@ def days_since_last_activity_xlsx() -> werkzeug.Response:
         "days_since_last_activity",
         "job_notes",
     ]
-    return _make_xlsx(
-        rows,
+    return exports.Export(
+        query,
         col_names,
         headers,
         "DaysSinceLastActivity",
@@ -341,6 +711,132 @@ def days_since_last_activity_xlsx() -> werkzeug.Response:
     )
 
 
+@app.get("/days-since-last-activity.csv")
+@app.get("/days-since-last-activity.ndjson")
+@app.get("/days-since-last-activity.xlsx")
+@export_cached
+def days_since_last_activity_xlsx() -> werkzeug.Response:
+    return _make_export(days_since_last_activity_export())
+
+
+@app.get("/diagnostics/cache")
+@page_lock(page_key="admin")
+def diagnostics_cache() -> dict:
+    """Show hit and miss counts for the E2 report cache"""
+    return {
+        **cache.result_cache.stats(),
+        "export_files": exports.cache.stats(),
+        "part_dimensions": parts.dimensions.stats(),
+    }
+
+
+@app.post("/diagnostics/cache/flush")
+@page_lock(page_key="admin")
+def diagnostics_cache_flush() -> dict:
+    """Flush the E2 report cache, or only the results for one report
+
+    Flushing everything also drops the schedule snapshot, so the next schedule
+    report rebuilds it, and the part dimension, which the next refresh reads again
+    in full.
+    """
+    report = flask.request.values.get("report") or None
+    flushed = cache.result_cache.flush(report)
+    if report is None:
+        schedule.snapshots.clear()
+        parts.dimensions.clear()
+    return {"flushed": flushed, **cache.result_cache.stats()}
+
+
+@app.get("/diagnostics/e2-pool")
+@page_lock(page_key="admin")
+def diagnostics_e2_pool() -> dict:
+    """Show connection pool statistics for the E2 database"""
+    return pool.pool_stats()
+
+
+@app.get("/diagnostics/paperless-parts")
+@page_lock(page_key="admin")
+def diagnostics_paperless_parts() -> dict:
+    """Show request, retry and failure counts for the Paperless Parts API, and the
+    size of the payload store"""
+    db: AppDatabase = flask.g.db
+    return {**paperless.stats(), "payloads": db.paperless_parts_payloads_stats()}
+
+
+@app.get("/diagnostics/queries")
+@page_lock(page_key="admin")
+def diagnostics_queries() -> str:
+    """Render timing and row count stats for E2 queries, per report"""
+    flask.g.rows = timing.query_stats.reports()
+    flask.g.slow_queries = list(timing.query_stats.slow_queries)
+    flask.g.slow_query_seconds = timing.SLOW_QUERY_SECONDS
+    return flask.render_template("query-stats.html")
+
+
+@app.post("/diagnostics/queries/reset")
+@page_lock(page_key="admin")
+def diagnostics_queries_reset() -> werkzeug.Response:
+    timing.query_stats.reset()
+    return flask.redirect(flask.url_for("diagnostics_queries"))
+
+
+@app.post("/exports")
+def exports_create() -> werkzeug.Response:
+    """Handle a POST request to run an export in the background
+
+    The export and format query arguments name the export, and the other values
+    in the request are passed to it. Exports that do not come in the format get a
+    404. Submitting the same export while it is still
+    running gets the job that is already running.
+    """
+    endpoint = flask.request.args.get("export", "")
+    export_format = flask.request.args.get("format", "xlsx")
+    if (
+        not endpoint.endswith("_xlsx")
+        or endpoint not in app.view_functions
+        or export_format not in ("csv", "ndjson", "xlsx")
+    ):
+        flask.abort(404)
+    path = flask.url_for(endpoint).removesuffix(".xlsx") + f".{export_format}"
+    # not every export has a route for every format, the workbook is only xlsx
+    try:
+        matched, _ = app.create_url_adapter(flask.request).match(path, method="GET")
+    except werkzeug.exceptions.HTTPException:
+        flask.abort(404)
+    if matched != endpoint:
+        flask.abort(404)
+    args = [
+        (k, v)
+        for k, v in flask.request.values.items(multi=True)
+        if k not in ("export", "format")
+    ]
+    unlocked_pages = flask.g.unlocked_pages & {endpoint}
+    job, created = exports.jobs.submit(path, args, unlocked_pages)
+    if created:
+        tasks.scheduler.add_job(exports.jobs.run, args=(job, _run_export))
+    return flask.redirect(flask.url_for("exports_detail", job_id=job.id))
+
+
+@app.get("/exports/<job_id>")
+def exports_detail(job_id: str) -> str:
+    """Render the progress of a background export, or only the progress card for
+    htmx to poll"""
+    flask.g.job = exports.jobs.get(job_id)
+    if flask.g.job is None:
+        flask.abort(404)
+    if flask.request.headers.get("HX-Request") == "true":
+        return flask.render_template("export-status.html")
+    return flask.render_template("export.html")
+
+
+@app.get("/exports/<job_id>/download")
+def exports_download(job_id: str) -> werkzeug.Response:
+    job = exports.jobs.get(job_id)
+    if job is None or job.status != "done":
+        flask.abort(404)
+    return flask.send_file(job.file, as_attachment=True, download_name=job.filename)
+
+
 @app.get("/income-statements")
 @page_lock
 def income_statements() -> str:
@@ -367,10 +863,15 @@ def income_statements() -> str:
     flask.g.end_date = end_date
     flask.g.department = flask.request.values.get("department", "shop")
     e2db = get_e2_database(flask.g.db)
-    flask.g.rows = e2db.income_statement(
-        flask.g.department, flask.g.start_date, flask.g.end_date
+    flask.g.rows, flask.g.period_list = e2db.gather(
+        functools.partial(
+            e2db.income_statement,
+            flask.g.department,
+            flask.g.start_date,
+            flask.g.end_date,
+        ),
+        functools.partial(e2db.period_list, flask.g.start_date, flask.g.end_date),
     )
-    flask.g.period_list = e2db.period_list(flask.g.start_date, flask.g.end_date)
     flask.g.total = sum(
         [
             row.get("total_amount")
@@ -395,18 +896,25 @@ def income_statements() -> str:
     return flask.render_template("income-statements.html")
 
 
-@app.get("/income-statements.xlsx")
-@page_lock
-def income_statements_xlsx() -> werkzeug.Response:
+def income_statements_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
     department = flask.request.values.get("department", "")
     start_date = str_to_date(flask.request.values.get("start_date"))
     end_date = str_to_date(flask.request.values.get("end_date"))
-    rows = e2db.income_statement(department, start_date, end_date)
+    query = functools.partial(e2db.income_statement, department, start_date, end_date)
     headers = ["GL Code", "Account Description", "Account Type", "Amount"]
     col_names = ["gl_account", "description", "account_type", "total_amount"]
     filename = f"Income Statement ({department}, {start_date} to {end_date}).xlsx"
-    return _make_xlsx(rows, col_names, headers, "IncomeStatement", filename)
+    return exports.Export(query, col_names, headers, "IncomeStatement", filename)
+
+
+@app.get("/income-statements.csv")
+@app.get("/income-statements.ndjson")
+@app.get("/income-statements.xlsx")
+@page_lock
+@export_cached
+def income_statements_xlsx() -> werkzeug.Response:
+    return _make_export(income_statements_export())
 
 
 @app.get("/inventory-count-sheet")
@@ -417,25 +925,30 @@ def inventory_count_sheet() -> str:
     flask.g.include_inactive_parts = "include-inactive-parts" in flask.request.values
     if not (flask.g.include_active_parts or flask.g.include_inactive_parts):
         flask.g.include_active_parts = flask.g.include_inactive_parts = True
-    flask.g.rows = e2db.inventory_count_sheet(
-        flask.g.selected_product_codes,
-        flask.g.include_active_parts,
-        flask.g.include_inactive_parts,
+    flask.g.rows, flask.g.product_codes = e2db.gather(
+        functools.partial(
+            e2db.inventory_count_sheet,
+            flask.g.selected_product_codes,
+            flask.g.include_active_parts,
+            flask.g.include_inactive_parts,
+        ),
+        e2db.product_codes,
     )
-    flask.g.product_codes = e2db.product_codes()
     return flask.render_template("inventory-count-sheet.html")
 
 
-@app.get("/inventory-count-sheet.xlsx")
-def inventory_count_sheet_xlsx() -> werkzeug.Response:
+def inventory_count_sheet_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
     selected_product_codes = flask.request.values.getlist("product-code")
     include_active_parts = "include-active-parts" in flask.request.values
     include_inactive_parts = "include-inactive-parts" in flask.request.values
     if not (include_active_parts or include_inactive_parts):
         include_active_parts = include_inactive_parts = True
-    rows = e2db.inventory_count_sheet(
-        selected_product_codes, include_active_parts, include_inactive_parts
+    query = functools.partial(
+        e2db.inventory_count_sheet,
+        selected_product_codes,
+        include_active_parts,
+        include_inactive_parts,
     )
     headers = [
         "Part number",
@@ -455,11 +968,19 @@ def inventory_count_sheet_xlsx() -> werkzeug.Response:
         "location",
         "quantity",
     ]
-    return _make_xlsx(
-        rows, col_names, headers, "InventoryCountSheet", "Inventory Count Sheet.xlsx"
+    return exports.Export(
+        query, col_names, headers, "InventoryCountSheet", "Inventory Count Sheet.xlsx"
     )
 
 
+@app.get("/inventory-count-sheet.csv")
+@app.get("/inventory-count-sheet.ndjson")
+@app.get("/inventory-count-sheet.xlsx")
+@export_cached
+def inventory_count_sheet_xlsx() -> werkzeug.Response:
+    return _make_export(inventory_count_sheet_export())
+
+
 @app.post("/job-notes/form")
 def job_notes_form() -> str:
     db: AppDatabase = flask.g.db
@@ -504,17 +1025,22 @@ def job_performance() -> str:
             start_date, end_date = end_date, start_date
     flask.g.start_date = start_date
     flask.g.end_date = end_date
-    flask.g.rows = e2db.job_performance(start_date, end_date)
-    return flask.render_template("job-performance.html")
+    flask.g.rows = e2db.job_performance(
+        start_date, end_date, after=_closed_after(), limit=PAGE_SIZE
+    )
+    load_job_notes(flask.g.rows)
+    flask.g.next_page_url = _closed_next_page(
+        flask.g.rows, "job_performance", start_date=start_date, end_date=end_date
+    )
+    return _render_page("job-performance.html", "job-performance-rows.html")
 
 
-@app.get("/job-performance.xlsx")
-def job_performance_xlsx() -> werkzeug.Response:
+def job_performance_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
     get_all = flask.request.values.get("get_all") == "true"
     start_date = str_to_date(flask.request.values.get("start_date", "2022-01-01"))
     end_date = str_to_date(flask.request.values.get("end_date", "2022-01-01"))
-    rows = e2db.job_performance(start_date, end_date, get_all)
+    query = functools.partial(e2db.job_performance, start_date, end_date, get_all)
     headers = [
         "Job Number",
         "Part Number",
@@ -545,15 +1071,24 @@ def job_performance_xlsx() -> werkzeug.Response:
         record_range = "all"
     else:
         record_range = f"{start_date} to {end_date}"
-    return _make_xlsx(
-        rows,
+    return exports.Export(
+        query,
         col_names,
         headers,
         "JobPerformance",
         f"Job Performance ({record_range}).xlsx",
+        stream=True,
     )
 
 
+@app.get("/job-performance.csv")
+@app.get("/job-performance.ndjson")
+@app.get("/job-performance.xlsx")
+@export_cached
+def job_performance_xlsx() -> werkzeug.Response:
+    return _make_export(job_performance_export())
+
+
 @app.get("/loading-summary")
 def loading_summary() -> str:
     """Render the Loading Summary report"""
@@ -561,19 +1096,19 @@ def loading_summary() -> str:
     flask.g.selected_departments = flask.request.values.getlist("department")
     if not flask.g.selected_departments:
         flask.g.selected_departments = ["Processing"]
-    flask.g.rows = e2db.get_loading_summary(flask.g.selected_departments)
-    flask.g.departments = e2db.get_departments_list()
+    flask.g.rows, flask.g.departments = e2db.gather(
+        functools.partial(e2db.get_loading_summary, flask.g.selected_departments),
+        e2db.get_departments_list,
+    )
     return flask.render_template("loading-summary.html")
 
 
-@app.get("/loading-summary.xlsx")
-def loading_summary_xlsx() -> werkzeug.Response:
-    """Generate the Loading Summary report as an Excel file"""
+def loading_summary_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
     selected_departments = flask.request.values.getlist("department")
     if not selected_departments:
         selected_departments = ["Processing"]
-    rows = e2db.get_loading_summary(selected_departments)
+    query = functools.partial(e2db.get_loading_summary, selected_departments)
     col_names = [
         "department_name",
         "job_number",
@@ -602,17 +1137,29 @@ def loading_summary_xlsx() -> werkzeug.Response:
         "Due Date",
         "Next Step",
     ]
-    return _make_xlsx(
-        rows, col_names, headers, "LoadingSummary", "Loading Summary.xlsx"
+    return exports.Export(
+        query, col_names, headers, "LoadingSummary", "Loading Summary.xlsx"
     )
 
 
+@app.get("/loading-summary.csv")
+@app.get("/loading-summary.ndjson")
+@app.get("/loading-summary.xlsx")
+@export_cached
+def loading_summary_xlsx() -> werkzeug.Response:
+    """Generate the Loading Summary report as an Excel file"""
+    return _make_export(loading_summary_export())
+
+
 @app.post("/lock")
 def lock() -> werkzeug.Response:
     endpoint = flask.request.values.get("endpoint")
     log.debug(f"Got a request from session {flask.g.session_id} to lock {endpoint}")
-    flask.g.db.lock_page(flask.g.session_id, endpoint)
-    flask.g.db.lock_page(flask.g.session_id, f"{endpoint}_xlsx")
+    unlocked_pages = flask.session.get("unlocked_pages", {})
+    for page_key in (endpoint, f"{endpoint}_xlsx"):
+        flask.g.db.lock_page(flask.g.session_id, page_key)
+        unlocked_pages.pop(page_key, None)
+    flask.session["unlocked_pages"] = unlocked_pages
     return flask.redirect(flask.url_for("index"))
 
 
@@ -620,13 +1167,13 @@ def lock() -> werkzeug.Response:
 def open_sales_report() -> str:
     e2db = get_e2_database(flask.g.db)
     flask.g.rows = e2db.open_sales_report()
+    load_job_notes(flask.g.rows)
     return flask.render_template("open-sales-report.html")
 
 
-@app.get("/open-sales-report.xlsx")
-def open_sales_report_xlsx() -> werkzeug.Response:
+def open_sales_report_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
-    rows = e2db.open_sales_report()
+    query = e2db.open_sales_report
     col_names = [
         "job_number",
         "priority",
@@ -673,11 +1220,19 @@ def open_sales_report_xlsx() -> werkzeug.Response:
         "PO Due Date",
         "Job Notes",
     ]
-    return _make_xlsx(
-        rows, col_names, headers, "OpenSalesReport", "Open Sales Report.xlsx"
+    return exports.Export(
+        query, col_names, headers, "OpenSalesReport", "Open Sales Report.xlsx"
     )
 
 
+@app.get("/open-sales-report.csv")
+@app.get("/open-sales-report.ndjson")
+@app.get("/open-sales-report.xlsx")
+@export_cached
+def open_sales_report_xlsx() -> werkzeug.Response:
+    return _make_export(open_sales_report_export())
+
+
 @app.get("/paperless-parts/quote-items")
 def paperless_parts_quote_items() -> str:
     start_val = flask.request.values.get("start")
@@ -699,28 +1254,16 @@ def paperless_parts_quote_items() -> str:
     if start_date > end_date:
         start_date, end_date = end_date, start_date
 
-    db = AppDatabase(str(config.APP_DB_PATH))
-    parts = db.paperless_parts_quote_items_parts_in_range(start_date, end_date)
-
-    e2db = get_e2_database(db)
-    part_numbers = list(set([r["part_number"] for r in parts]))
-    part_dates = e2db.part_dates(part_numbers)
-
-    new_part_numbers = set()
-    for r in parts:
-        this_pn = r["part_number"]
-        quote_sent = r["quote_sent_date"]
-        if this_pn not in new_part_numbers:
-            if this_pn not in part_dates:
-                new_part_numbers.add(this_pn)
-            else:
-                entered_date = part_dates[this_pn]["entered_date"]
-                log.debug(
-                    f"{this_pn} quote sent {quote_sent}, part entered {entered_date}"
-                )
-                if quote_sent < entered_date:
-                    new_part_numbers.add(this_pn)
+    # whether each item is for a new part was worked out when its quote was synced
+    item_parts = flask.g.db.paperless_parts_quote_items_parts_in_range(
+        start_date, end_date
+    )
+    new_part_numbers = {r["part_number"] for r in item_parts if r["new_part"]}
     new_part_count = len(new_part_numbers)
+    # items that have not been classified yet might be for new parts or not
+    unknown_part_numbers = {
+        r["part_number"] for r in item_parts if r["new_part"] is None
+    } - new_part_numbers
     log.debug(f"New part numbers: {new_part_numbers}")
 
     return flask.render_template(
@@ -728,10 +1271,10 @@ def paperless_parts_quote_items() -> str:
         ctx={
             "start": start_date.isoformat(),
             "end": end_date.isoformat(),
-            "parts": parts,
-            "part_dates": part_dates,
+            "parts": item_parts,
             "new_part_numbers": new_part_numbers,
             "new_part_count": new_part_count,
+            "unknown_part_numbers": unknown_part_numbers,
         },
     )
 
@@ -749,10 +1292,36 @@ def paperless_parts_quotes_dump() -> str:
     return "ok"
 
 
+def _paperless_parts_sync_submit() -> paperless.SyncRun:
+    """Start a Paperless Parts sync in the background, or get the one in flight"""
+    run, created = paperless.syncs.submit()
+    if created:
+        tasks.scheduler.add_job(tasks.paperless_parts_sync_run, args=(run,))
+    return run
+
+
 @app.get("/paperless-parts/sync")
-def paperless_parts_sync() -> werkzeug.Response:
-    tasks.scheduler.add_job(tasks.paperless_parts_sync)
-    return flask.redirect(flask.url_for("index"))
+def paperless_parts_sync() -> str | werkzeug.Response:
+    """Render the progress of the Paperless Parts sync for htmx to poll
+
+    Any other request starts a sync, or joins the one in flight, and shows it on
+    /settings.
+    """
+    if flask.request.headers.get("HX-Request") == "true":
+        flask.g.sync = paperless.syncs.current
+        return flask.render_template("paperless-parts/sync-status.html")
+    _paperless_parts_sync_submit()
+    return flask.redirect(flask.url_for("settings"))
+
+
+@app.post("/paperless-parts/sync")
+def paperless_parts_sync_create() -> str | werkzeug.Response:
+    """Handle a POST request to start a Paperless Parts sync, or join the one in
+    flight"""
+    flask.g.sync = _paperless_parts_sync_submit()
+    if flask.request.headers.get("HX-Request") == "true":
+        return flask.render_template("paperless-parts/sync-status.html")
+    return flask.redirect(flask.url_for("settings"))
 
 
 def sales_summary_dates(
@@ -794,12 +1363,25 @@ def sales_summary() -> str:
     start_date, end_date = sales_summary_dates(start_date, end_date)
     flask.g.start_date = start_date
     flask.g.end_date = end_date
-    flask.g.rows = e2db.sales_summary(start_date, end_date)
-    return flask.render_template("sales-summary.html")
+    flask.g.rows = e2db.sales_summary(
+        start_date,
+        end_date,
+        after=flask.request.values.get("after_invoice"),
+        limit=PAGE_SIZE,
+    )
+    flask.g.next_page_url = None
+    invoices = {row["invoice_number"] for row in flask.g.rows}
+    if len(invoices) == PAGE_SIZE:
+        flask.g.next_page_url = flask.url_for(
+            "sales_summary",
+            after_invoice=flask.g.rows[-1]["invoice_number"],
+            start_date=start_date,
+            end_date=end_date,
+        )
+    return _render_page("sales-summary.html", "sales-summary-rows.html")
 
 
-@app.get("/sales-summary.xlsx")
-def sales_summary_xlsx() -> werkzeug.Response:
+def sales_summary_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
     try:
         start_date = str_to_date(flask.request.values.get("start_date"))
@@ -852,16 +1434,25 @@ def sales_summary_xlsx() -> werkzeug.Response:
         "gl_account_description",
         "amount",
     ]
-    rows = e2db.sales_summary(start_date, end_date)
-    return _make_xlsx(
-        rows,
+    query = functools.partial(e2db.sales_summary, start_date, end_date)
+    return exports.Export(
+        query,
         col_names,
         headers,
         "SalesSummary",
         f"Sales Summary ({start_date} to {end_date}).xlsx",
+        stream=True,
     )
 
 
+@app.get("/sales-summary.csv")
+@app.get("/sales-summary.ndjson")
+@app.get("/sales-summary.xlsx")
+@export_cached
+def sales_summary_xlsx() -> werkzeug.Response:
+    return _make_export(sales_summary_export())
+
+
 @app.get("/service-vendors")
 def service_vendors() -> str:
     e2db = get_e2_database(flask.g.db)
@@ -869,23 +1460,54 @@ def service_vendors() -> str:
     return flask.render_template("service-vendors.html")
 
 
-@app.get("/service-vendors.xlsx")
-def service_vendors_xlsx() -> werkzeug.Response:
+def service_vendors_export() -> exports.Export:
     e2db = get_e2_database(flask.g.db)
-    rows = e2db.service_vendors_list()
+    query = e2db.service_vendors_list
     col_names = ["service_code", "vendor_code", "is_default", "lead_time_days"]
     headers = ["Service Code", "Vendor Code", "Is Default", "Lead Time (Days)"]
-    return _make_xlsx(
-        rows, col_names, headers, "ServiceVendors", "Service Vendors.xlsx"
+    return exports.Export(
+        query, col_names, headers, "ServiceVendors", "Service Vendors.xlsx"
     )
 
 
+@app.get("/service-vendors.csv")
+@app.get("/service-vendors.ndjson")
+@app.get("/service-vendors.xlsx")
+@export_cached
+def service_vendors_xlsx() -> werkzeug.Response:
+    return _make_export(service_vendors_export())
+
+
 @app.get("/settings")
 def settings() -> str:
     """Render the /settings page"""
+    flask.g.mirror_status = mirror.get_store().status()
+    flask.g.sync = paperless.syncs.current
+    flask.g.paperless_parts_sync_runs = flask.g.db.paperless_parts_sync_runs_list()
     return flask.render_template("settings.html")
 
 
+@app.post("/settings/e2-mirror")
+def settings_e2_mirror() -> werkzeug.Response:
+    """Handle a POST request to turn serving reports from the local mirror on or off"""
+    flask.g.db.e2_mirror_enabled = "e2-mirror-enabled" in flask.request.values
+    return flask.redirect(flask.url_for("settings"))
+
+
+@app.post("/settings/e2-mirror/sync")
+def settings_e2_mirror_sync() -> werkzeug.Response:
+    tasks.scheduler.add_job(tasks.e2_mirror_sync, kwargs={"force": True})
+    return flask.redirect(flask.url_for("settings"))
+
+
+@app.post("/settings/page-unlocks/revoke")
+@page_lock(page_key="admin")
+def settings_page_unlocks_revoke() -> werkzeug.Response:
+    """Handle a POST request to lock every page again for everyone"""
+    flask.g.db.page_unlocks_revoke()
+    return flask.redirect(flask.url_for("settings"))
+
+
 @app.post("/settings/paperless-parts")
 def settings_paperless_parts() -> werkzeug.Response:
     """Handle a POST request to save settings for Paperless Parts to the database"""
@@ -917,14 +1539,103 @@ def unlock() -> werkzeug.Response:
     password = flask.request.values.get("password")
     log.debug(f"Got a request from session {flask.g.session_id} to unlock {endpoint}")
     if flask.g.db.check_page_password(endpoint, password):
-        flask.g.db.unlock_page(flask.g.session_id, endpoint)
-        flask.g.db.unlock_page(flask.g.session_id, f"{endpoint}_xlsx")
-    return flask.redirect(flask.url_for(endpoint))
+        unlocked_pages = flask.session.get("unlocked_pages", {})
+        for page_key in (endpoint, f"{endpoint}_xlsx"):
+            unlocked_pages[page_key] = flask.g.db.unlock_page(
+                flask.g.session_id, page_key
+            )
+        flask.session["unlocked_pages"] = unlocked_pages
+    # only go back to a page on this site
+    next_url = flask.request.values.get("next", "")
+    if next_url.startswith("/") and not next_url.startswith(("//", "/\\")):
+        return flask.redirect(next_url)
+    if endpoint in app.view_functions:
+        return flask.redirect(flask.url_for(endpoint))
+    return flask.redirect(flask.url_for("index"))
+
+
+# the reports that can be sheets of the workbook, by name, with their sheet title and
+# the function that gets their export
+WORKBOOK_SHEETS: dict[str, tuple[str, typing.Callable[[], exports.Export]]] = {
+    "closed-jobs": ("Closed Jobs", closed_jobs_export),
+    "contacts": ("Contacts", contacts_export),
+    "customers": ("Customers", customers_export),
+    "days-since-last-activity": (
+        "Days Since Last Activity",
+        days_since_last_activity_export,
+    ),
+    "inventory-count-sheet": ("Inventory Count Sheet", inventory_count_sheet_export),
+    "job-performance": ("Job Performance", job_performance_export),
+    "loading-summary": ("Loading Summary", loading_summary_export),
+    "open-sales-report": ("Open Sales Report", open_sales_report_export),
+    "sales-summary": ("Sales Summary", sales_summary_export),
+    "service-vendors": ("Service Vendors", service_vendors_export),
+}
+
+
+@app.get("/workbook")
+def workbook() -> str:
+    """Render a form to pick the reports for one workbook"""
+    flask.g.sheets = WORKBOOK_SHEETS
+    flask.g.start_date, flask.g.end_date = sales_summary_dates(None, None)
+    return flask.render_template("workbook.html")
+
+
+@app.get("/workbook.xlsx")
+@export_cached
+def workbook_xlsx() -> werkzeug.Response:
+    """Build one workbook with a sheet for each selected report
+
+    The report queries run at the same time on separate connections, and each sheet
+    is written as soon as its rows arrive, so the workbook takes about as long as the
+    slowest report. Reports with dates use the start_date and end_date of the
+    request.
+    """
+    names = [n for n in flask.request.values.getlist("report") if n in WORKBOOK_SHEETS]
+    e2db = get_e2_database(flask.g.db)
+    sheets = {n: WORKBOOK_SHEETS[n][1]() for n in names or WORKBOOK_SHEETS}
+    output = tempfile.TemporaryFile()
+    workbook_options = {"default_date_format": "yyyy-mm-dd", "constant_memory": True}
+    workbook = xlsxwriter.Workbook(output, workbook_options)
+    worksheets = {n: workbook.add_worksheet(WORKBOOK_SHEETS[n][0]) for n in sheets}
+    calls = {n: functools.partial(e.query, stream=False) for n, e in sheets.items()}
+    for n, rows in e2db.gather_as_completed(calls):
+        e = sheets[n]
+        _write_sheet(
+            workbook, worksheets[n], rows, e.col_names, e.headers, e.table_name
+        )
+    workbook.close()
+    output.seek(0)
+    return flask.send_file(
+        output,
+        EXPORT_MIMETYPES["xlsx"],
+        as_attachment=True,
+        download_name=f"E2 Spy Reports ({dt.date.today()}).xlsx",
+    )
 
 
 def main() -> None:
     tasks.scheduler.start()
     tasks.scheduler.add_job(tasks.paperless_parts_sync, "cron", day="*", hour="3")
+    tasks.scheduler.add_job(
+        tasks.paperless_parts_payloads_prune, "cron", day="*", hour="4"
+    )
+    tasks.scheduler.add_job(tasks.e2_mirror_sync, "interval", minutes=15)
+    tasks.scheduler.add_job(tasks.paperless_parts_quote_items_classify_backlog)
+    tasks.scheduler.add_job(tasks.page_unlocks_prune, "interval", hours=1)
+    tasks.scheduler.add_job(tasks.exports_prune, "interval", hours=1)
+    tasks.scheduler.add_job(
+        tasks.e2_part_dimension_refresh,
+        "interval",
+        seconds=parts.REFRESH_SECONDS,
+        next_run_time=dt.datetime.now(),
+    )
+    tasks.scheduler.add_job(
+        tasks.e2_schedule_snapshot_refresh,
+        "interval",
+        seconds=schedule.REFRESH_SECONDS,
+        next_run_time=dt.datetime.now(),
+    )
     waitress.serve(app, port=config.PORT, threads=8)
 
 
@@ -1,14 +1,51 @@
 # full path to application database
 APP_DB_PATH = "app.db"
 
+# full path to the local mirror of E2 tables
+MIRROR_DB_PATH = "mirror.db"
+
+# mirrored tables that are synced past a watermark are compared row by row with E2
+# this often, to pick up the changes and deletions the watermark misses
+MIRROR_RECONCILE_HOURS = 24
+
+# full path to a directory for files of exports that run in the background
+EXPORT_DIR = "exports"
+
+# files of exports that run in the background are deleted after this many hours
+EXPORT_RETENTION_HOURS = 24
+
+# full path to a directory for cached export files
+EXPORT_CACHE_DIR = "export-cache"
+
+# a cached export file is served for this many seconds after it is built
+EXPORT_CACHE_SECONDS = 300
+
+# least recently used export files are deleted when the cache is bigger than this
+EXPORT_CACHE_MAX_MB = 512
+
 # full path to application log file
 APP_LOG = "app.log"
 
 # full path to a file to collect all stderr message
 ERR_LOG = "stderr.log"
 
+# full path to a file to collect E2 queries that take longer than SLOW_QUERY_SECONDS
+SLOW_QUERY_LOG = "slow-queries.log"
+
+# E2 queries that take longer than this many seconds are written to SLOW_QUERY_LOG
+SLOW_QUERY_SECONDS = 2
+
 # port to listen on
 PORT = 80
 
-# paperless parts cache directory
-PAPERLESS_PARTS_CACHE_DIR = ".local/cache"
+# Paperless Parts API, set this to the URL of a local mock server for testing
+PAPERLESS_PARTS_BASE_URL = "https://api.paperlessparts.com"
+
+# how many Paperless Parts quote details to fetch at the same time
+PAPERLESS_PARTS_FETCH_THREADS = 4
+
+# how many requests per second to send to the Paperless Parts API, on average
+PAPERLESS_PARTS_REQUESTS_PER_SECOND = 4
+
+# a Paperless Parts sync stops sending requests after this many seconds
+PAPERLESS_PARTS_SYNC_BUDGET_SECONDS = 3600
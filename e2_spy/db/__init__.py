@@ -1,2 +1,11 @@
-from .app import AppDatabase
+from .app import AppDatabase, app_database, app_database_writer
 from .e2 import E2Database
+from .mirror import MirrorDatabase
+
+__all__ = [
+    "AppDatabase",
+    "E2Database",
+    "MirrorDatabase",
+    "app_database",
+    "app_database_writer",
+]
@@ -1,10 +1,19 @@
+import contextlib
 import datetime as dt
 import json
 import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import Iterable, Iterator
 from typing import TypedDict
 from zoneinfo import ZoneInfo
+
 import fort
 
+from e2_spy import paperless
+
 
 class PaperlessPartsQuoteItemsDict(TypedDict):
     quote_number: int
@@ -15,9 +24,104 @@ class PaperlessPartsQuoteItemsDict(TypedDict):
     quote_sent_date: dt.datetime
 
 
+class SettingsCache:
+    """All settings in one database file, shared by every AppDatabase in the process
+
+    Settings are loaded with one query and reloaded only after something has written
+    to the database, from this process or another one. Writes are detected with
+    PRAGMA data_version on a connection that is kept open only for that purpose.
+    """
+
+    def __init__(self, dsn: str) -> None:
+        self._lock = threading.Lock()
+        self._watch = sqlite3.connect(dsn, check_same_thread=False)
+        self._data_version: int | None = None
+        self._settings: dict[str, str] | None = None
+
+    def get(self, db: "AppDatabase") -> dict[str, str]:
+        with self._lock:
+            data_version = self._watch.execute("pragma data_version").fetchone()[0]
+            if self._settings is None or data_version != self._data_version:
+                sql = """
+                    select setting_id, setting_value from settings
+                """
+                self._settings = {
+                    r["setting_id"]: r["setting_value"] for r in db.q(sql)
+                }
+                self._data_version = data_version
+            return self._settings
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._settings = None
+
+
+_settings_caches: dict[str, SettingsCache] = {}
+_settings_caches_lock = threading.Lock()
+
+# how long a page stays unlocked for a session after the password is entered
+PAGE_UNLOCK_SECONDS = 31 * 24 * 60 * 60
+
+# payloads from Paperless Parts are compressed with zlib at this level
+PAYLOAD_COMPRESSION_LEVEL = 9
+
+# pruning payloads vacuums the database when more than this fraction of it is free
+VACUUM_FREE_FRACTION = 0.25
+
+# connections are opened once per thread and kept for the life of the thread
+_thread_local = threading.local()
+
+# background jobs that write to the database take turns
+_writer_lock = threading.Lock()
+
+# pragmas for every connection; in WAL mode readers and the writer do not block
+# each other, and a writer that finds the database locked waits instead of failing
+CONNECTION_PRAGMAS = (
+    "pragma journal_mode = wal",
+    "pragma synchronous = normal",
+    "pragma busy_timeout = 10000",
+    "pragma cache_size = -16000",
+    "pragma temp_store = memory",
+)
+
+
+def _thread_database(dsn: str, role: str) -> "AppDatabase":
+    databases = _thread_local.__dict__.setdefault("databases", {})
+    if (dsn, role) not in databases:
+        databases[(dsn, role)] = AppDatabase(dsn)
+    return databases[(dsn, role)]
+
+
+def app_database(dsn: str) -> "AppDatabase":
+    """Get this thread's connection to the database, for serving requests"""
+    return _thread_database(dsn, "reader")
+
+
+@contextlib.contextmanager
+def app_database_writer(dsn: str) -> Iterator["AppDatabase"]:
+    """Get a connection for a background job that writes to the database
+
+    Background jobs get connections separate from the ones that serve requests, and
+    only one of them holds a writer at a time.
+    """
+    with _writer_lock:
+        yield _thread_database(dsn, "writer")
+
+
 class AppDatabase(fort.SQLiteDatabase):
     _version: int | None = None
 
+    def __init__(self, dsn: str) -> None:
+        super().__init__(dsn)
+        for pragma in CONNECTION_PRAGMAS:
+            self.cnx.execute(pragma)
+        self._settings_cache = None
+        if dsn != ":memory:":
+            with _settings_caches_lock:
+                if dsn not in _settings_caches:
+                    _settings_caches[dsn] = SettingsCache(dsn)
+                self._settings_cache = _settings_caches[dsn]
+
     def _table_exists(self, table_name: str) -> bool:
         sql = """
             select count(*) table_count
@@ -42,13 +146,27 @@ class AppDatabase(fort.SQLiteDatabase):
         }
         self.u(sql, params)
 
-    def check_page_password(self, page_key: str, password: str) -> bool:
+    def check_page_password(self, page_key: str, password: str | None) -> bool:
+        """Check a password for a page, a page that has no password set can never be
+        unlocked"""
         sql = """
             select page_password from page_passwords where page_key = :page_key
         """
         params = {"page_key": page_key}
         page_password = self.q_val(sql, params)
-        return password == page_password
+        if not password or not page_password:
+            return False
+        return secrets.compare_digest(password.encode(), page_password.encode())
+
+    @property
+    def e2_cnx_details(self) -> dict:
+        settings = self.settings
+        return {
+            "server": settings.get("e2-hostname"),
+            "user": settings.get("e2-user"),
+            "password": settings.get("e2-password"),
+            "database": settings.get("e2-database"),
+        }
 
     @property
     def e2_database(self) -> str:
@@ -60,8 +178,9 @@ class AppDatabase(fort.SQLiteDatabase):
 
     @property
     def e2_database_configured(self) -> bool:
+        settings = self.settings
         for prop in ("e2-database", "e2-hostname", "e2-password", "e2-user"):
-            if self.get_setting(prop) in (None, ""):
+            if settings.get(prop) in (None, ""):
                 return False
         return True
 
@@ -73,6 +192,14 @@ class AppDatabase(fort.SQLiteDatabase):
     def e2_hostname(self, value: str) -> None:
         self.set_setting("e2-hostname", value)
 
+    @property
+    def e2_mirror_enabled(self) -> bool:
+        return self.get_setting("e2-mirror-enabled") == "true"
+
+    @e2_mirror_enabled.setter
+    def e2_mirror_enabled(self, value: bool) -> None:
+        self.set_setting("e2-mirror-enabled", "true" if value else "false")
+
     @property
     def e2_password(self) -> str:
         return self.get_setting("e2-password")
@@ -90,21 +217,18 @@ class AppDatabase(fort.SQLiteDatabase):
         self.set_setting("e2-user", value)
 
     def get_setting(self, setting_id: str) -> str:
-        sql = """
-            select setting_value from settings where setting_id = :setting_id
-        """
-        params = {"setting_id": setting_id}
-        return self.q_val(sql, params)
+        return self.settings.get(setting_id)
 
-    def get_unlocked_pages(self, session_id: str) -> list[str]:
+    def get_unlocked_pages(self, session_id: str) -> dict[str, int]:
+        """Get the pages a session has unlocked, with when each unlock expires"""
         sql = """
-            select page_key
+            select page_key, expires_at
             from unlocked_pages
-            where session_id = :session_id
+            where session_id = :session_id and expires_at > :now
             order by page_key
         """
-        params = {"session_id": session_id}
-        return [r["page_key"] for r in self.q(sql, params)]
+        params = {"session_id": session_id, "now": int(time.time())}
+        return {r["page_key"]: r["expires_at"] for r in self.q(sql, params)}
 
     def job_notes_delete(self, job_number: str) -> None:
         sql = """
@@ -112,6 +236,7 @@ class AppDatabase(fort.SQLiteDatabase):
         """
         params = {"job_number": job_number}
         self.u(sql, params)
+        self.set_setting("job-notes-version", secrets.token_urlsafe())
 
     def job_notes_get(self, job_number: str) -> str:
         sql = """
@@ -124,6 +249,16 @@ class AppDatabase(fort.SQLiteDatabase):
             return row["notes"]
         return ""
 
+    def job_notes_get_many(self, job_numbers: Iterable[str]) -> dict[str, str]:
+        """Get notes for many jobs in one query, jobs without notes are left out"""
+        sql = """
+            select job_number, notes
+            from job_notes
+            where job_number in (select value from json_each(:job_numbers))
+        """
+        params = {"job_numbers": json.dumps(list(set(job_numbers)))}
+        return {row["job_number"]: row["notes"] for row in self.q(sql, params)}
+
     def job_notes_update(self, job_number: str, notes: str) -> None:
         sql = """
             insert into job_notes (job_number, notes) values (:job_number, :notes)
@@ -131,6 +266,12 @@ class AppDatabase(fort.SQLiteDatabase):
         """
         params = {"job_number": job_number, "notes": notes}
         self.u(sql, params)
+        self.set_setting("job-notes-version", secrets.token_urlsafe())
+
+    @property
+    def job_notes_version(self) -> str | None:
+        """Changes every time job notes change, so cached exports with notes expire"""
+        return self.get_setting("job-notes-version")
 
     def lock_page(self, session_id: str, page_key: str) -> None:
         sql = """
@@ -221,6 +362,153 @@ class AppDatabase(fort.SQLiteDatabase):
                 add column quote_sent_date datetime
             """)
             self.add_schema_version(5)
+        if self.version < 6:
+            self.log.info("Migrating database to schema version 6")
+            self.u("""
+                alter table unlocked_pages add column expires_at int
+            """)
+            self.u(
+                """
+                    update unlocked_pages set expires_at = :expires_at
+                """,
+                {"expires_at": int(time.time()) + PAGE_UNLOCK_SECONDS},
+            )
+            self.u("""
+                delete from unlocked_pages
+                where rowid not in (
+                    select min(rowid) from unlocked_pages group by session_id, page_key
+                )
+            """)
+            self.u("""
+                create unique index unlocked_pages_session_id_page_key
+                on unlocked_pages (session_id, page_key)
+            """)
+            self.u("""
+                create index unlocked_pages_expires_at on unlocked_pages (expires_at)
+            """)
+            self.add_schema_version(6)
+        if self.version < 7:
+            self.log.info("Migrating database to schema version 7")
+            self.u("""
+                alter table paperless_parts_quote_details
+                add column payload_hash text
+            """)
+            self.add_schema_version(7)
+        if self.version < 8:
+            self.log.info("Migrating database to schema version 8")
+            self.u("""
+                delete from paperless_parts_quote_details
+                where rowid not in (
+                    select max(rowid) from paperless_parts_quote_details
+                    group by quote_number, ifnull(revision_number, -1)
+                )
+            """)
+            # a quote without revisions has a null revision_number, which a plain
+            # unique index would not compare as equal
+            self.u("""
+                create unique index paperless_parts_quote_details_quote_revision
+                on paperless_parts_quote_details (
+                    quote_number, ifnull(revision_number, -1)
+                )
+            """)
+            self.u("""
+                create index paperless_parts_quote_items_quote_revision
+                on paperless_parts_quote_items (quote_number, revision)
+            """)
+            self.u("""
+                create index paperless_parts_quote_items_quote_sent_date
+                on paperless_parts_quote_items (quote_sent_date)
+            """)
+            self.add_schema_version(8)
+        if self.version < 9:
+            self.log.info("Migrating database to schema version 9")
+            self.u("""
+                create table paperless_parts_payloads (
+                    payload_hash text primary key,
+                    payload blob not null,
+                    size int not null
+                )
+            """)
+            sql = """
+                select rowid, payload, payload_hash from paperless_parts_quote_details
+            """
+            for r in self.q(sql):
+                payload = json.loads(r["payload"])
+                payload_hash = r["payload_hash"]
+                if payload_hash is None:
+                    payload_hash = paperless.payload_hash(payload)
+                    sql = """
+                        update paperless_parts_quote_details
+                        set payload_hash = :payload_hash where rowid = :rowid
+                    """
+                    self.u(sql, {"payload_hash": payload_hash, "rowid": r["rowid"]})
+                self.paperless_parts_payloads_insert([(payload, payload_hash)])
+            self.u("""
+                alter table paperless_parts_quote_details drop column payload
+            """)
+            self.add_schema_version(9)
+        if self.version < 10:
+            self.log.info("Migrating database to schema version 10")
+            self.u("""
+                create table paperless_parts_sync_runs (
+                    started_at datetime,
+                    duration real,
+                    status text,
+                    listed int,
+                    skipped int,
+                    fetched int,
+                    written int,
+                    unchanged int,
+                    failed int,
+                    requests int,
+                    error text
+                )
+            """)
+            self.add_schema_version(10)
+        if self.version < 11:
+            self.log.info("Migrating database to schema version 11")
+            self.u("""
+                alter table paperless_parts_quote_items
+                add column part_entered_date datetime
+            """)
+            self.u("""
+                alter table paperless_parts_quote_items add column new_part bool
+            """)
+            self.add_schema_version(11)
+        if self.version < 12:
+            self.log.info("Migrating database to schema version 12")
+            self.u("""
+                alter table paperless_parts_quote_items
+                add column classified_at datetime
+            """)
+            # items classified before this version are not checked again
+            sql = """
+                update paperless_parts_quote_items
+                set classified_at = :classified_at
+                where new_part is not null
+            """
+            self.u(sql, {"classified_at": dt.datetime.now(dt.UTC)})
+            self.add_schema_version(12)
+
+    @property
+    def page_unlocks_epoch(self) -> str | None:
+        """Changes every time unlocks are revoked, so sessions know to reload theirs"""
+        return self.get_setting("page-unlocks-epoch")
+
+    def page_unlocks_prune(self) -> int:
+        """Delete expired page unlocks"""
+        sql = """
+            delete from unlocked_pages where expires_at <= :now
+        """
+        params = {"now": int(time.time())}
+        return self.u(sql, params)
+
+    def page_unlocks_revoke(self) -> None:
+        """Lock every page again for every session"""
+        self.u("""
+            delete from unlocked_pages
+        """)
+        self.set_setting("page-unlocks-epoch", secrets.token_urlsafe())
 
     @property
     def paperless_parts_api_key(self) -> str:
@@ -230,11 +518,71 @@ class AppDatabase(fort.SQLiteDatabase):
     def paperless_parts_api_key(self, value: str) -> None:
         self.set_setting("paperless-parts-api-key", value)
 
+    def paperless_parts_payloads_insert(
+        self, payloads: Iterable[tuple[dict, str]]
+    ) -> None:
+        """Add payloads to the payload store, from pairs of a payload and its hash
+
+        The store holds each payload once, compressed, no matter how many quotes
+        refer to it.
+        """
+        sql = """
+            insert into paperless_parts_payloads (payload_hash, payload, size)
+            values (:payload_hash, :payload, :size)
+            on conflict (payload_hash) do nothing
+        """
+        params = []
+        for payload, payload_hash in payloads:
+            content = json.dumps(payload).encode()
+            params.append(
+                {
+                    "payload_hash": payload_hash,
+                    "payload": zlib.compress(content, PAYLOAD_COMPRESSION_LEVEL),
+                    "size": len(content),
+                }
+            )
+        self.b(sql, params)
+
+    def paperless_parts_payloads_prune(self) -> int:
+        """Delete payloads that no quote refers to anymore, and return how many
+
+        If that leaves much of the database file empty, the file is vacuumed to give
+        the space back.
+        """
+        sql = """
+            delete from paperless_parts_payloads
+            where payload_hash not in (
+                select payload_hash from paperless_parts_quote_details
+                where payload_hash is not null
+            )
+        """
+        deleted = self.u(sql)
+        free_pages = self.q_val("pragma freelist_count")
+        if free_pages > self.q_val("pragma page_count") * VACUUM_FREE_FRACTION:
+            self.log.info(f"Vacuuming the database to free {free_pages} pages")
+            self.u("vacuum")
+        return deleted
+
+    def paperless_parts_payloads_stats(self) -> dict:
+        sql = """
+            select
+                count(*) payloads, ifnull(sum(size), 0) bytes,
+                ifnull(sum(length(payload)), 0) stored_bytes
+            from paperless_parts_payloads
+        """
+        return dict(self.q_one(sql))
+
     def paperless_parts_quote_details_delete_all(self) -> None:
         sql = """
             delete from paperless_parts_quote_details
         """
         self.u(sql)
+        sql = """
+            delete from paperless_parts_payloads
+        """
+        self.u(sql)
+        # the next sync starts over from the first quote
+        self.paperless_parts_watermark = None
 
     def paperless_parts_quote_details_get(
         self, quote_number: int, revision_number: int | None
@@ -247,7 +595,7 @@ class AppDatabase(fort.SQLiteDatabase):
             )
         sql = f"""
             select
-                created, due_date, id, payload, quote_notes, quote_number,
+                created, due_date, id, payload_hash, quote_notes, quote_number,
                 revision_number, sent_date, uuid
             from paperless_parts_quote_details
             where {where_clause}
@@ -264,46 +612,82 @@ class AppDatabase(fort.SQLiteDatabase):
         """
         return self.q_one(sql)
 
-    def paperless_parts_quote_details_insert(self, payload: dict) -> None:
+    def paperless_parts_quote_details_list_for_quote(self, quote_number: int) -> list:
+        sql = """
+            select
+                d.created, d.due_date, d.id, p.payload, d.quote_notes, d.quote_number,
+                d.revision_number, d.sent_date, d.uuid
+            from paperless_parts_quote_details d
+            join paperless_parts_payloads p on p.payload_hash = d.payload_hash
+            where d.quote_number = :quote_number
+            order by d.revision_number nulls first
+        """
+        params = {"quote_number": quote_number}
+        return [
+            {**r, "payload": zlib.decompress(r["payload"]).decode()}
+            for r in self.q(sql, params)
+        ]
+
+    def paperless_parts_quote_details_upsert(
+        self, payloads: Iterable[tuple[dict, str | None]]
+    ) -> None:
+        """Insert quotes, or replace the ones already stored, from pairs of a quote
+        payload and its hash
+
+        The payload itself goes to the payload store, under its hash.
+        """
+        payloads = list(payloads)
+        self.paperless_parts_payloads_insert(payloads)
         sql = """
             insert into paperless_parts_quote_details (
-                created, due_date, id, payload, quote_notes, quote_number,
+                created, due_date, id, payload_hash, quote_notes, quote_number,
                 revision_number, sent_date, uuid
             ) values (
-                :created, :due_date, :id, :payload, :quote_notes, :quote_number,
+                :created, :due_date, :id, :payload_hash, :quote_notes, :quote_number,
                 :revision_number, :sent_date, :uuid
             )
+            on conflict (quote_number, ifnull(revision_number, -1)) do update set
+                created = excluded.created, due_date = excluded.due_date,
+                id = excluded.id, payload_hash = excluded.payload_hash,
+                quote_notes = excluded.quote_notes, sent_date = excluded.sent_date,
+                uuid = excluded.uuid
         """
-        params = {
-            "created": payload["created"],
-            "due_date": payload["due_date"],
-            "id": payload["id"],
-            "payload": json.dumps(payload),
-            "quote_notes": payload["quote_notes"],
-            "quote_number": payload["number"],
-            "revision_number": payload["revision_number"],
-            "sent_date": payload["sent_date"],
-            "uuid": payload["uuid"],
-        }
-        self.u(sql, params)
+        params = [
+            {
+                "created": payload["created"],
+                "due_date": payload["due_date"],
+                "id": payload["id"],
+                "payload_hash": payload_hash,
+                "quote_notes": payload["quote_notes"],
+                "quote_number": payload["number"],
+                "revision_number": payload["revision_number"],
+                "sent_date": payload["sent_date"],
+                "uuid": payload["uuid"],
+            }
+            for payload, payload_hash in payloads
+        ]
+        self.b(sql, params)
 
-    def paperless_parts_quote_details_list_for_quote(self, quote_number: int) -> list:
+    def paperless_parts_quote_items_classify(self, items: Iterable[dict]) -> None:
+        """Save whether quote items were for new parts, from dicts with the rowid of
+        each item, the date its part was entered in E2, and new_part"""
         sql = """
-            select
-                created, due_date, id, payload, quote_notes, quote_number,
-                revision_number, sent_date, uuid
-            from paperless_parts_quote_details
-            where quote_number = :quote_number
-            order by revision_number nulls first
+            update paperless_parts_quote_items
+            set
+                part_entered_date = :part_entered_date, new_part = :new_part,
+                classified_at = :classified_at
+            where rowid = :rowid
         """
-        params = {"quote_number": quote_number}
-        return self.q(sql, params)
+        classified_at = dt.datetime.now(dt.UTC)
+        self.b(sql, [{**item, "classified_at": classified_at} for item in items])
 
     def paperless_parts_quote_items_parts_in_range(
         self, start_date: dt.date, end_date: dt.date
     ) -> list[dict]:
         sql = """
-            select quote_number, revision, part_number, quote_sent_date
+            select
+                quote_number, revision, part_number, quote_sent_date,
+                part_entered_date, new_part
             from paperless_parts_quote_items
             where part_number is not null
             and quote_sent_date > :start_date
@@ -319,26 +703,18 @@ class AppDatabase(fort.SQLiteDatabase):
                 "quote_sent_date": dt.datetime.fromisoformat(
                     r["quote_sent_date"]
                 ).astimezone(ZoneInfo("America/Chicago")),
+                "part_entered_date": (
+                    None
+                    if r["part_entered_date"] is None
+                    else dt.datetime.fromisoformat(r["part_entered_date"])
+                ),
+                "new_part": r["new_part"],
             }
             for r in self.q(sql, params)
         ]
 
-    def paperless_parts_quote_items_reset(
-        self, quote_number: int, quote_revision: int | None
-    ) -> None:
-        if quote_revision is None:
-            rev_condition = "is null"
-        else:
-            rev_condition = "= :revision"
-        sql = f"""
-            delete from paperless_parts_quote_items
-            where quote_number = :quote_number and revision {rev_condition}
-        """  # noqa: S608
-        params = {"quote_number": quote_number, "revision": quote_revision}
-        self.u(sql, params)
-
     def paperless_parts_quote_items_insert(
-        self, params: PaperlessPartsQuoteItemsDict
+        self, items: Iterable[PaperlessPartsQuoteItemsDict]
     ) -> None:
         sql = """
             insert into paperless_parts_quote_items (
@@ -349,7 +725,41 @@ class AppDatabase(fort.SQLiteDatabase):
                 :quote_sent_date
             )
         """
-        self.u(sql, params)  # ty:ignore[invalid-argument-type]
+        self.b(sql, list(items))  # ty:ignore[invalid-argument-type]
+
+    def paperless_parts_quote_items_reset(
+        self, quotes: Iterable[tuple[int, int | None]]
+    ) -> None:
+        """Delete the items of quotes, from pairs of quote number and revision"""
+        sql = """
+            delete from paperless_parts_quote_items
+            where quote_number = :quote_number and revision is :revision
+        """
+        params = [
+            {"quote_number": quote_number, "revision": revision}
+            for quote_number, revision in quotes
+        ]
+        self.b(sql, params)
+
+    def paperless_parts_quote_items_unclassified(
+        self, recheck_since: dt.datetime
+    ) -> list[dict]:
+        """Get quote items that were never classified as for a new part or not, and
+        items sent after recheck_since for parts that were not in E2 yet when they
+        were"""
+        sql = """
+            select rowid, part_number, quote_sent_date
+            from paperless_parts_quote_items
+            where part_number is not null
+            and (
+                classified_at is null
+                or (
+                    part_entered_date is null
+                    and datetime(quote_sent_date) > datetime(:recheck_since)
+                )
+            )
+        """
+        return self.q(sql, {"recheck_since": recheck_since})
 
     def paperless_parts_quote_revisions_insert(
         self, quote_number: int, revision_number: int | None
@@ -371,6 +781,40 @@ class AppDatabase(fort.SQLiteDatabase):
         """
         return self.q(sql)
 
+    def paperless_parts_sync_runs_insert(self, params: dict) -> None:
+        sql = """
+            insert into paperless_parts_sync_runs (
+                started_at, duration, status, listed, skipped, fetched, written,
+                unchanged, failed, requests, error
+            ) values (
+                :started_at, :duration, :status, :listed, :skipped, :fetched, :written,
+                :unchanged, :failed, :requests, :error
+            )
+        """
+        self.u(sql, params)
+
+    def paperless_parts_sync_runs_list(self, limit: int = 10) -> list[dict]:
+        """Get the most recent sync runs, newest first"""
+        sql = """
+            select
+                started_at, duration, status, listed, skipped, fetched, written,
+                unchanged, failed, requests, error
+            from paperless_parts_sync_runs
+            order by started_at desc
+            limit :limit
+        """
+        return self.q(sql, {"limit": limit})
+
+    @property
+    def paperless_parts_watermark(self) -> dict | None:
+        """The last quote that a Paperless Parts sync has processed, and every quote
+        sent before it: its quote_number, revision_number and sent_date"""
+        return json.loads(self.get_setting("paperless-parts-watermark") or "null")
+
+    @paperless_parts_watermark.setter
+    def paperless_parts_watermark(self, value: dict | None) -> None:
+        self.set_setting("paperless-parts-watermark", json.dumps(value))
+
     @property
     def secret_key(self) -> bytes:
         return bytes.fromhex(self.get_setting("secret-key"))
@@ -387,18 +831,46 @@ class AppDatabase(fort.SQLiteDatabase):
         """
         params = {"setting_id": setting_id, "setting_value": setting_value}
         self.u(sql, params)
+        if self._settings_cache is not None:
+            self._settings_cache.invalidate()
 
-    def unlock_page(self, session_id: str, page_key: str) -> None:
-        self.lock_page(session_id, page_key)
+    @property
+    def settings(self) -> dict[str, str]:
+        """Get all settings, from the in-process cache when it is up to date"""
+        if self._settings_cache is None:
+            sql = """
+                select setting_id, setting_value from settings
+            """
+            return {r["setting_id"]: r["setting_value"] for r in self.q(sql)}
+        return self._settings_cache.get(self)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Run the statements in the block in one transaction, and commit them all or
+        none of them"""
+        self.cnx.execute("begin immediate")
+        try:
+            yield
+            self.cnx.execute("commit")
+        except BaseException:
+            if self.cnx.in_transaction:
+                self.cnx.execute("rollback")
+            raise
+
+    def unlock_page(self, session_id: str, page_key: str) -> int:
+        """Unlock a page for a session, and return when the unlock expires"""
         sql = """
-            insert into unlocked_pages (session_id, page_key)
-            values (:session_id, :page_key)
+            insert into unlocked_pages (session_id, page_key, expires_at)
+            values (:session_id, :page_key, :expires_at)
+            on conflict (session_id, page_key) do update set expires_at = :expires_at
         """
         params = {
+            "expires_at": int(time.time()) + PAGE_UNLOCK_SECONDS,
             "page_key": page_key,
             "session_id": session_id,
         }
         self.u(sql, params)
+        return params["expires_at"]
 
     @property
     def version(self) -> int:
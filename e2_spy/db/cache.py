@@ -0,0 +1,173 @@
+import collections
+import dataclasses
+import datetime as dt
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class _Entry:
+    report: str
+    value: typing.Any
+    expires: float
+    size: int
+
+
+def _sizeof(value: typing.Any) -> int:  # noqa: ANN401
+    """Roughly estimate the memory used by a query result"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    elif isinstance(value, list | tuple):
+        size += sum(_sizeof(v) for v in value)
+    return size
+
+
+def _normalize(value: typing.Any) -> typing.Hashable:  # noqa: ANN401
+    """Turn a report parameter into a hashable value that is the same for equivalent
+    parameters
+
+    Sets are unordered, so {'b', 'a'} and {'a', 'b'} share a cache entry. Lists and
+    tuples keep their order, a cursor like (date, job_number) means something else
+    with its values the other way around.
+    """
+    if isinstance(value, set | frozenset):
+        return tuple(sorted((_normalize(v) for v in value), key=repr))
+    if isinstance(value, list | tuple):
+        return tuple(_normalize(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    if isinstance(value, dt.date):
+        return value.isoformat()
+    return value
+
+
+class ResultCache:
+    """An in-process TTL + LRU cache for query results with a memory budget"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: collections.OrderedDict[tuple, _Entry] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._evictions = 0
+        self._hits: collections.Counter[str] = collections.Counter()
+        self._misses: collections.Counter[str] = collections.Counter()
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def get(self, key: tuple, report: str) -> tuple[bool, typing.Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses[report] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._hits[report] += 1
+            return True, entry.value
+
+    def put(self, key: tuple, report: str, value: typing.Any, ttl: float) -> None:  # noqa: ANN401
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            log.debug(f"Not caching {report} result of {size} bytes")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(report, value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def flush(self, report: str | None = None) -> int:
+        """Remove all entries, or all entries for one report, and return how many
+        entries were removed"""
+        with self._lock:
+            keys = [
+                k
+                for k, e in self._entries.items()
+                if report is None or e.report == report
+            ]
+            for k in keys:
+                self._remove(k)
+        log.info(f"Flushed {len(keys)} cached results for {report or 'all reports'}")
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = collections.Counter(e.report for e in self._entries.values())
+            reports = sorted(set(self._hits) | set(self._misses) | set(entries))
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "entries": len(self._entries),
+                "evictions": self._evictions,
+                "hits": self._hits.total(),
+                "misses": self._misses.total(),
+                "reports": {
+                    r: {
+                        "entries": entries[r],
+                        "hits": self._hits[r],
+                        "misses": self._misses[r],
+                    }
+                    for r in reports
+                },
+            }
+
+
+result_cache = ResultCache(max_bytes=64 * 1024 * 1024)
+
+
+def cached(ttl: float, filters: typing.Iterable[str] = ()) -> typing.Callable:
+    """Cache the results of an E2Database report method for ttl seconds
+
+    Results are keyed by the database the method ran against, the qualified method
+    name, and the normalized arguments, so a report served from the mirror is cached
+    apart from the same report run against E2. filters names the arguments that are
+    lists of values to match in any order, like ['b', 'a'] for "in ('a', 'b')", which
+    are keyed as sets. Calls with stream=True are never cached.
+    """
+    filters = frozenset(filters)
+
+    def decorator(f: typing.Callable) -> typing.Callable:
+        signature = inspect.signature(f)
+
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):  # noqa: ANN001, ANN002, ANN003, ANN202
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            del params["self"]
+            if params.pop("stream", False):
+                return f(self, *args, **kwargs)
+            for name in filters & params.keys():
+                if params[name] is not None:
+                    params[name] = frozenset(params[name])
+            key = (self.cache_scope, f.__qualname__, _normalize(params))
+            hit, value = result_cache.get(key, f.__name__)
+            if not hit:
+                value = f(self, *args, **kwargs)
+                result_cache.put(key, f.__name__, value, ttl)
+            if isinstance(value, list):
+                return list(value)
+            return value
+
+        return wrapper
+
+    return decorator
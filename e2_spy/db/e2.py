@@ -1,19 +1,81 @@
+import concurrent.futures
 import contextlib
 import datetime as dt
 import decimal
+import itertools
+import json
 import logging
-import pymssql
+import time
+import typing
+from collections.abc import Iterable, Iterator
+
+from . import parts, schedule
+from .cache import cached
+from .pool import get_pool
+from .timing import caller_report, query_stats
 
 log = logging.getLogger(__name__)
 
+# how long to cache results of reports built from live data, long enough for
+# viewing a report and then exporting it to share one query
+REPORT_TTL = 2 * 60
+
+# how long to cache lists of reference data that rarely change
+REFERENCE_TTL = 15 * 60
+
+# how many part numbers to look up in one query for part dates
+PART_DATES_CHUNK_SIZE = 1000
+
+# how many independent queries for a page can run at the same time, across all
+# requests; each running query checks out its own pooled connection
+QUERY_THREADS = 4
+
+# patterns that select the GL accounts of each department for an income statement
+DEPARTMENT_GL_PATTERNS = {
+    "shop": "%.1%",
+    "processing": "%.2%",
+    "manufacturing": "%.6%",
+    "quality": "%.7%",
+    "sales": "%.8%",
+    "accounting": "%.9%",
+}
+
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=QUERY_THREADS, thread_name_prefix="e2-query"
+)
+
 
 class E2Database:
     def __init__(self, cnx_details: dict) -> None:
-        self.cnx = pymssql.connect(**cnx_details, as_dict=True)
+        self.pool = get_pool(cnx_details)
+        # when the oldest copy of E2 data behind a report this instance served was
+        # taken, None while every report read E2 directly
+        self.as_of: dt.datetime | None = None
+
+    def _note_as_of(self, as_of: dt.datetime) -> None:
+        if self.as_of is None or as_of < self.as_of:
+            self.as_of = as_of
 
+    def _schedule_snapshot(self) -> schedule.ScheduleSnapshot:
+        """Get the shared schedule snapshot, and note how old its data is"""
+        snapshot = schedule.snapshots.get(self)
+        self._note_as_of(snapshot.as_of)
+        return snapshot
+
+    @property
+    def cache_scope(self) -> tuple:
+        """Identify the database that query results come from"""
+        details = self.pool.cnx_details
+        return details.get("server"), details.get("database")
+
+    @cached(ttl=REPORT_TTL, filters=("users",))
     def action_summary(
-        self, start_date: dt.date, end_date: dt.date, users: list[str]
-    ) -> list:
+        self,
+        start_date: dt.date,
+        end_date: dt.date,
+        users: list[str],
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
         sql = """
             select
                 a.action_code, a.action_id, a.completed_date,
@@ -38,22 +100,68 @@ class E2Database:
             end_date + dt.timedelta(days=1),
             users,
         )
-        return self.q(sql, params)
+        return self._rows(sql, params, stream)
 
-    def closed_jobs(self) -> list:
-        sql = """
-            select
+    @cached(ttl=REPORT_TTL)
+    def closed_jobs(
+        self,
+        after: tuple[dt.date | None, str] | None = None,
+        limit: int | None = None,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        """Get closed jobs, newest first
+
+        Pass limit to get one page, and the (date closed, job number) of the last row
+        of a page as after to get the next page.
+        """
+        top, top_params = self._top(limit)
+        after_filter, after_params = self._closed_after("od", after)
+        sql = f"""
+            select {top}
                 oh.customer_code, oh.customer_po_number, od.date_closed, od.job_number,
                 oh.order_number, od.part_description, od.part_number
             from order_detail od
             left join order_header oh on oh.order_header_id = od.order_header_id
             where oh.company_code = 'spmtech'
             and od.status = 'closed'
-            order by od.date_closed desc
+            {after_filter}
+            order by cast(od.date_closed as date) desc, od.job_number desc
+        """  # noqa: S608
+        return self._rows(sql, top_params + after_params, stream)
+
+    @staticmethod
+    def _closed_after(
+        alias: str, after: tuple[dt.date | None, str] | None
+    ) -> tuple[str, tuple]:
+        """Build a filter for the rows after a (date closed, job number) keyset cursor,
+        for reports ordered by date closed then job number, both descending"""
+        if after is None:
+            return "", ()
+        date_closed, job_number = after
+        if date_closed is None:
+            # jobs without a date closed sort last
+            return (
+                f"and {alias}.date_closed is null and {alias}.job_number < %s",
+                (job_number,),
+            )
+        sql = f"""
+            and (
+                {alias}.date_closed < %s or {alias}.date_closed is null or (
+                    {alias}.date_closed >= %s and {alias}.date_closed < %s
+                    and {alias}.job_number < %s
+                )
+            )
         """
-        return self.q(sql)
+        params = (
+            date_closed,
+            date_closed,
+            date_closed + dt.timedelta(days=1),
+            job_number,
+        )
+        return sql, params
 
-    def contacts_list(self) -> list:
+    @cached(ttl=REFERENCE_TTL)
+    def contacts_list(self, stream: bool = False) -> list | Iterator[dict]:
         sql = """
             select
                 case
@@ -72,9 +180,10 @@ class E2Database:
             and c.contact_name is not null
             order by contact_type, customer_name, vendor_name, contact_name
         """
-        return self.q(sql)
+        return self._rows(sql, stream=stream)
 
-    def customer_list(self) -> list:
+    @cached(ttl=REFERENCE_TTL)
+    def customer_list(self, stream: bool = False) -> list | Iterator[dict]:
         sql = """
             select
                 c.customer_code,
@@ -90,33 +199,59 @@ class E2Database:
             and c.customer_code is not null
             order by c.customer_code, a.address_id
         """
-        return self.q(sql)
+        return self._rows(sql, stream=stream)
 
-    def days_since_last_activity(self) -> list:
-        sql = """
-            select
-                c.job_number, c.part_number, coalesce(c.part_description, '') as part_description, c.current_step,
-                coalesce(ns.work_center, ns.vendor_code, 'LAST STEP') next_step, c.actual_start_date, c.actual_end_date,
-                datediff(
-                    day, (select max(v) from (values (c.actual_start_date), (c.actual_end_date)) as value(v)),
-                    sysdatetime()
-                ) as days_since_last_activity
-            from (
-                select
-                    job_number, part_number, part_description, coalesce(work_center, vendor_code) current_step,
-                    actual_start_date, actual_end_date, item_number,
-                    row_number() over (partition by job_number order by item_number) z
-                from schedule_detail
-                where schedule_header_id = 50
-                and step_status in ('current', 'pending')
-            ) c
-            left join schedule_detail ns on
-                ns.schedule_header_id = 50 and ns.job_number = c.job_number and ns.item_number = c.item_number + 1
-            where z = 1
-            order by days_since_last_activity desc
+    def days_since_last_activity(self, stream: bool = False) -> list | Iterator[dict]:
+        today = dt.date.today()
+        rows = []
+        for step in self._schedule_snapshot().current_steps():
+            dates = [
+                d for d in (step["actual_start_date"], step["actual_end_date"]) if d
+            ]
+            rows.append(
+                {
+                    "job_number": step["job_number"],
+                    "part_number": step["part_number"],
+                    "part_description": step["part_description"] or "",
+                    "current_step": step["current_step"],
+                    "next_step": step["next_step"],
+                    "actual_start_date": step["actual_start_date"],
+                    "actual_end_date": step["actual_end_date"],
+                    "days_since_last_activity": (today - max(dates).date()).days
+                    if dates
+                    else None,
+                }
+            )
+        rows.sort(
+            key=lambda r: (
+                r["days_since_last_activity"] is None,
+                -(r["days_since_last_activity"] or 0),
+            )
+        )
+        return iter(rows) if stream else rows
+
+    def gather(self, *calls: typing.Callable[[], typing.Any]) -> list:
+        """Run independent queries at the same time on separate connections
+
+        Each call is a function that takes no arguments, usually a functools.partial
+        of a report method. Returns the results in the same order as the calls once
+        all of them have finished.
         """
-        return self.q(sql)
+        if len(calls) < 2:
+            return [c() for c in calls]
+        futures = [_executor.submit(c) for c in calls]
+        return [f.result() for f in futures]
 
+    def gather_as_completed(
+        self, calls: dict[str, typing.Callable[[], typing.Any]]
+    ) -> Iterator[tuple[str, typing.Any]]:
+        """Run independent queries at the same time on separate connections, and
+        yield the name of each call with its result as soon as that query finishes"""
+        futures = {_executor.submit(c): name for name, c in calls.items()}
+        for f in concurrent.futures.as_completed(futures):
+            yield futures[f], f.result()
+
+    @cached(ttl=REFERENCE_TTL)
     def get_departments_list(self) -> list[str]:
         sql = """
             select distinct department_name
@@ -126,6 +261,7 @@ class E2Database:
         """
         return [row.get("department_name") for row in self.q(sql)]
 
+    @cached(ttl=REFERENCE_TTL)
     def get_followup_user_code_list(self) -> list[str]:
         sql = """
             select distinct followup_by_user_code
@@ -135,53 +271,56 @@ class E2Database:
         """
         return [row.get("followup_by_user_code") for row in self.q(sql)]
 
-    def get_loading_summary(self, departments: list[str]) -> list:
-        sql = """
-            select
-                sd.department_name, sd.job_number, sd.work_center, sd.priority, sd.part_number, sd.part_description,
-                sd.quantity_to_make, sd.quantity_open, sd.scheduled_start_date start_date,
-                sd.scheduled_end_date end_date, sd.due_date,
-                coalesce(ns.work_center, ns.vendor_code, 'LAST STEP') next_step
-            from (
-                select
-                    department_name, due_date, item_number, job_number,
-                    part_description, part_number, priority, quantity_open,
-                    quantity_to_make, schedule_job_id, scheduled_end_date,
-                    scheduled_start_date, step_number, work_center,
-                    row_number() over (partition by job_number order by item_number) z
-                from schedule_detail
-                where schedule_header_id = 50
-                and department_name in %s
-                and scheduled_start_date < %s
-                and step_status in ('current', 'pending')) sd
-            left join schedule_detail ns
-                on ns.schedule_job_id = sd.schedule_job_id
-                and ns.item_number = sd.item_number + 1
-            where z = 1
-            order by priority
-        """
-        params = (departments, dt.date.today() + dt.timedelta(days=1))
-        return self.q(sql, params)
+    def get_loading_summary(
+        self, departments: list[str], stream: bool = False
+    ) -> list | Iterator[dict]:
+        departments = {d.casefold() for d in departments}
+        tomorrow = dt.date.today() + dt.timedelta(days=1)
+
+        def match(step: dict) -> bool:
+            return (
+                (step["department_name"] or "").casefold() in departments
+                and step["scheduled_start_date"] is not None
+                and step["scheduled_start_date"].date() < tomorrow
+            )
+
+        rows = [
+            {
+                "department_name": step["department_name"],
+                "job_number": step["job_number"],
+                "work_center": step["work_center"],
+                "priority": step["priority"],
+                "part_number": step["part_number"],
+                "part_description": step["part_description"],
+                "quantity_to_make": step["quantity_to_make"],
+                "quantity_open": step["quantity_open"],
+                "start_date": step["scheduled_start_date"],
+                "end_date": step["scheduled_end_date"],
+                "due_date": step["due_date"],
+                "next_step": step["next_step"],
+            }
+            for step in self._schedule_snapshot().first_steps(match)
+        ]
+        rows.sort(key=lambda r: (r["priority"] is not None, r["priority"] or 0))
+        return iter(rows) if stream else rows
 
-    def gl_accounts_list(self) -> list:
+    @cached(ttl=REFERENCE_TTL)
+    def gl_accounts_list(self, stream: bool = False) -> list | Iterator[dict]:
         sql = """
             select gl_account, description, gl_group_code, account_type
             from gl_account
             where company_code = 'spmtech'
         """
-        return self.q(sql)
+        return self._rows(sql, stream=stream)
 
+    @cached(ttl=REPORT_TTL)
     def income_statement(
-        self, department: str, start_date: dt.date, end_date: dt.date
-    ) -> list:
-        department_patterns = {
-            "shop": "%.1%",
-            "processing": "%.2%",
-            "manufacturing": "%.6%",
-            "quality": "%.7%",
-            "sales": "%.8%",
-            "accounting": "%.9%",
-        }
+        self,
+        department: str,
+        start_date: dt.date,
+        end_date: dt.date,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
         start_period = start_date.strftime("%Y%m")
         end_period = end_date.strftime("%Y%m")
         if department == "~all":
@@ -189,7 +328,11 @@ class E2Database:
             params = (start_period, end_period)
         else:
             gl_account_filter = "where gl_account like %s"
-            params = (department_patterns.get(department), start_period, end_period)
+            params = (
+                DEPARTMENT_GL_PATTERNS.get(department),
+                start_period,
+                end_period,
+            )
         sql = f"""
             with a as (
                 select
@@ -211,14 +354,16 @@ class E2Database:
             left join b on b.gl_account_id = a.gl_account_id
             order by a.gl_account
         """  # noqa: S608
-        return self.q(sql, params)
+        return self._rows(sql, params, stream)
 
+    @cached(ttl=REPORT_TTL, filters=("product_codes",))
     def inventory_count_sheet(
         self,
         product_codes: list[str],
         include_active_parts: bool = True,
         include_inactive_parts: bool = True,
-    ):
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
         where_clause = "where p.company_code = 'spmtech' and p.part_number is not null and p.part_number <> ''"
         params = None
         if len(product_codes) > 0:
@@ -256,28 +401,44 @@ class E2Database:
             order by p.part_number, p.part_number_id
         """  # noqa: S608
 
-        return [
-            {
-                "part_number": r["part_number"],
-                "revision": r["revision"],
-                "part_active": bool(r["part_active"]),
-                "location": r["location"] or "",
-                "part_description": r["part_description"],
-                "product_code": r["product_code"],
-                "quantity": self.remove_exponent(decimal.Decimal(r["quantity"]))
-                if r["quantity"] is not None
-                else "",
-            }
-            for r in self.q(sql, params)
-        ]
+        rows = map(self._inventory_count_sheet_row, self._rows(sql, params, stream))
+        return rows if stream else list(rows)
 
+    def _inventory_count_sheet_row(self, r: dict) -> dict:
+        return {
+            "part_number": r["part_number"],
+            "revision": r["revision"],
+            "part_active": bool(r["part_active"]),
+            "location": r["location"] or "",
+            "part_description": r["part_description"],
+            "product_code": r["product_code"],
+            "quantity": self.remove_exponent(decimal.Decimal(r["quantity"]))
+            if r["quantity"] is not None
+            else "",
+        }
+
+    @cached(ttl=REPORT_TTL)
     def job_performance(
-        self, start_date: dt.date, end_date: dt.date, get_all: bool = False
-    ):
+        self,
+        start_date: dt.date,
+        end_date: dt.date,
+        get_all: bool = False,
+        after: tuple[dt.date | None, str] | None = None,
+        limit: int | None = None,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        """Get closed jobs with estimated and actual hours, newest first
+
+        Pages the same way as closed_jobs.
+        """
+        top, params = self._top(limit)
         if get_all:
             date_closed_filter = ""
         else:
             date_closed_filter = "and cast(o.date_closed as date) between %s and %s"
+            params += (start_date, end_date)
+        after_filter, after_params = self._closed_after("o", after)
+        params += after_params
         sql = f"""
             with h as (
                 select
@@ -289,7 +450,7 @@ class E2Database:
                 and status in ('Current', 'Finished')
                 group by order_detail_id
             )
-            select
+            select {top}
                 cast(o.date_closed as date) date_closed,
                 o.job_number,
                 o.part_description,
@@ -312,15 +473,29 @@ class E2Database:
             where o.company_code = 'spmtech'
             and o.status = 'closed'
             {date_closed_filter}
-            order by o.date_closed desc
+            {after_filter}
+            order by cast(o.date_closed as date) desc, o.job_number desc
         """  # noqa: S608
-        params = (
-            start_date,
-            end_date,
+        return self._rows(sql, params, stream)
+
+    def open_sales_report(self, stream: bool = False) -> list | Iterator[dict]:
+        """Get open orders with the current step of each job
+
+        Only the orders are cached, current steps always come from the schedule
+        snapshot.
+        """
+        current_steps = {
+            step["job_number"]: step["current_step"]
+            for step in self._schedule_snapshot().current_steps()
+        }
+        rows = (
+            {**row, "current_step": current_steps.get(row["job_number"]) or ""}
+            for row in self.open_sales_orders(stream=stream)
         )
-        return self.q(sql, params)
+        return rows if stream else list(rows)
 
-    def open_sales_report(self):
+    @cached(ttl=REPORT_TTL)
+    def open_sales_orders(self, stream: bool = False) -> list | Iterator[dict]:
         sql = """
             with jpo as (
                 select
@@ -336,18 +511,6 @@ class E2Database:
                 ) j
                 left join po_header p on p.po_header_id = j.po_header_id
                 group by j.job_number
-            ),
-            jcs as (
-                select job_number, current_step
-                from (
-                    select
-                        job_number, coalesce(work_center, vendor_code) current_step,
-                        row_number() over (partition by job_number order by item_number) z
-                    from schedule_detail
-                    where schedule_header_id = 50
-                    and step_status in ('current', 'pending')
-                ) c
-                where z = 1
             )
             select
                 od.job_number,
@@ -357,7 +520,7 @@ class E2Database:
                 od.grid_parent_job_number parent_job_number,
                 od.part_number,
                 od.part_description,
-                coalesce(jcs.current_step, '') current_step,
+                '' current_step,
                 od.quantity_to_make,
                 od.quantity_open,
                 oh.customer_code,
@@ -372,39 +535,108 @@ class E2Database:
                 jpo.po_due_date
             from order_detail od
             left join order_header oh on oh.order_header_id = od.order_header_id
-            left join jcs on jcs.job_number = od.job_number
             left join schedule_job sj on sj.order_detail_id = od.order_detail_id and sj.schedule_header_id = 50
             left join jpo on jpo.job_number = od.job_number
             where od.company_code = 'spmtech'
             and od.status in ('firm', 'hold', 'in process', 'released')
             order by od.priority
         """
-        return self.q(sql)
+        return self._rows(sql, stream=stream)
 
-    def part_dates(self, part_numbers: list[str]) -> dict[str, dict]:
-        if not part_numbers:
-            return {}
-        placeholders = ", ".join(["%s"] * len(part_numbers))
-        sql = f"""
+    def open_schedule_steps(self, stream: bool = False) -> list | Iterator[dict]:
+        """Get every current or pending step in the live schedule, with the step after
+        it, ordered by job and item number
+
+        This is the source for the shared schedule snapshot, reports should read
+        schedule.snapshots instead of calling this directly.
+        """
+        sql = """
+            select
+                sd.job_number, sd.item_number, sd.department_name, sd.work_center,
+                coalesce(sd.work_center, sd.vendor_code) current_step,
+                coalesce(ns.work_center, ns.vendor_code, 'LAST STEP') next_step,
+                sd.priority, sd.part_number, sd.part_description, sd.quantity_to_make,
+                sd.quantity_open, sd.scheduled_start_date, sd.scheduled_end_date,
+                sd.due_date, sd.actual_start_date, sd.actual_end_date
+            from schedule_detail sd
+            left join schedule_detail ns on ns.schedule_header_id = 50
+                and ns.job_number = sd.job_number
+                and ns.item_number = sd.item_number + 1
+            where sd.schedule_header_id = 50
+            and sd.step_status in ('current', 'pending')
+            order by sd.job_number, sd.item_number
+        """
+        return self._rows(sql, stream=stream)
+
+    def part_dates(self, part_numbers: Iterable[str]) -> dict[str, dict]:
+        """Get the dates of many parts from the part dimension, and the ones it does
+        not have from E2, PART_DATES_CHUNK_SIZE part numbers per query
+
+        The part numbers go in as one JSON parameter, so every query has the same
+        text and E2 can reuse its plan.
+        """
+        result = {}
+        misses = sorted(set(part_numbers))
+        dimension = parts.dimensions.get(self)
+        if dimension is not None:
+            for part_number in misses:
+                part = dimension.by_number.get(part_number)
+                if part is not None:
+                    result[part_number] = part.dates
+            misses = [pn for pn in misses if pn not in result]
+        sql = """
             select
-                part_number,
-                revision_date,
-                date_routed,
-                entered_date at time zone 'Central Standard Time' as entered_date
+                p.part_number,
+                p.revision_date,
+                p.date_routed,
+                p.entered_date at time zone 'Central Standard Time' as entered_date
+            from part_number p
+            join openjson(%s) with (part_number varchar(100) '$') j
+            on j.part_number = p.part_number
+        """
+        for chunk in itertools.batched(misses, PART_DATES_CHUNK_SIZE):
+            for row in self.q(sql, (json.dumps(chunk),)):
+                result[row.get("part_number")] = {
+                    "entered_date": row.get("entered_date"),
+                    "revision_date": row.get("revision_date"),
+                    "routed_date": row.get("date_routed"),
+                }
+        return result
+
+    def part_number_checksums(self) -> dict[int, int]:
+        """Get a checksum of the columns the part dimension keeps, for every part"""
+        sql = """
+            select
+                part_number_id,
+                binary_checksum(
+                    part_number, company_code, description, product_code, active,
+                    entered_date, revision_date, date_routed
+                ) checksum
             from part_number
-            where part_number in ({placeholders})
         """
-        log.debug(sql)
-        log.debug(part_numbers)
-        return {
-            row.get("part_number"): {
-                "entered_date": row.get("entered_date"),
-                "revision_date": row.get("revision_date"),
-                "routed_date": row.get("date_routed"),
-            }
-            for row in self.q(sql, tuple(part_numbers))
-        }
+        return {r["part_number_id"]: r["checksum"] for r in self.q_iter(sql)}
+
+    def part_number_rows(
+        self, part_number_ids: list[int] | None = None
+    ) -> Iterator[dict]:
+        """Stream the columns the part dimension keeps, for some parts or all of them"""
+        columns = """
+            p.part_number_id, p.part_number, p.company_code, p.description,
+            p.product_code, p.active, p.revision_date, p.date_routed,
+            p.entered_date at time zone 'Central Standard Time' as entered_date
+        """
+        if part_number_ids is None:
+            sql = f"select {columns} from part_number p"  # noqa: S608
+            return self.q_iter(sql)
+        sql = f"""
+            select {columns}
+            from part_number p
+            join openjson(%s) with (part_number_id int '$') j
+            on j.part_number_id = p.part_number_id
+        """  # noqa: S608
+        return self.q_iter(sql, (json.dumps(part_number_ids),))
 
+    @cached(ttl=REFERENCE_TTL)
     def period_list(self, start_date: dt.date, end_date: dt.date):
         start_period = start_date.strftime("%Y%m")
         end_period = end_date.strftime("%Y%m")
@@ -417,7 +649,11 @@ class E2Database:
         params = (start_period, end_period)
         return [row.get("period_number") for row in self.q(sql, params)]
 
+    @cached(ttl=REFERENCE_TTL)
     def product_codes(self):
+        dimension = parts.dimensions.get(self)
+        if dimension is not None:
+            return dimension.product_codes
         sql = """
             select distinct product_code
             from part_number
@@ -426,18 +662,104 @@ class E2Database:
         """
         return [row["product_code"] for row in self.q(sql)]
 
-    def q(self, sql: str, params: tuple | None = None):
+    def q(self, sql: str, params: tuple | None = None) -> list[dict]:
         if params is None:
             params = tuple()
-        with contextlib.closing(self.cnx.cursor()) as cur:
+        report = caller_report()
+        with self.pool.connection() as cnx, contextlib.closing(cnx.cursor()) as cur:
+            start = time.perf_counter()
             cur.execute(sql, params)
-            return cur.fetchall()
+            executed = time.perf_counter()
+            rows = cur.fetchall()
+            fetched = time.perf_counter()
+        query_stats.record(
+            report, sql, params, executed - start, fetched - executed, len(rows)
+        )
+        return rows
+
+    def q_iter(
+        self, sql: str, params: tuple | None = None, batch_size: int = 1000
+    ) -> Iterator[dict]:
+        """Execute a query and yield rows as they are fetched, batch_size at a time
+
+        The connection is held until the generator is exhausted or closed. A connection
+        that is given back before all rows were read is discarded rather than reused.
+        """
+        if params is None:
+            params = tuple()
+        return self._q_gen(sql, params, batch_size, caller_report())
+
+    def _q_gen(
+        self, sql: str, params: tuple, batch_size: int, report: str
+    ) -> Iterator[dict]:
+        pc = self.pool.acquire()
+        exhausted = False
+        execute_seconds = fetch_seconds = 0.0
+        row_count = 0
+        try:
+            with contextlib.closing(pc.cnx.cursor()) as cur:
+                start = time.perf_counter()
+                cur.execute(sql, params)
+                execute_seconds = time.perf_counter() - start
+                while True:
+                    start = time.perf_counter()
+                    rows = cur.fetchmany(batch_size)
+                    fetch_seconds += time.perf_counter() - start
+                    if not rows:
+                        break
+                    row_count += len(rows)
+                    yield from rows
+            exhausted = True
+        finally:
+            self.pool.release(pc, discard=not exhausted)
+            query_stats.record(
+                report, sql, params, execute_seconds, fetch_seconds, row_count
+            )
+
+    def _rows(
+        self, sql: str, params: tuple | None = None, stream: bool = False
+    ) -> list[dict] | Iterator[dict]:
+        if stream:
+            return self.q_iter(sql, params)
+        return self.q(sql, params)
 
     def remove_exponent(self, d):
         return d.quantize(decimal.Decimal(1)) if d == d.to_integral() else d.normalize()
 
-    def sales_summary(self, start_date: dt.date, end_date: dt.date):
-        sql = """
+    @cached(ttl=REPORT_TTL)
+    def sales_summary(
+        self,
+        start_date: dt.date,
+        end_date: dt.date,
+        after: str | None = None,
+        limit: int | None = None,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        """Get invoice lines in a date range, ordered by invoice number
+
+        Pass limit to get the lines for that many invoices, and the last invoice
+        number of a page as after to get the next page. Pages always hold whole
+        invoices.
+        """
+        invoice_filter = "and cast(bh.invoice_date as date) between %s and %s"
+        params = (start_date, end_date)
+        if limit is not None:
+            after_filter = ""
+            if after is not None:
+                after_filter = "and invoice_number > %s"
+                params += (after,)
+            invoice_filter = f"""
+                and bh.invoice_number in (
+                    select top (%s) invoice_number
+                    from billing_header
+                    where company_code = 'spmtech' and invoice_number is not null
+                    and cast(invoice_date as date) between %s and %s
+                    {after_filter}
+                    order by invoice_number
+                )
+            """  # noqa: S608
+            params = (limit, *params)
+        sql = f"""
             select
                 bh.invoice_number,
                 cast(bh.invoice_date as date) invoice_date,
@@ -465,41 +787,40 @@ class E2Database:
                 and ad.account_type in ('miscellaneous charge', 'total')
             left join gl_account ga on ga.gl_account = ad.gl_account
             where bh.company_code = 'spmtech' and bh.invoice_number is not null
-            and cast(bh.invoice_date as date) between %s and %s
+            {invoice_filter}
             order by bh.invoice_number, bd.item_number
-        """
-        params = (
-            start_date,
-            end_date,
-        )
-        return [
-            {
-                "invoice_number": r["invoice_number"],
-                "invoice_date": r["invoice_date"],
-                "period": r["period"],
-                "customer_code": r["customer_code"],
-                "customer_name": r["customer_name"],
-                "job_number": r["job_number"],
-                "market": r["market"],
-                "part_number": r["part_number"],
-                "revision": r["revision"],
-                "qty_ordered": int(r["qty_ordered"]),
-                "qty_shipped": int(r["qty_shipped"]),
-                "unit": r["unit"],
-                "unit_price": r["unit_price"],
-                "product_code": r["product_code"],
-                "salesman": r["salesman"],
-                "part_description": r["part_description"],
-                "gl_account": r["gl_account"]
-                if "." in r["gl_account"]
-                else f"{r['gl_account']}.000",
-                "gl_account_description": r["gl_account_description"],
-                "amount": r["amount"],
-            }
-            for r in self.q(sql, params)
-        ]
+        """  # noqa: S608
+        rows = map(self._sales_summary_row, self._rows(sql, params, stream))
+        return rows if stream else list(rows)
 
-    def service_vendors_list(self):
+    @staticmethod
+    def _sales_summary_row(r: dict) -> dict:
+        return {
+            "invoice_number": r["invoice_number"],
+            "invoice_date": r["invoice_date"],
+            "period": r["period"],
+            "customer_code": r["customer_code"],
+            "customer_name": r["customer_name"],
+            "job_number": r["job_number"],
+            "market": r["market"],
+            "part_number": r["part_number"],
+            "revision": r["revision"],
+            "qty_ordered": int(r["qty_ordered"]),
+            "qty_shipped": int(r["qty_shipped"]),
+            "unit": r["unit"],
+            "unit_price": r["unit_price"],
+            "product_code": r["product_code"],
+            "salesman": r["salesman"],
+            "part_description": r["part_description"],
+            "gl_account": r["gl_account"]
+            if "." in r["gl_account"]
+            else f"{r['gl_account']}.000",
+            "gl_account_description": r["gl_account_description"],
+            "amount": r["amount"],
+        }
+
+    @cached(ttl=REFERENCE_TTL)
+    def service_vendors_list(self, stream: bool = False) -> list | Iterator[dict]:
         sql = """
             select s.service_code, o.vendor_code, o.is_default, o.lead_time_days
             from service_code s
@@ -508,4 +829,11 @@ class E2Database:
             and s.service_code is not null
             order by s.service_code, o.is_default desc, o.vendor_code
         """
-        return self.q(sql)
+        return self._rows(sql, stream=stream)
+
+    @staticmethod
+    def _top(limit: int | None) -> tuple[str, tuple]:
+        """Build a top clause to limit a report to one page of rows"""
+        if limit is None:
+            return "", ()
+        return "top (%s)", (limit,)
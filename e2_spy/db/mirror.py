@@ -0,0 +1,743 @@
+import collections
+import contextlib
+import dataclasses
+import datetime as dt
+import decimal
+import functools
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from collections.abc import Iterator
+
+import pymssql
+
+from e2_spy import config
+
+from .cache import cached
+from .e2 import DEPARTMENT_GL_PATTERNS, REFERENCE_TTL, REPORT_TTL, E2Database
+
+log = logging.getLogger(__name__)
+
+# full path to the local copy of the E2 tables
+MIRROR_DB_PATH = getattr(config, "MIRROR_DB_PATH", "mirror.db")
+
+# how many changed rows to request from E2 in one query
+FETCH_CHUNK_SIZE = 500
+
+# tables with watermarks are compared row by row against E2 this often, to catch
+# the changes and deletions their watermarks miss
+RECONCILE_SECONDS = getattr(config, "MIRROR_RECONCILE_HOURS", 24) * 60 * 60
+
+
+@dataclasses.dataclass(frozen=True)
+class MirrorTable:
+    """An E2 table to copy into the mirror
+
+    watermarks are columns whose values only grow as rows are added, or changed in
+    a way reports care about. A table with watermarks is synced by copying the rows
+    at or past the newest value of any of them, and only reconciled with a full
+    checksum comparison every RECONCILE_SECONDS. A table without watermarks is
+    compared in full on every sync.
+    """
+
+    name: str
+    key: str
+    where: str = ""
+    watermarks: tuple[str, ...] = ()
+
+
+MIRROR_TABLES = [
+    MirrorTable(
+        "accounting_distribution",
+        "accounting_distribution_id",
+        watermarks=("accounting_distribution_id",),
+    ),
+    MirrorTable("action", "action_id", watermarks=("action_id", "completed_date")),
+    MirrorTable(
+        "billing_detail", "billing_detail_id", watermarks=("billing_detail_id",)
+    ),
+    MirrorTable(
+        "billing_header", "billing_header_id", watermarks=("billing_header_id",)
+    ),
+    MirrorTable(
+        "commission_distribution",
+        "commission_distribution_id",
+        watermarks=("commission_distribution_id",),
+    ),
+    MirrorTable("gl_account", "gl_account_id"),
+    # balances are updated in place as entries are posted, so compare in full
+    MirrorTable("gl_balance", "gl_balance_id"),
+    MirrorTable(
+        "order_detail", "order_detail_id", watermarks=("order_detail_id", "date_closed")
+    ),
+    MirrorTable("order_header", "order_header_id", watermarks=("order_header_id",)),
+    MirrorTable(
+        "order_material", "order_material_id", watermarks=("order_material_id",)
+    ),
+    MirrorTable(
+        "part_number", "part_number_id", watermarks=("part_number_id", "revision_date")
+    ),
+    MirrorTable("po_header", "po_header_id", watermarks=("po_header_id",)),
+    MirrorTable(
+        "routing_header", "routing_header_id", watermarks=("routing_header_id",)
+    ),
+    # steps are updated in place as jobs move through the shop, so compare in full
+    MirrorTable(
+        "schedule_detail", "schedule_detail_id", "where schedule_header_id = 50"
+    ),
+]
+
+
+def _convert_datetime(value: bytes) -> dt.date | dt.datetime:
+    s = value.decode()
+    if len(s) == 10:
+        return dt.date.fromisoformat(s)
+    return dt.datetime.fromisoformat(s)
+
+
+def _convert_decimal(value: bytes) -> decimal.Decimal:
+    return decimal.Decimal(value.decode())
+
+
+sqlite3.register_converter("e2datetime", _convert_datetime)
+sqlite3.register_converter("e2decimal", _convert_decimal)
+
+
+def _adapt(value: typing.Any) -> typing.Any:  # noqa: ANN401
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, dt.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, dt.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal | uuid.UUID):
+        return str(value)
+    return value
+
+
+def _column_type(type_code: int) -> str:
+    """Choose a SQLite column type for a pymssql column type
+
+    Text compares case-insensitively, like it does in E2.
+    """
+    if type_code == pymssql.DATETIME:
+        return "e2datetime"
+    if type_code == pymssql.DECIMAL:
+        return "e2decimal"
+    if type_code == pymssql.NUMBER:
+        return "numeric"
+    if type_code == pymssql.BINARY:
+        return "blob"
+    return "text collate nocase"
+
+
+class _ColumnsChangedError(Exception):
+    """The columns of a table in E2 no longer match its copy in the mirror"""
+
+
+def _dict_factory(cur: sqlite3.Cursor, row: tuple) -> dict:
+    return {d[0]: v for d, v in zip(cur.description, row, strict=True)}
+
+
+class MirrorStore:
+    """A local SQLite copy of the E2 tables that reports read
+
+    Tables with watermarks are synced by copying only the rows past them. Other
+    tables, and every table when it is due to be reconciled, are compared in full:
+    E2 sends a narrow list of keys and row checksums, only rows that are new or have
+    a different checksum are copied, and rows that no longer exist in E2 are removed.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = str(path or MIRROR_DB_PATH)
+        with contextlib.closing(self.connect()) as cnx:
+            cnx.execute("pragma journal_mode = wal")
+            cnx.execute("""
+                create table if not exists mirror_tables (
+                    table_name text primary key,
+                    synced_at text,
+                    row_count integer,
+                    rows_changed integer,
+                    duration real,
+                    reconciled_at text
+                )
+            """)
+            if "reconciled_at" not in self._columns(cnx, "mirror_tables"):
+                cnx.execute("alter table mirror_tables add column reconciled_at text")
+
+    def connect(self) -> sqlite3.Connection:
+        cnx = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        cnx.row_factory = _dict_factory
+        cnx.execute("pragma busy_timeout = 10000")
+        return cnx
+
+    def q(self, sql: str, params: tuple | dict = ()) -> list[dict]:
+        with contextlib.closing(self.connect()) as cnx:
+            return cnx.execute(sql, params).fetchall()
+
+    def q_iter(self, sql: str, params: tuple | dict = ()) -> Iterator[dict]:
+        with contextlib.closing(self.connect()) as cnx:
+            cur = cnx.execute(sql, params)
+            while rows := cur.fetchmany(1000):
+                yield from rows
+
+    def as_of(self, table_names: typing.Iterable[str]) -> dt.datetime | None:
+        """Get the time of the oldest sync of these tables, or None if any of the
+        tables has never been synced"""
+        table_names = list(table_names)
+        sql = """
+            select table_name, synced_at
+            from mirror_tables
+            where table_name in (select value from json_each(?))
+        """
+        synced = {
+            r["table_name"]: r["synced_at"]
+            for r in self.q(sql, (json.dumps(table_names),))
+        }
+        if any(synced.get(t) is None for t in table_names):
+            return None
+        return min(dt.datetime.fromisoformat(s) for s in synced.values())
+
+    def status(self) -> list[dict]:
+        sql = """
+            select table_name, synced_at, row_count, rows_changed, duration
+            from mirror_tables
+        """
+        synced = {r["table_name"]: r for r in self.q(sql)}
+        return [synced.get(t.name, {"table_name": t.name}) for t in MIRROR_TABLES]
+
+    def _columns(self, cnx: sqlite3.Connection, table_name: str) -> list[str]:
+        return [r["name"] for r in cnx.execute(f"pragma table_info({table_name})")]
+
+    def _create_table(
+        self, cnx: sqlite3.Connection, table: MirrorTable, description: tuple
+    ) -> None:
+        column_defs = []
+        for name, type_code, *_ in description:
+            column_def = f'"{name}" {_column_type(type_code)}'
+            if name == table.key:
+                column_def = f"{column_def} primary key"
+            column_defs.append(column_def)
+        cnx.execute(f"drop table if exists {table.name}")
+        cnx.execute(f"create table {table.name} ({', '.join(column_defs)})")
+
+    def _write(
+        self, cnx: sqlite3.Connection, table: MirrorTable, columns: list, rows: list
+    ) -> None:
+        """Insert or update rows, leaving rows whose checksum has not changed alone
+        so that they do not count as changes"""
+        names = ", ".join(f'"{c}"' for c in columns)
+        placeholders = ", ".join("?" * len(columns))
+        updates = ", ".join(f'"{c}" = excluded."{c}"' for c in columns)
+        sql = f"""
+            insert into {table.name} ({names}) values ({placeholders})
+            on conflict ({table.key}) do update set {updates}
+            where _checksum is not excluded._checksum
+        """  # noqa: S608
+        cnx.executemany(sql, ([_adapt(v) for v in row] for row in rows))
+
+    def _watermark(
+        self, cnx: sqlite3.Connection, table: MirrorTable, column: str
+    ) -> typing.Any:  # noqa: ANN401
+        """Get the newest value of a watermark column in the mirror"""
+        sql = f"""
+            select "{column}" v from {table.name}
+            where "{column}" is not null
+            order by "{column}" desc
+            limit 1
+        """  # noqa: S608
+        row = cnx.execute(sql).fetchone()
+        return row and row["v"]
+
+    def _reconcile_due(self, cnx: sqlite3.Connection, table: MirrorTable) -> bool:
+        sql = "select reconciled_at from mirror_tables where table_name = ?"
+        row = cnx.execute(sql, (table.name,)).fetchone()
+        if row is None or row["reconciled_at"] is None:
+            return True
+        reconciled_at = dt.datetime.fromisoformat(row["reconciled_at"])
+        age = (dt.datetime.now() - reconciled_at).total_seconds()
+        return age >= RECONCILE_SECONDS
+
+    def sync_table(
+        self, e2db: E2Database, table: MirrorTable, reconcile: bool = False
+    ) -> int:
+        """Bring one table up to date and return the number of rows that changed
+
+        The table is compared with E2 in full if it has no watermarks, if it is due
+        to be reconciled, or if reconcile is true.
+        """
+        try:
+            return self._sync_table(e2db, table, reconcile)
+        except _ColumnsChangedError:
+            # the table changed in E2, start over with a full copy now that the E2
+            # connection is back in the pool
+            log.info(f"Columns in {table.name} changed")
+            with contextlib.closing(self.connect()) as cnx:
+                cnx.execute(f"drop table if exists {table.name}")
+            return self._sync_table(e2db, table)
+
+    def _sync_table(
+        self, e2db: E2Database, table: MirrorTable, reconcile: bool = False
+    ) -> int:
+        start = time.monotonic()
+        with contextlib.closing(self.connect()) as cnx:
+            local_columns = self._columns(cnx, table.name)
+            watermarks = {}
+            if local_columns and not reconcile and not self._reconcile_due(cnx, table):
+                watermarks = {
+                    c: self._watermark(cnx, table, c)
+                    for c in table.watermarks
+                    if c in local_columns
+                }
+                watermarks = {c: v for c, v in watermarks.items() if v is not None}
+            reconcile = not watermarks
+            local = {}
+            if local_columns and reconcile:
+                sql = f"select {table.key} k, _checksum c from {table.name}"  # noqa: S608
+                local = {r["k"]: r["c"] for r in cnx.execute(sql)}
+        select_rows = f"select *, binary_checksum(*) _checksum from {table.name}"  # noqa: S608
+        deleted = []
+        if not reconcile:
+            conditions = " or ".join(f"{c} >= %s" for c in watermarks)
+            where = f"{table.where} and" if table.where else "where"
+            queries = [
+                (f"{select_rows} {where} ({conditions})", tuple(watermarks.values()))
+            ]
+        else:
+            sql = f"""
+                select {table.key} k, binary_checksum(*) c
+                from {table.name}
+                {table.where}
+            """  # noqa: S608
+            remote = {_adapt(r["k"]): r["c"] for r in e2db.q(sql)}
+            changed = [k for k, c in remote.items() if local.get(k) != c]
+            deleted = [k for k in local if k not in remote]
+            if local and len(changed) < len(remote) / 2:
+                queries = [
+                    (f"{select_rows} where {table.key} in %s", (chunk,))
+                    for chunk in itertools.batched(changed, FETCH_CHUNK_SIZE)
+                ]
+            else:
+                log.info(f"Copying all rows of {table.name} from E2")
+                queries = [(f"{select_rows} {table.where}", ())]
+                local_columns = []
+        with (
+            contextlib.closing(self.connect()) as cnx,
+            e2db.pool.connection() as e2cnx,
+        ):
+            cnx.execute("begin immediate")
+            try:
+                changes_before = cnx.total_changes
+                for sql, params in queries:
+                    with contextlib.closing(e2cnx.cursor(as_dict=False)) as cur:
+                        cur.execute(sql, params)
+                        columns = [d[0] for d in cur.description]
+                        if columns != local_columns:
+                            if local_columns:
+                                raise _ColumnsChangedError
+                            self._create_table(cnx, table, cur.description)
+                            local_columns = columns
+                        while rows := cur.fetchmany(1000):
+                            self._write(cnx, table, columns, rows)
+                for chunk in itertools.batched(deleted, FETCH_CHUNK_SIZE):
+                    sql = f"""
+                        delete from {table.name}
+                        where {table.key} in (select value from json_each(?))
+                    """  # noqa: S608
+                    cnx.execute(sql, (json.dumps(chunk),))
+                rows_changed = cnx.total_changes - changes_before
+                sql = f"select count(*) n from {table.name}"  # noqa: S608
+                row_count = cnx.execute(sql).fetchone()["n"]
+                now = dt.datetime.now().isoformat(sep=" ")
+                sql = """
+                    insert into mirror_tables (
+                        table_name, synced_at, row_count, rows_changed, duration,
+                        reconciled_at
+                    ) values (
+                        :table_name, :synced_at, :row_count, :rows_changed, :duration,
+                        :reconciled_at
+                    )
+                    on conflict (table_name) do update set
+                        synced_at = :synced_at, row_count = :row_count,
+                        rows_changed = :rows_changed, duration = :duration,
+                        reconciled_at = coalesce(:reconciled_at, reconciled_at)
+                """
+                params = {
+                    "table_name": table.name,
+                    "synced_at": now,
+                    "row_count": row_count,
+                    "rows_changed": rows_changed,
+                    "duration": time.monotonic() - start,
+                    "reconciled_at": now if reconcile else None,
+                }
+                cnx.execute(sql, params)
+                cnx.execute("commit")
+            except BaseException:
+                if cnx.in_transaction:
+                    cnx.execute("rollback")
+                raise
+        log.info(
+            f"{'Reconciled' if reconcile else 'Synced'} {table.name}: "
+            f"{rows_changed} of {row_count} rows changed"
+        )
+        return rows_changed
+
+    def sync(self, e2db: E2Database, reconcile: bool = False) -> None:
+        for table in MIRROR_TABLES:
+            try:
+                self.sync_table(e2db, table, reconcile)
+            except (pymssql.Error, sqlite3.Error):
+                log.exception(f"Could not sync {table.name}")
+
+
+_stores: dict[str, MirrorStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str | None = None) -> MirrorStore:
+    """Get the shared store for a mirror database file, setting up the file the first
+    time it is used"""
+    path = str(path or MIRROR_DB_PATH)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = MirrorStore(path)
+        return _stores[path]
+
+
+def mirrored(*table_names: str) -> typing.Callable:
+    """Serve a MirrorDatabase report from the mirror if all the tables it reads have
+    been synced, otherwise fall back to running the report against E2"""
+
+    def decorator(f: typing.Callable) -> typing.Callable:
+        @functools.wraps(f)
+        def wrapper(self: "MirrorDatabase", *args, **kwargs):  # noqa: ANN002, ANN003, ANN202
+            as_of = self.store.as_of(table_names)
+            if as_of is None:
+                return getattr(super(MirrorDatabase, self), f.__name__)(*args, **kwargs)
+            self._note_as_of(as_of)
+            return f(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class MirrorDatabase(E2Database):
+    """Run reports against the local mirror of E2 where possible
+
+    Only reports that read nothing but mirrored tables are overridden here, the rest
+    still run against E2. as_of is the time of the oldest sync behind any report
+    this instance served from the mirror.
+    """
+
+    def __init__(self, cnx_details: dict, store: MirrorStore | None = None) -> None:
+        super().__init__(cnx_details)
+        self.store = store or get_store()
+
+    @staticmethod
+    def _limit(limit: int | None) -> str:
+        return "" if limit is None else f"limit {int(limit)}"
+
+    def _mirror_rows(
+        self, sql: str, params: tuple = (), stream: bool = False
+    ) -> list[dict] | Iterator[dict]:
+        if stream:
+            return self.store.q_iter(sql, params)
+        return self.store.q(sql, params)
+
+    @mirrored("order_detail", "order_header")
+    @cached(ttl=REPORT_TTL)
+    def closed_jobs(
+        self,
+        after: tuple[dt.date | None, str] | None = None,
+        limit: int | None = None,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        after_filter, params = self._mirror_closed_after("od", after)
+        sql = f"""
+            select
+                oh.customer_code, oh.customer_po_number, od.date_closed, od.job_number,
+                oh.order_number, od.part_description, od.part_number
+            from order_detail od
+            left join order_header oh on oh.order_header_id = od.order_header_id
+            where oh.company_code = 'spmtech'
+            and od.status = 'closed'
+            {after_filter}
+            order by date(od.date_closed) desc, od.job_number desc
+            {self._limit(limit)}
+        """  # noqa: S608
+        return self._mirror_rows(sql, params, stream)
+
+    @staticmethod
+    def _mirror_closed_after(
+        alias: str, after: tuple[dt.date | None, str] | None
+    ) -> tuple[str, tuple]:
+        if after is None:
+            return "", ()
+        date_closed, job_number = after
+        if date_closed is None:
+            return (
+                f"and {alias}.date_closed is null and {alias}.job_number < ?",
+                (job_number,),
+            )
+        sql = f"""
+            and (
+                date({alias}.date_closed) < ? or {alias}.date_closed is null
+                or (date({alias}.date_closed) = ? and {alias}.job_number < ?)
+            )
+        """
+        params = (date_closed.isoformat(), date_closed.isoformat(), job_number)
+        return sql, params
+
+    @mirrored("schedule_detail")
+    @cached(ttl=REFERENCE_TTL)
+    def get_departments_list(self) -> list[str]:
+        sql = """
+            select distinct department_name
+            from schedule_detail
+            where length(department_name) > 0
+            order by department_name
+        """
+        return [row["department_name"] for row in self.store.q(sql)]
+
+    @mirrored("action")
+    @cached(ttl=REFERENCE_TTL)
+    def get_followup_user_code_list(self) -> list[str]:
+        sql = """
+            select distinct followup_by_user_code
+            from action
+            where length(followup_by_user_code) > 0
+            order by followup_by_user_code
+        """
+        return [row["followup_by_user_code"] for row in self.store.q(sql)]
+
+    @mirrored("gl_account", "gl_balance")
+    @cached(ttl=REPORT_TTL)
+    def income_statement(
+        self,
+        department: str,
+        start_date: dt.date,
+        end_date: dt.date,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        """Balances are added up as decimals here, SQLite would add them as floats"""
+        if department == "~all":
+            gl_account_filter = ""
+            params = ()
+        else:
+            gl_account_filter = "where gl_account like ?"
+            params = (DEPARTMENT_GL_PATTERNS.get(department),)
+        sql = """
+            select gl_account_id, amount
+            from gl_balance
+            where period_number between ? and ?
+            and amount is not null
+        """
+        periods = (start_date.strftime("%Y%m"), end_date.strftime("%Y%m"))
+        totals = collections.defaultdict(decimal.Decimal)
+        for r in self.store.q_iter(sql, periods):
+            totals[r["gl_account_id"]] += r["amount"]
+        sql = f"""
+            select
+                gl_account_id, gl_account, active, description, gl_group_code,
+                account_type
+            from gl_account
+            {gl_account_filter}
+            order by gl_account
+        """  # noqa: S608
+        rows = (
+            {
+                "gl_account": r["gl_account"],
+                "active": r["active"],
+                "description": r["description"],
+                "gl_group_code": r["gl_group_code"],
+                "account_type": r["account_type"],
+                "total_amount": totals[r["gl_account_id"]],
+            }
+            for r in self._mirror_rows(sql, params, stream)
+        )
+        return rows if stream else list(rows)
+
+    @mirrored("order_detail", "part_number", "routing_header")
+    @cached(ttl=REPORT_TTL)
+    def job_performance(
+        self,
+        start_date: dt.date,
+        end_date: dt.date,
+        get_all: bool = False,
+        after: tuple[dt.date | None, str] | None = None,
+        limit: int | None = None,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        if get_all:
+            date_closed_filter = ""
+            params = ()
+        else:
+            date_closed_filter = "and date(o.date_closed) between ? and ?"
+            params = (start_date.isoformat(), end_date.isoformat())
+        after_filter, after_params = self._mirror_closed_after("o", after)
+        sql = f"""
+            with h as (
+                select
+                    order_detail_id,
+                    sum(total_estimated_hours) total_estimated_hours,
+                    sum(total_actual_hours) total_actual_hours
+                from routing_header
+                where order_detail_id is not null
+                and status in ('Current', 'Finished')
+                group by order_detail_id
+            )
+            select
+                date(o.date_closed) date_closed,
+                o.job_number,
+                o.part_description,
+                o.part_number,
+                cast(
+                    case
+                        when h.total_estimated_hours > 0
+                        then 100.0 * h.total_actual_hours / h.total_estimated_hours
+                        else 0
+                    end
+                as integer) performance,
+                o.product_code,
+                coalesce(h.total_estimated_hours, 0) total_estimated_hours,
+                coalesce(h.total_actual_hours, 0) total_actual_hours,
+                cast(o.quantity_to_make as integer) quantity_to_make,
+                date(p.revision_date) part_revision_date
+            from order_detail o
+            left join h on h.order_detail_id = o.order_detail_id
+            left join part_number p on p.part_number_id = o.part_number_id
+            where o.company_code = 'spmtech'
+            and o.status = 'closed'
+            {date_closed_filter}
+            {after_filter}
+            order by date(o.date_closed) desc, o.job_number desc
+            {self._limit(limit)}
+        """  # noqa: S608
+        params += after_params
+        rows = map(self._job_performance_row, self._mirror_rows(sql, params, stream))
+        return rows if stream else list(rows)
+
+    @staticmethod
+    def _job_performance_row(r: dict) -> dict:
+        for col in ("date_closed", "part_revision_date"):
+            if r[col] is not None:
+                r[col] = dt.date.fromisoformat(r[col])
+        return r
+
+    @mirrored("schedule_detail")
+    def open_schedule_steps(self, stream: bool = False) -> list | Iterator[dict]:
+        sql = """
+            select
+                sd.job_number, sd.item_number, sd.department_name, sd.work_center,
+                coalesce(sd.work_center, sd.vendor_code) current_step,
+                coalesce(ns.work_center, ns.vendor_code, 'LAST STEP') next_step,
+                sd.priority, sd.part_number, sd.part_description, sd.quantity_to_make,
+                sd.quantity_open, sd.scheduled_start_date, sd.scheduled_end_date,
+                sd.due_date, sd.actual_start_date, sd.actual_end_date
+            from schedule_detail sd
+            left join schedule_detail ns on ns.job_number = sd.job_number
+                and ns.item_number = sd.item_number + 1
+            where sd.step_status in ('current', 'pending')
+            order by sd.job_number, sd.item_number
+        """
+        return self._mirror_rows(sql, stream=stream)
+
+    @mirrored(
+        "accounting_distribution",
+        "billing_detail",
+        "billing_header",
+        "commission_distribution",
+        "gl_account",
+    )
+    @cached(ttl=REPORT_TTL)
+    def sales_summary(
+        self,
+        start_date: dt.date,
+        end_date: dt.date,
+        after: str | None = None,
+        limit: int | None = None,
+        stream: bool = False,
+    ) -> list | Iterator[dict]:
+        invoice_filter = "and date(bh.invoice_date) between ? and ?"
+        params = (start_date.isoformat(), end_date.isoformat())
+        if limit is not None:
+            after_filter = ""
+            if after is not None:
+                after_filter = "and invoice_number > ?"
+                params += (after,)
+            invoice_filter = f"""
+                and bh.invoice_number in (
+                    select invoice_number
+                    from billing_header
+                    where company_code = 'spmtech' and invoice_number is not null
+                    and date(invoice_date) between ? and ?
+                    {after_filter}
+                    order by invoice_number
+                    {self._limit(limit)}
+                )
+            """  # noqa: S608
+        sql = f"""
+            select
+                bh.invoice_number,
+                date(bh.invoice_date) invoice_date,
+                bh.period_number period,
+                bh.customer_code,
+                bh.customer_name,
+                bd.job_number,
+                coalesce(bd.work_code, 'UNSPECIFIED') market,
+                bd.part_number,
+                bd.revision_level revision,
+                bd.quantity_ordered qty_ordered,
+                bd.quantity_shipped qty_shipped,
+                bd.unit_of_measure unit,
+                bd.unit_price,
+                bd.product_code,
+                coalesce(cd.salesman_code, 'UNSPECIFIED') salesman,
+                bd.part_description,
+                ad.gl_account,
+                ga.description gl_account_description,
+                ad.amount_credit amount
+            from billing_header bh
+            left join billing_detail bd on bd.billing_header_id = bh.billing_header_id
+            left join commission_distribution cd
+                on cd.billing_detail_id = bd.billing_detail_id
+            left join accounting_distribution ad
+                on ad.billing_detail_id = bd.billing_detail_id
+                and ad.account_type in ('miscellaneous charge', 'total')
+            left join gl_account ga on ga.gl_account = ad.gl_account
+            where bh.company_code = 'spmtech' and bh.invoice_number is not null
+            {invoice_filter}
+            order by bh.invoice_number, bd.item_number
+        """  # noqa: S608
+        rows = map(
+            self._mirror_sales_summary_row, self._mirror_rows(sql, params, stream)
+        )
+        return rows if stream else list(rows)
+
+    @staticmethod
+    def _mirror_sales_summary_row(r: dict) -> dict:
+        r["invoice_date"] = dt.date.fromisoformat(r["invoice_date"])
+        return E2Database._sales_summary_row(r)
+
+    @mirrored("part_number")
+    @cached(ttl=REFERENCE_TTL)
+    def product_codes(self) -> list[str]:
+        sql = """
+            select distinct product_code
+            from part_number
+            where product_code is not null and product_code <> ''
+            and company_code = 'SPMTECH'
+            order by product_code
+        """
+        return [row["product_code"] for row in self.store.q(sql)]
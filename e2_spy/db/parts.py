@@ -0,0 +1,149 @@
+import dataclasses
+import datetime as dt
+import functools
+import itertools
+import logging
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    from .e2 import E2Database
+
+log = logging.getLogger(__name__)
+
+# how often the background job refreshes the part dimension
+REFRESH_SECONDS = 15 * 60
+
+# how many changed parts to request from E2 in one query
+FETCH_CHUNK_SIZE = 1000
+
+
+@dataclasses.dataclass(frozen=True)
+class Part:
+    part_number_id: int
+    part_number: str
+    company_code: str | None
+    description: str | None
+    product_code: str | None
+    active: bool
+    entered_date: dt.datetime | None
+    revision_date: dt.datetime | None
+    routed_date: dt.datetime | None
+
+    @property
+    def dates(self) -> dict:
+        return {
+            "entered_date": self.entered_date,
+            "revision_date": self.revision_date,
+            "routed_date": self.routed_date,
+        }
+
+
+@dataclasses.dataclass(frozen=True)
+class PartDimension:
+    """Every row of the E2 part_number table, looked up by part number
+
+    parts and checksums are keyed by part_number_id. checksums has the
+    binary_checksum E2 gave each row when it was read, so a refresh only reads the
+    rows that changed since. When several rows share a part number, by_number has
+    the one with the highest part_number_id.
+    """
+
+    refreshed_at: dt.datetime
+    parts: dict[int, Part]
+    checksums: dict[int, int]
+
+    @functools.cached_property
+    def by_number(self) -> dict[str, Part]:
+        return {p.part_number: p for _, p in sorted(self.parts.items())}
+
+    @functools.cached_property
+    def product_codes(self) -> list[str]:
+        return sorted(
+            {
+                p.product_code
+                for p in self.parts.values()
+                if p.product_code and (p.company_code or "").upper() == "SPMTECH"
+            }
+        )
+
+    @property
+    def age(self) -> float:
+        return (dt.datetime.now() - self.refreshed_at).total_seconds()
+
+
+class PartDimensions:
+    """Hold one PartDimension per E2 database, refreshed in the background
+
+    Lookups never wait for a refresh: until the first one finishes for a database,
+    get returns None and callers read from E2 instead.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._refresh_locks: dict[tuple, threading.Lock] = {}
+        self._dimensions: dict[tuple, PartDimension] = {}
+
+    def get(self, e2db: "E2Database") -> PartDimension | None:
+        return self._dimensions.get(e2db.cache_scope)
+
+    def refresh(self, e2db: "E2Database") -> PartDimension:
+        """Read the parts that are new or changed since the last refresh, and drop
+        the ones that are gone"""
+        scope = e2db.cache_scope
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(scope, threading.Lock())
+        with refresh_lock:
+            start = dt.datetime.now()
+            current = self._dimensions.get(scope)
+            remote = e2db.part_number_checksums()
+            if current is None:
+                parts = {}
+                rows = e2db.part_number_rows()
+                changed = list(remote)
+            else:
+                parts = {k: p for k, p in current.parts.items() if k in remote}
+                changed = [
+                    k for k, c in remote.items() if current.checksums.get(k) != c
+                ]
+                rows = itertools.chain.from_iterable(
+                    e2db.part_number_rows(list(chunk))
+                    for chunk in itertools.batched(changed, FETCH_CHUNK_SIZE)
+                )
+            for row in rows:
+                parts[row["part_number_id"]] = Part(
+                    part_number_id=row["part_number_id"],
+                    part_number=row["part_number"],
+                    company_code=row["company_code"],
+                    description=row["description"],
+                    product_code=row["product_code"],
+                    active=bool(row["active"]),
+                    entered_date=row["entered_date"],
+                    revision_date=row["revision_date"],
+                    routed_date=row["date_routed"],
+                )
+            dimension = PartDimension(start, parts, remote)
+            self._dimensions[scope] = dimension
+        log.info(
+            f"Refreshed part dimension: {len(changed)} of {len(parts)} parts changed "
+            f"in {dimension.age:.3f}s"
+        )
+        return dimension
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dimensions.clear()
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "server": scope[0],
+                "database": scope[1],
+                "parts": len(d.parts),
+                "age": d.age,
+            }
+            for scope, d in list(self._dimensions.items())
+        ]
+
+
+dimensions = PartDimensions()
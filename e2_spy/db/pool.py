@@ -0,0 +1,222 @@
+import contextlib
+import dataclasses
+import logging
+import threading
+import time
+from collections.abc import Iterator
+
+import pymssql
+
+log = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """No E2 connection became available before the checkout timeout"""
+
+
+@dataclasses.dataclass
+class _PooledConnection:
+    cnx: pymssql.Connection
+    created: float
+    last_used: float
+
+
+class E2ConnectionPool:
+    """A bounded, thread-safe pool of connections to the E2 database
+
+    Connections are validated with a ping when they have been idle for a while,
+    recycled when they are older than max_age seconds, and closed when they are
+    returned to a pool that has been closed.
+    """
+
+    def __init__(
+        self,
+        cnx_details: dict,
+        max_size: int = 12,
+        max_age: float = 30 * 60,
+        ping_after: float = 10,
+        checkout_timeout: float = 30,
+    ) -> None:
+        self.cnx_details = cnx_details
+        self.max_size = max_size
+        self.max_age = max_age
+        self.ping_after = ping_after
+        self.checkout_timeout = checkout_timeout
+        self._cond = threading.Condition()
+        self._idle: list[_PooledConnection] = []
+        self._in_use = 0
+        self._closed = False
+        self._checkouts = 0
+        self._connections_created = 0
+        self._connections_recycled = 0
+        self._failed_pings = 0
+        self._waits = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    @property
+    def key(self) -> tuple:
+        return pool_key(self.cnx_details)
+
+    def _connect(self) -> _PooledConnection:
+        log.info(f"Opening a new connection to {self.cnx_details.get('server')}")
+        cnx = pymssql.connect(**self.cnx_details, as_dict=True, autocommit=True)
+        now = time.monotonic()
+        with self._cond:
+            self._connections_created += 1
+        return _PooledConnection(cnx, now, now)
+
+    @staticmethod
+    def _discard(pc: _PooledConnection) -> None:
+        with contextlib.suppress(pymssql.Error):
+            pc.cnx.close()
+
+    def _is_healthy(self, pc: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if now - pc.created > self.max_age:
+            log.debug("Recycling an E2 connection that reached its maximum age")
+            with self._cond:
+                self._connections_recycled += 1
+            return False
+        if now - pc.last_used < self.ping_after:
+            return True
+        try:
+            with contextlib.closing(pc.cnx.cursor()) as cur:
+                cur.execute("select 1 ping")
+                cur.fetchall()
+        except pymssql.Error:
+            log.warning("Discarding an E2 connection that failed a ping")
+            with self._cond:
+                self._failed_pings += 1
+            return False
+        return True
+
+    def acquire(self) -> _PooledConnection:
+        """Check out a connection, waiting up to checkout_timeout seconds for one"""
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    msg = "The E2 connection pool is closed"
+                    raise PoolTimeoutError(msg)
+                if self._idle:
+                    pc = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    pc = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    msg = f"Timed out waiting for an E2 connection ({self.max_size=})"
+                    raise PoolTimeoutError(msg)
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_seconds = time.monotonic() - start
+                self._waits += 1
+                self._wait_seconds_total += wait_seconds
+                self._wait_seconds_max = max(self._wait_seconds_max, wait_seconds)
+        try:
+            if pc is not None and not self._is_healthy(pc):
+                self._discard(pc)
+                pc = None
+            if pc is None:
+                pc = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return pc
+
+    def release(self, pc: _PooledConnection, discard: bool = False) -> None:
+        """Return a connection to the pool, or close it if it should not be reused"""
+        pc.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if not (discard or self._closed):
+                self._idle.append(pc)
+                pc = None
+            self._cond.notify()
+        if pc is not None:
+            self._discard(pc)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[pymssql.Connection]:
+        pc = self.acquire()
+        try:
+            yield pc.cnx
+        except (pymssql.InterfaceError, pymssql.OperationalError):
+            self.release(pc, discard=True)
+            raise
+        except BaseException:
+            self.release(pc)
+            raise
+        else:
+            self.release(pc)
+
+    def close(self) -> None:
+        """Close idle connections and stop handing out new ones
+
+        Connections that are checked out are closed when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for pc in idle:
+            self._discard(pc)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "server": self.cnx_details.get("server"),
+                "database": self.cnx_details.get("database"),
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "connections_created": self._connections_created,
+                "connections_recycled": self._connections_recycled,
+                "failed_pings": self._failed_pings,
+                "waits": self._waits,
+                "wait_seconds_total": round(self._wait_seconds_total, 3),
+                "wait_seconds_max": round(self._wait_seconds_max, 3),
+            }
+
+
+_pool: E2ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def pool_key(cnx_details: dict) -> tuple:
+    return tuple(sorted(cnx_details.items()))
+
+
+def get_pool(cnx_details: dict) -> E2ConnectionPool:
+    """Get the shared pool for these connection details
+
+    If the connection details have changed since the pool was built, the old pool is
+    closed and a new one is built.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.key != pool_key(cnx_details):
+            if _pool is not None:
+                log.info(
+                    "E2 connection details changed, rebuilding the connection pool"
+                )
+                _pool.close()
+            _pool = E2ConnectionPool(cnx_details)
+        return _pool
+
+
+def pool_stats() -> dict:
+    with _pool_lock:
+        if _pool is None:
+            return {}
+        return _pool.stats()
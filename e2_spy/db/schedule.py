@@ -0,0 +1,94 @@
+import dataclasses
+import datetime as dt
+import logging
+import threading
+import typing
+from collections.abc import Iterator
+
+if typing.TYPE_CHECKING:
+    from .e2 import E2Database
+
+log = logging.getLogger(__name__)
+
+# how often the background job rebuilds the snapshot
+REFRESH_SECONDS = 5 * 60
+
+# a report that finds a snapshot older than this rebuilds it before reading it, in
+# case the background job is not running
+MAX_AGE_SECONDS = 15 * 60
+
+
+@dataclasses.dataclass(frozen=True)
+class ScheduleSnapshot:
+    """Open (current or pending) schedule steps for every job in the live schedule
+
+    steps maps each job number to its open steps in item number order, so the first
+    one is the job's current step. Each step also carries its next_step. as_of is
+    when the steps were read from E2: taken_at, or the last sync of the mirror the
+    snapshot was built from.
+    """
+
+    taken_at: dt.datetime
+    steps: dict[str, list[dict]]
+    as_of: dt.datetime
+
+    def current_steps(self) -> Iterator[dict]:
+        for job_steps in self.steps.values():
+            yield job_steps[0]
+
+    def first_steps(self, match: typing.Callable[[dict], bool]) -> Iterator[dict]:
+        """Yield the first open step of each job for which match is true"""
+        for job_steps in self.steps.values():
+            for step in job_steps:
+                if match(step):
+                    yield step
+                    break
+
+    @property
+    def age(self) -> float:
+        return (dt.datetime.now() - self.taken_at).total_seconds()
+
+
+class ScheduleSnapshots:
+    """Hold one ScheduleSnapshot per E2 database, rebuilt in the background"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._build_locks: dict[tuple, threading.Lock] = {}
+        self._snapshots: dict[tuple, ScheduleSnapshot] = {}
+
+    def _build(
+        self, e2db: "E2Database", force: bool, stale: ScheduleSnapshot | None = None
+    ) -> ScheduleSnapshot:
+        scope = e2db.cache_scope
+        with self._lock:
+            build_lock = self._build_locks.setdefault(scope, threading.Lock())
+        with build_lock:
+            # another thread may have rebuilt the snapshot while this one waited
+            current = self._snapshots.get(scope)
+            if not force and current is not stale:
+                return current
+            start = dt.datetime.now()
+            steps: dict[str, list[dict]] = {}
+            for row in e2db.open_schedule_steps(stream=True):
+                steps.setdefault(row["job_number"], []).append(row)
+            snapshot = ScheduleSnapshot(start, steps, e2db.as_of or start)
+            self._snapshots[scope] = snapshot
+        log.info(f"Built schedule snapshot of {len(steps)} jobs in {snapshot.age:.3f}s")
+        return snapshot
+
+    def get(self, e2db: "E2Database") -> ScheduleSnapshot:
+        snapshot = self._snapshots.get(e2db.cache_scope)
+        if snapshot is None or snapshot.age > MAX_AGE_SECONDS:
+            snapshot = self._build(e2db, force=False, stale=snapshot)
+        return snapshot
+
+    def refresh(self, e2db: "E2Database") -> ScheduleSnapshot:
+        return self._build(e2db, force=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+
+
+snapshots = ScheduleSnapshots()
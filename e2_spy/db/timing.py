@@ -0,0 +1,133 @@
+import collections
+import dataclasses
+import datetime as dt
+import logging
+import sys
+import textwrap
+import threading
+
+from e2_spy import config
+
+log = logging.getLogger(__name__)
+slow_log = logging.getLogger("e2_spy.slow_queries")
+
+# E2 queries that take longer than this many seconds are written to the slow query log
+SLOW_QUERY_SECONDS: float = getattr(config, "SLOW_QUERY_SECONDS", 2.0)
+
+# helpers between a report method and the cursor, skipped when naming the caller
+_PLUMBING = {"_rows", "q", "q_iter"}
+
+
+@dataclasses.dataclass
+class ReportStats:
+    report: str
+    calls: int = 0
+    rows: int = 0
+    execute_seconds: float = 0.0
+    fetch_seconds: float = 0.0
+    max_seconds: float = 0.0
+    slow_calls: int = 0
+
+    @property
+    def total_seconds(self) -> float:
+        return self.execute_seconds + self.fetch_seconds
+
+    @property
+    def avg_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+    @property
+    def avg_rows(self) -> float:
+        return self.rows / self.calls if self.calls else 0.0
+
+
+@dataclasses.dataclass
+class SlowQuery:
+    timestamp: dt.datetime
+    report: str
+    seconds: float
+    execute_seconds: float
+    fetch_seconds: float
+    rows: int
+    params: str
+
+
+class QueryStats:
+    """Aggregate timing and row counts for E2 queries, per report method"""
+
+    def __init__(self, recent_slow_queries: int = 50) -> None:
+        self._lock = threading.Lock()
+        self._reports: dict[str, ReportStats] = {}
+        self.slow_queries: collections.deque[SlowQuery] = collections.deque(
+            maxlen=recent_slow_queries
+        )
+
+    def record(
+        self,
+        report: str,
+        sql: str,
+        params: tuple | None,
+        execute_seconds: float,
+        fetch_seconds: float,
+        rows: int,
+    ) -> None:
+        seconds = execute_seconds + fetch_seconds
+        slow = seconds >= SLOW_QUERY_SECONDS
+        with self._lock:
+            s = self._reports.setdefault(report, ReportStats(report))
+            s.calls += 1
+            s.rows += rows
+            s.execute_seconds += execute_seconds
+            s.fetch_seconds += fetch_seconds
+            s.max_seconds = max(s.max_seconds, seconds)
+            if slow:
+                s.slow_calls += 1
+                self.slow_queries.appendleft(
+                    SlowQuery(
+                        dt.datetime.now(),
+                        report,
+                        seconds,
+                        execute_seconds,
+                        fetch_seconds,
+                        rows,
+                        repr(params),
+                    )
+                )
+        log.debug(
+            f"{report}: {rows} rows in {seconds:.3f}s "
+            f"(execute {execute_seconds:.3f}s, fetch {fetch_seconds:.3f}s)"
+        )
+        if slow:
+            slow_log.warning(
+                f"{report}: {rows} rows in {seconds:.3f}s "
+                f"(execute {execute_seconds:.3f}s, fetch {fetch_seconds:.3f}s) "
+                f"params={params!r}\n{textwrap.dedent(sql).strip()}"
+            )
+
+    def reports(self) -> list[ReportStats]:
+        """Get a copy of the stats for each report, slowest total time first"""
+        with self._lock:
+            return sorted(
+                (dataclasses.replace(s) for s in self._reports.values()),
+                key=lambda s: s.total_seconds,
+                reverse=True,
+            )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._reports.clear()
+            self.slow_queries.clear()
+
+
+query_stats = QueryStats()
+
+
+def caller_report() -> str:
+    """Get the name of the E2Database method that is running a query"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if name not in _PLUMBING:
+            return name
+        frame = frame.f_back
+    return "unknown"
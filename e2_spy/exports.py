@@ -0,0 +1,262 @@
+import collections
+import contextlib
+import dataclasses
+import logging
+import os
+import pathlib
+import secrets
+import threading
+import time
+import typing
+from collections.abc import Iterable, Iterator
+
+from e2_spy import config
+
+log = logging.getLogger(__name__)
+
+# finished exports are deleted after this many seconds
+RETENTION_SECONDS = getattr(config, "EXPORT_RETENTION_HOURS", 24) * 60 * 60
+
+# a cached export file is served for requests in the same window of this many
+# seconds, later requests build the export again
+CACHE_SECONDS = getattr(config, "EXPORT_CACHE_SECONDS", 5 * 60)
+
+# least recently used export files are deleted when the cache is bigger than this
+CACHE_MAX_BYTES = getattr(config, "EXPORT_CACHE_MAX_MB", 512) * 1024 * 1024
+
+
+def export_dir() -> pathlib.Path:
+    path = pathlib.Path(getattr(config, "EXPORT_DIR", "exports"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def cache_dir() -> pathlib.Path:
+    path = pathlib.Path(getattr(config, "EXPORT_CACHE_DIR", "export-cache"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@dataclasses.dataclass(frozen=True)
+class Export:
+    """A report export: the query for its rows, and how to lay them out
+
+    query takes a stream argument and returns the rows. An export with stream=True
+    always reads its rows as a stream, because the report has no bound on its size.
+    """
+
+    query: typing.Callable[..., list | Iterable[dict]]
+    col_names: list[str]
+    headers: list[str]
+    table_name: str
+    filename: str
+    stream: bool = False
+
+
+@dataclasses.dataclass
+class ExportJob:
+    """One export running in the background
+
+    path and args are the URL of the export route and its query arguments, which the
+    job requests as if a user had, with the page unlocks of the user that submitted
+    it. status is "queued", "running", "done" or "failed". rows counts the rows
+    written so far, for progress.
+    """
+
+    id: str
+    key: tuple
+    path: str
+    args: list[tuple[str, str]]
+    unlocked_pages: set[str]
+    created_at: float = dataclasses.field(default_factory=time.time)
+    status: str = "queued"
+    rows: int = 0
+    filename: str | None = None
+    file: pathlib.Path | None = None
+    error: str | None = None
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def in_flight(self) -> bool:
+        return self.status in ("queued", "running")
+
+
+Build = typing.Callable[[ExportJob, typing.BinaryIO], None]
+
+
+class ExportJobs:
+    """Keep track of background exports and the files they write"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._jobs: dict[str, ExportJob] = {}
+
+    def get(self, job_id: str) -> ExportJob | None:
+        return self._jobs.get(job_id)
+
+    def prune(self) -> int:
+        """Forget finished exports older than the retention window, and delete their
+        files
+
+        Any other file in the export directory, left there by a failed export or from
+        before a restart, is deleted too. Returns how many files were deleted.
+        """
+        cutoff = time.time() - RETENTION_SECONDS
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if not job.in_flight and job.finished_at < cutoff:
+                    del self._jobs[job.id]
+            keep = {job.file for job in self._jobs.values() if job.file is not None}
+            in_flight = {job.id for job in self._jobs.values() if job.in_flight}
+        deleted = 0
+        for file in export_dir().iterdir():
+            if file not in keep and file.stem not in in_flight:
+                file.unlink(missing_ok=True)
+                deleted += 1
+        return deleted
+
+    def run(self, job: ExportJob, build: Build) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        log.info(f"Running export {job.id} of {job.path}")
+        partial = export_dir() / f"{job.id}.part"
+        try:
+            with partial.open("wb") as f:
+                build(job, f)
+            job.file = partial.with_suffix(pathlib.PurePath(job.path).suffix)
+            partial.replace(job.file)
+            job.status = "done"
+        except Exception as e:
+            log.exception(f"Export {job.id} of {job.path} failed")
+            partial.unlink(missing_ok=True)
+            job.error = str(e) or type(e).__name__
+            job.status = "failed"
+        job.finished_at = time.time()
+        log.info(f"Export {job.id} {job.status}: {job.rows} rows in {job.elapsed:.3f}s")
+
+    def submit(
+        self, path: str, args: list[tuple[str, str]], unlocked_pages: set[str]
+    ) -> tuple[ExportJob, bool]:
+        """Get a new export job, or the one already in flight for the same export
+
+        Returns the job and whether it is new, in which case the caller schedules it.
+        """
+        key = (path, tuple(sorted(args)), frozenset(unlocked_pages))
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and job.in_flight:
+                    return job, False
+            job = ExportJob(secrets.token_urlsafe(), key, path, args, unlocked_pages)
+            self._jobs[job.id] = job
+        return job, True
+
+
+jobs = ExportJobs()
+
+
+class ExportCache:
+    """A size-bounded cache of export files on disk
+
+    Each file is stored as <key>/<download name>, where the caller derives the key
+    from the export, its parameters and a fingerprint of its data, so a cached file
+    is never out of date. It is only unreachable once the fingerprint moves on, and
+    then it is deleted like any other file that has not been served in a while. The
+    access time of a file records when it was last served.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counts: collections.Counter[str] = collections.Counter()
+
+    def evict(self) -> int:
+        """Delete files from past fingerprint windows, then least recently used files
+        until the cache fits its budget, and return how many files were deleted"""
+        cutoff = time.time() - CACHE_SECONDS
+        entries = []
+        for file in cache_dir().glob("*/*"):
+            try:
+                st = file.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_mtime, st.st_size, file))
+        entries.sort()
+        # left by an export that was interrupted before it could finish
+        for file in cache_dir().glob("*.part"):
+            with contextlib.suppress(FileNotFoundError):
+                if file.stat().st_mtime < cutoff:
+                    file.unlink()
+        total = sum(size for _, _, size, _ in entries)
+        deleted = 0
+        with self._lock:
+            for _, mtime, size, file in entries:
+                if mtime >= cutoff and total <= self.max_bytes:
+                    continue
+                file.unlink(missing_ok=True)
+                with contextlib.suppress(OSError):
+                    file.parent.rmdir()
+                total -= size
+                deleted += 1
+            self._counts["evictions"] += deleted
+        return deleted
+
+    def get(self, key: str) -> pathlib.Path | None:
+        """Get the cached file for key, and mark it as used"""
+        for file in (cache_dir() / key).glob("*"):
+            try:
+                os.utime(file, (time.time(), file.stat().st_mtime))
+            except FileNotFoundError:
+                break
+            with self._lock:
+                self._counts["hits"] += 1
+            return file
+        with self._lock:
+            self._counts["misses"] += 1
+        return None
+
+    def put(self, key: str, filename: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield chunks of an export as it is sent, and save them to the cache
+
+        The file is only kept if every chunk was sent, and it is not kept at all if
+        it grows bigger than the whole cache.
+        """
+        partial = cache_dir() / f"{key}.{secrets.token_hex(4)}.part"
+        size = 0
+        complete = False
+        try:
+            with partial.open("wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size <= self.max_bytes:
+                        f.write(chunk)
+                    yield chunk
+            complete = size <= self.max_bytes
+        finally:
+            if complete:
+                file = cache_dir() / key / filename
+                file.parent.mkdir(exist_ok=True)
+                partial.replace(file)
+                self.evict()
+            else:
+                partial.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        files = [f.stat().st_size for f in cache_dir().glob("*/*")]
+        return {
+            "bytes": sum(files),
+            "max_bytes": self.max_bytes,
+            "files": len(files),
+            "evictions": self._counts["evictions"],
+            "hits": self._counts["hits"],
+            "misses": self._counts["misses"],
+        }
+
+
+cache = ExportCache(CACHE_MAX_BYTES)
@@ -1,6 +1,14 @@
+import collections
+import concurrent.futures
+import dataclasses
+import email.utils
+import hashlib
 import json
 import logging
+import random
+import threading
 import time
+from collections.abc import Iterable, Iterator
 
 import httpx
 
@@ -8,46 +16,385 @@ from e2_spy import config
 
 log = logging.getLogger(__name__)
 
+# the Paperless Parts API, or a local mock of it for testing
+BASE_URL = getattr(config, "PAPERLESS_PARTS_BASE_URL", "https://api.paperlessparts.com")
 
-def get_client(api_key: str) -> httpx.Client:
-    auth_header = {"Authorization": f"API-Token {api_key}"}
-    return httpx.Client(headers=auth_header)
-
-
-def get_quotes(c: httpx.Client, use_cache: bool = True) -> list:
-    config.PAPERLESS_PARTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    p = config.PAPERLESS_PARTS_CACHE_DIR / "quotes.json"
-    if not use_cache or not p.exists():
-        response = c.get("https://api.paperlessparts.com/quotes/public/new")
-        p.write_bytes(response.content)
-    with p.open() as f:
-        return json.load(f)
-
-
-def get_quote_details(
-    c: httpx.Client, quote_number: int, revision: int | None, use_cache: bool = True
-) -> dict:
-    config.PAPERLESS_PARTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    if revision is None:
-        path_rev = 0
-        params = {}
-    else:
-        path_rev = revision
-        params = {"revision": revision}
-    p = config.PAPERLESS_PARTS_CACHE_DIR / f"quote-{quote_number}-{path_rev}.json"
-    if not use_cache or not p.exists():
-        log.info(f"Fetching info from API for quote {quote_number} revision {revision}")
+# how many quote details are fetched at the same time
+FETCH_THREADS = getattr(config, "PAPERLESS_PARTS_FETCH_THREADS", 4)
+
+# how many requests are sent to the API per second, on average
+REQUESTS_PER_SECOND = getattr(config, "PAPERLESS_PARTS_REQUESTS_PER_SECOND", 4)
+
+# seconds to wait for the API to connect, and to answer
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# a request that fails in a way that may pass is tried this many times in all, with
+# exponential backoff between attempts, from BACKOFF_SECONDS up to
+# BACKOFF_MAX_SECONDS with full jitter
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+
+# a sync sends no new requests after this many seconds
+SYNC_BUDGET_SECONDS = getattr(config, "PAPERLESS_PARTS_SYNC_BUDGET_SECONDS", 60 * 60)
+
+# after this many requests in a row have failed, the circuit breaker sends no
+# requests for CIRCUIT_RESET_SECONDS
+CIRCUIT_FAILURES = 5
+CIRCUIT_RESET_SECONDS = 5 * 60
+
+
+class PaperlessError(Exception):
+    """A request to the Paperless Parts API failed"""
+
+
+class SyncAbortedError(PaperlessError):
+    """No more requests can be sent in this sync"""
+
+
+class CircuitOpenError(SyncAbortedError):
+    """The circuit breaker is open after too many failures in a row"""
+
+
+class BudgetExceededError(SyncAbortedError):
+    """The sync ran past its time budget"""
+
+
+class TokenBucket:
+    """A thread-safe token bucket rate limiter
+
+    The bucket holds up to capacity tokens and refills at rate tokens per second.
+    Each request takes one token, waiting for it if the bucket is empty, so requests
+    go out in bursts of at most capacity and at rate per second on average.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
         while True:
-            response = c.get(
-                f"https://api.paperlessparts.com/quotes/public/{quote_number}",
-                params=params,
-            )
-            if "error" in response.json():
-                log.error(response.text)
-                log.error("Sleeping for 5 seconds")
-                time.sleep(5)
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stop sending requests to an API that keeps failing
+
+    The circuit opens after CIRCUIT_FAILURES failed requests in a row. While it is
+    open, requests fail right away. After CIRCUIT_RESET_SECONDS it lets one request
+    through, and closes again if that one succeeds.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < CIRCUIT_RESET_SECONDS:
+            return "open"
+        return "half-open"
+
+    def before_request(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self._trial):
+                msg = "Paperless Parts circuit breaker is open"
+                raise CircuitOpenError(msg)
+            self._trial = state == "half-open"
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            self._trial = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= CIRCUIT_FAILURES:
+                if self._opened_at is None:
+                    log.error("Opening the Paperless Parts circuit breaker")
+                self._opened_at = time.monotonic()
+
+
+rate_limiter = TokenBucket(REQUESTS_PER_SECOND, REQUESTS_PER_SECOND)
+circuit_breaker = CircuitBreaker()
+
+# counts of requests, retries and failures since the process started
+metrics: collections.Counter[str] = collections.Counter()
+_metrics_lock = threading.Lock()
+
+
+def _count(*names: str) -> None:
+    with _metrics_lock:
+        metrics.update(names)
+
+
+def stats() -> dict:
+    with _metrics_lock:
+        return {"circuit_breaker": circuit_breaker.state, **metrics}
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Get the seconds to wait from a Retry-After header, in seconds or as a date"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def _body_error(response: httpx.Response) -> str | None:
+    """Describe what is wrong with the body of a successful response, if anything"""
+    try:
+        body = response.json()
+    except ValueError:
+        return f"response is not JSON: {response.text[:200]}"
+    if "error" in body:
+        return f"error in response: {response.text}"
+    return None
+
+
+class Client:
+    """A Paperless Parts API client that retries, backs off, and gives up in time
+
+    Requests that fail in a way that may pass (a transport error or timeout, a 429
+    or 5xx response, or a body that has an error or is not JSON) are retried with
+    exponential backoff and jitter, waiting at least as long as Retry-After asks.
+    Other errors are not retried. Every request goes through the shared rate limiter
+    and circuit breaker, and no request starts after the client's time budget is
+    spent.
+    """
+
+    def __init__(self, api_key: str, budget: float = SYNC_BUDGET_SECONDS) -> None:
+        self.http = httpx.Client(
+            base_url=BASE_URL,
+            headers={"Authorization": f"API-Token {api_key}"},
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+        self.deadline = time.monotonic() + budget
+
+    def _check_budget(self, wait: float = 0) -> None:
+        if time.monotonic() + wait > self.deadline:
+            _count("budget_exceeded")
+            msg = "Paperless Parts sync ran out of time"
+            raise BudgetExceededError(msg)
+
+    def get(self, path: str, params: dict | None = None) -> httpx.Response:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self._check_budget()
+            circuit_breaker.before_request()
+            rate_limiter.acquire()
+            _count("requests")
+            retry_after = None
+            try:
+                response = self.http.get(path, params=params)
+            except httpx.TransportError as e:
+                reason = f"{type(e).__name__}: {e}"
+                _count("transport_errors")
             else:
+                if response.status_code == 429 or response.status_code >= 500:
+                    reason = f"HTTP {response.status_code}"
+                    retry_after = _retry_after(response)
+                    _count(f"http_{response.status_code}")
+                elif response.is_error:
+                    # the API answered, so it is up, but this request will not work
+                    circuit_breaker.record(success=True)
+                    _count("failures", f"http_{response.status_code}")
+                    msg = f"GET {path} failed with HTTP {response.status_code}"
+                    raise PaperlessError(msg)
+                elif reason := _body_error(response):
+                    retry_after = _retry_after(response)
+                    _count("body_errors")
+                else:
+                    circuit_breaker.record(success=True)
+                    return response
+            circuit_breaker.record(success=False)
+            if attempt == MAX_ATTEMPTS:
                 break
-        p.write_bytes(response.content)
-    with p.open(encoding="utf-8") as f:
-        return json.load(f)
+            backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** (attempt - 1))
+            wait = max(random.uniform(0, backoff), retry_after or 0)  # noqa: S311
+            log.warning(
+                f"GET {path} attempt {attempt} failed ({reason}), "
+                f"retrying in {wait:.1f}s"
+            )
+            self._check_budget(wait)
+            _count("retries")
+            time.sleep(wait)
+        _count("failures")
+        msg = f"GET {path} failed after {MAX_ATTEMPTS} attempts ({reason})"
+        raise PaperlessError(msg)
+
+
+def get_client(api_key: str) -> Client:
+    return Client(api_key)
+
+
+def payload_hash(payload: dict) -> str:
+    """Hash the content of a quote payload, so that equal payloads with keys in any
+    order get the same hash"""
+    content = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def get_quotes(
+    c: Client, last_quote: int | None = None, last_revision: int | None = None
+) -> list:
+    """Get the quotes that were sent, or only the ones sent after last_quote"""
+    params = {}
+    if last_quote is not None:
+        params["last_quote"] = last_quote
+        if last_revision is not None:
+            params["revision"] = last_revision
+    return c.get("/quotes/public/new", params=params).json()
+
+
+def get_quote_details(c: Client, quote_number: int, revision: int | None) -> dict:
+    log.info(f"Fetching info from API for quote {quote_number} revision {revision}")
+    params = {} if revision is None else {"revision": revision}
+    return c.get(f"/quotes/public/{quote_number}", params=params).json()
+
+
+def get_quote_details_many(
+    c: Client, quotes: Iterable[dict]
+) -> Iterator[tuple[dict, dict | None]]:
+    """Fetch the details of many quotes at the same time
+
+    Yields each quote from get_quotes with its details as soon as they arrive, in no
+    particular order, so the caller can write them to the database while the rest
+    are fetched. Quotes that could not be fetched are logged and yielded with None.
+    At most FETCH_THREADS requests are in flight, and all of them share the rate
+    limit. Raises SyncAbortedError when the circuit breaker opens or the time budget
+    runs out.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=FETCH_THREADS, thread_name_prefix="paperless-fetch"
+    )
+    futures = {}
+
+    def result(f: concurrent.futures.Future) -> tuple[dict, dict | None]:
+        q = futures.pop(f)
+        try:
+            return q, f.result()
+        except SyncAbortedError:
+            raise
+        except PaperlessError as e:
+            log.error(f"Skipping quote {q['quote']} revision {q['revision']}: {e}")
+            return q, None
+
+    try:
+        for q in quotes:
+            f = executor.submit(get_quote_details, c, q["quote"], q["revision"])
+            futures[f] = q
+            # keep a few fetches queued ahead of the workers, not the whole list
+            if len(futures) >= 2 * FETCH_THREADS:
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for f in done:
+                    yield result(f)
+        for f in concurrent.futures.as_completed(list(futures)):
+            yield result(f)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+@dataclasses.dataclass
+class SyncRun:
+    """One Paperless Parts sync, for showing its progress
+
+    status is "queued", "running", "done", "aborted" or "failed". counts has how many
+    quotes were listed, skipped without fetching, to be fetched and fetched so far,
+    and of the ones fetched, how many were written, unchanged or failed.
+    """
+
+    counts: collections.Counter[str] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    status: str = "queued"
+    error: str | None = None
+    started_at: float | None = None
+    finished_at: float | None = None
+    _requests_at_start: int = 0
+    _requests_at_finish: int | None = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def in_flight(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def rate(self) -> float:
+        """Requests per second sent to the API during the sync"""
+        return self.requests / self.elapsed if self.elapsed else 0
+
+    @property
+    def requests(self) -> int:
+        if self._requests_at_finish is not None:
+            return self._requests_at_finish - self._requests_at_start
+        return metrics["requests"] - self._requests_at_start
+
+    def finish(self, status: str) -> None:
+        self._requests_at_finish = metrics["requests"]
+        self.finished_at = time.time()
+        self.status = status
+
+    def start(self) -> None:
+        self._requests_at_start = metrics["requests"]
+        self.started_at = time.time()
+        self.status = "running"
+
+
+class SyncRuns:
+    """Make sure only one Paperless Parts sync runs at a time
+
+    Asking for a sync while one is queued or running joins that one.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.current: SyncRun | None = None
+
+    def submit(self) -> tuple[SyncRun, bool]:
+        """Get a new sync, or the one already in flight
+
+        Returns the sync and whether it is new, in which case the caller runs it.
+        """
+        with self._lock:
+            if self.current is not None and self.current.in_flight:
+                return self.current, False
+            self.current = SyncRun()
+            return self.current, True
+
+
+syncs = SyncRuns()
@@ -1,37 +1,282 @@
-import json
+import datetime as dt
 import logging
+from collections.abc import Iterator
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from e2_spy import config, paperless
-from e2_spy.db import AppDatabase
+from e2_spy import config, exports, paperless
+from e2_spy.db import (
+    AppDatabase,
+    E2Database,
+    MirrorDatabase,
+    app_database,
+    app_database_writer,
+    mirror,
+    parts,
+    schedule,
+)
 
 log = logging.getLogger(__name__)
 scheduler = BackgroundScheduler()
 
+# quotes from Paperless Parts are written in batches of this many, each batch in one
+# transaction
+PAPERLESS_PARTS_WRITE_BATCH = 50
+
+# quote items for parts that were not in E2 yet are checked again for the date their
+# part was entered, until their quote is this old
+NEW_PART_RECHECK_DAYS = 30
+
+
+def e2_mirror_sync(force: bool = False) -> None:
+    db = app_database(str(config.APP_DB_PATH))
+    if not db.e2_database_configured or not (force or db.e2_mirror_enabled):
+        return
+    log.info("Syncing the local mirror of E2 tables...")
+    mirror.get_store().sync(E2Database(db.e2_cnx_details), reconcile=force)
+    log.info("Done syncing the local mirror of E2 tables")
+
+
+def e2_part_dimension_refresh() -> None:
+    db = app_database(str(config.APP_DB_PATH))
+    if not db.e2_database_configured:
+        return
+    parts.dimensions.refresh(E2Database(db.e2_cnx_details))
+
+
+def e2_schedule_snapshot_refresh() -> None:
+    db = app_database(str(config.APP_DB_PATH))
+    if not db.e2_database_configured:
+        return
+    if db.e2_mirror_enabled:
+        e2db = MirrorDatabase(db.e2_cnx_details)
+    else:
+        e2db = E2Database(db.e2_cnx_details)
+    schedule.snapshots.refresh(e2db)
+
+
+def exports_prune() -> None:
+    deleted = exports.jobs.prune()
+    log.info(f"Deleted {deleted} expired export files")
+    evicted = exports.cache.evict()
+    log.info(f"Evicted {evicted} files from the export cache")
+
+
+def page_unlocks_prune() -> None:
+    with app_database_writer(str(config.APP_DB_PATH)) as db:
+        pruned = db.page_unlocks_prune()
+    log.info(f"Pruned {pruned} expired page unlocks")
+
+
+def paperless_parts_payloads_prune() -> None:
+    with app_database_writer(str(config.APP_DB_PATH)) as db:
+        deleted = db.paperless_parts_payloads_prune()
+    log.info(f"Deleted {deleted} Paperless Parts payloads that are no longer used")
+
+
+def paperless_parts_quote_items_classify(e2db: E2Database) -> int:
+    """Mark which quote items were for a new part, one that E2 did not have yet when
+    the quote was sent, and return how many items were classified
+
+    Part dates for every item that needs them are read from E2 in bulk, before the
+    app database writer is taken to save the results.
+    """
+    db = app_database(str(config.APP_DB_PATH))
+    recheck_since = dt.datetime.now(dt.UTC) - dt.timedelta(days=NEW_PART_RECHECK_DAYS)
+    items = db.paperless_parts_quote_items_unclassified(recheck_since)
+    part_dates = e2db.part_dates(item["part_number"] for item in items)
+    classified = []
+    for item in items:
+        entered_date = part_dates.get(item["part_number"], {}).get("entered_date")
+        quote_sent_date = dt.datetime.fromisoformat(
+            item["quote_sent_date"]
+        ).astimezone()
+        classified.append(
+            {
+                "rowid": item["rowid"],
+                "part_entered_date": entered_date and entered_date.isoformat(),
+                "new_part": entered_date is None or quote_sent_date < entered_date,
+            }
+        )
+    with app_database_writer(str(config.APP_DB_PATH)) as writer, writer.transaction():
+        writer.paperless_parts_quote_items_classify(classified)
+    return len(classified)
+
+
+def paperless_parts_quote_items_classify_backlog() -> None:
+    """Classify the quote items that no sync has classified yet, like the ones that
+    were stored before items were classified at all"""
+    db = app_database(str(config.APP_DB_PATH))
+    if not db.e2_database_configured:
+        return
+    classified = paperless_parts_quote_items_classify(E2Database(db.e2_cnx_details))
+    log.info(f"Classified {classified} Paperless Parts quote items")
+
+
+def paperless_parts_quote_items(q: dict, qd: dict) -> Iterator[dict]:
+    for item in qd["quote_items"]:
+        component = item["root_component"]
+        yield {
+            "part_name": component["description"],
+            "part_number": component["part_number"],
+            "part_revision": component["revision"],
+            "quote_number": q["quote"],
+            "quote_sent_date": qd["sent_date"],
+            "revision": q["revision"],
+        }
+
+
+def paperless_parts_quotes_write(
+    db: AppDatabase, batch: list[tuple[dict, dict, str]]
+) -> None:
+    """Write a batch of quotes, with their details, items and payload hashes, in one
+    transaction"""
+    with db.transaction():
+        db.paperless_parts_quote_details_upsert((qd, h) for _, qd, h in batch)
+        db.paperless_parts_quote_items_reset(
+            (q["quote"], q["revision"]) for q, _, _ in batch
+        )
+        db.paperless_parts_quote_items_insert(
+            item for q, qd, _ in batch for item in paperless_parts_quote_items(q, qd)
+        )
+
+
+def _sent_date(quote: dict) -> dt.datetime:
+    return dt.datetime.fromisoformat(quote["sent_date"])
+
 
 def paperless_parts_sync() -> None:
-    log.info("Syncing data from Paperless Parts...")
-    db = AppDatabase(str(config.APP_DB_PATH))
+    """Sync quotes from Paperless Parts, unless a sync is already running"""
+    run, new = paperless.syncs.submit()
+    if new:
+        paperless_parts_sync_run(run)
+    else:
+        log.info("A Paperless Parts sync is already running, not starting another")
+
+
+def _paperless_parts_sync(run: paperless.SyncRun) -> None:
+    """Sync quotes sent since the last sync from Paperless Parts
+
+    The watermark is the last quote a sync has processed along with every quote
+    before it. Only quotes after the watermark are listed, and of those, quotes that
+    are already stored are fetched again to catch changes, but their items are only
+    rewritten when the payload has changed. The watermark stops short of the first
+    quote that could not be fetched, so it is tried again in the next sync.
+
+    Quotes are listed and fetched without holding the app database writer, it is
+    only taken to write each batch, the watermark, and classified items.
+    """
+    db = app_database(str(config.APP_DB_PATH))
     c = paperless.get_client(db.paperless_parts_api_key)
-    for q in paperless.get_quotes(c, use_cache=False):
-        qd = db.paperless_parts_quote_details_get(q["quote"], q["revision"])
-        if qd is None:
-            qd = paperless.get_quote_details(c, q["quote"], q["revision"])
-            db.paperless_parts_quote_details_insert(qd)
-        else:
-            qd = json.loads(qd["payload"])
-        db.paperless_parts_quote_items_reset(q["quote"], q["revision"])
-        for item in qd["quote_items"]:
-            component = item["root_component"]
-            db.paperless_parts_quote_items_insert(
-                {
-                    "part_name": component["description"],
-                    "part_number": component["part_number"],
-                    "part_revision": component["revision"],
-                    "quote_number": q["quote"],
-                    "quote_sent_date": qd["sent_date"],
-                    "revision": q["revision"],
-                }
-            )
-    log.info("Done syncing data from Paperless Parts")
+    watermark = db.paperless_parts_watermark
+    last_quote = last_revision = None
+    if watermark is not None:
+        last_quote = watermark["quote_number"]
+        last_revision = watermark["revision_number"]
+        log.info(f"Syncing quotes sent after quote {last_quote} rev {last_revision}")
+    counts = run.counts
+    quotes = []
+    done = {}
+    batch = []
+
+    def write_batch() -> None:
+        with app_database_writer(str(config.APP_DB_PATH)) as writer:
+            paperless_parts_quotes_write(writer, batch)
+        for q, qd, _ in batch:
+            done[q["quote"], q["revision"]] = qd["sent_date"]
+        batch.clear()
+
+    try:
+        quotes = paperless.get_quotes(c, last_quote, last_revision)
+        counts["listed"] = len(quotes)
+        to_fetch = []
+        stored = {}
+        for q in quotes:
+            key = q["quote"], q["revision"]
+            qd = db.paperless_parts_quote_details_get(*key)
+            # before the first watermark, stored quotes are trusted as they are
+            if qd is not None and (
+                watermark is None or _sent_date(qd) <= _sent_date(watermark)
+            ):
+                counts["skipped"] += 1
+                done[key] = qd["sent_date"]
+                continue
+            to_fetch.append(q)
+            stored[key] = qd
+        counts["to_fetch"] = len(to_fetch)
+        # quotes are written as their details arrive, while the rest are fetched
+        log.info(f"Fetching details of {len(to_fetch)} quotes from Paperless Parts")
+        for q, qd in paperless.get_quote_details_many(c, to_fetch):
+            counts["fetched"] += 1
+            if qd is None:
+                counts["failed"] += 1
+                continue
+            key = q["quote"], q["revision"]
+            payload_hash = paperless.payload_hash(qd)
+            old = stored[key]
+            if old is not None and old["payload_hash"] == payload_hash:
+                counts["unchanged"] += 1
+                done[key] = qd["sent_date"]
+                continue
+            batch.append((q, qd, payload_hash))
+            counts["written"] += 1
+            if len(batch) >= PAPERLESS_PARTS_WRITE_BATCH:
+                write_batch()
+    except paperless.SyncAbortedError as e:
+        log.error(f"Stopped syncing data from Paperless Parts: {e}")
+        run.error = str(e)
+    finally:
+        # keep the quotes that were fetched, even if the sync failed part way
+        if batch:
+            write_batch()
+        # move the watermark over every quote up to the first one that is not done
+        new_watermark = watermark
+        for q in quotes:
+            key = q["quote"], q["revision"]
+            if key not in done:
+                break
+            new_watermark = {
+                "quote_number": q["quote"],
+                "revision_number": q["revision"],
+                "sent_date": done[key],
+            }
+        if new_watermark != watermark:
+            with app_database_writer(str(config.APP_DB_PATH)) as writer:
+                writer.paperless_parts_watermark = new_watermark
+    if db.e2_database_configured:
+        e2db = E2Database(db.e2_cnx_details)
+        classified = paperless_parts_quote_items_classify(e2db)
+        log.info(f"Classified {classified} Paperless Parts quote items")
+
+
+def paperless_parts_sync_run(run: paperless.SyncRun) -> None:
+    """Run a sync that was submitted to paperless.syncs, and record how it went"""
+    run.start()
+    log.info("Syncing data from Paperless Parts...")
+    try:
+        _paperless_parts_sync(run)
+        run.finish("aborted" if run.error else "done")
+    except Exception as e:
+        log.exception("Syncing data from Paperless Parts failed")
+        run.error = str(e) or type(e).__name__
+        run.finish("failed")
+    with app_database_writer(str(config.APP_DB_PATH)) as db:
+        db.paperless_parts_sync_runs_insert(
+            {
+                "started_at": dt.datetime.fromtimestamp(run.started_at).isoformat(" "),
+                "duration": run.elapsed,
+                "status": run.status,
+                "listed": run.counts["listed"],
+                "skipped": run.counts["skipped"],
+                "fetched": run.counts["fetched"],
+                "written": run.counts["written"],
+                "unchanged": run.counts["unchanged"],
+                "failed": run.counts["failed"],
+                "requests": run.requests,
+                "error": run.error,
+            }
+        )
+    log.info(
+        f"Done syncing data from Paperless Parts ({run.status}) in "
+        f"{run.elapsed:.1f}s: {dict(run.counts)}"
+    )
@@ -0,0 +1,164 @@
+import dataclasses
+import datetime as dt
+import decimal
+import operator
+import typing
+from collections.abc import Sequence
+
+import xlsxwriter.workbook
+import xlsxwriter.worksheet
+
+
+@dataclasses.dataclass(frozen=True)
+class Column:
+    """How to write one column of an xlsx export
+
+    kind is "string", "number", "date" or "auto". An auto column takes its kind from
+    the first row of the export. format names one of the formats in
+    RowWriter.formats. width is a fixed column width, or None to fit the column to
+    its widest value but no narrower than min_width. source is "job_notes" to write
+    the notes for the row's job number instead of a value from the row.
+    """
+
+    kind: str = "auto"
+    format: str | None = None
+    width: int | None = None
+    min_width: int = 0
+    source: str | None = None
+
+
+# columns that are not written with the defaults, by row key
+COLUMNS: dict[str, Column] = {
+    "amount": Column(kind="number", format="money"),
+    "gl_account": Column(min_width=10),
+    "job_notes": Column(
+        kind="string", format="text_wrap", width=40, source="job_notes"
+    ),
+    # 14 is a good width for 'Job Number'
+    "job_number": Column(kind="string", min_width=14),
+    # column header 'Active' is longer than any value (TRUE or FALSE)
+    "part_active": Column(width=9),
+    "part_description": Column(kind="string", width=100),
+    "unit_price": Column(kind="number", format="money"),
+}
+
+DEFAULT_COLUMN = Column()
+
+# the value types that each kind writes with its own worksheet method, any other
+# value (None, for example) goes through worksheet.write
+_KIND_TYPES: dict[str, frozenset[type]] = {
+    "auto": frozenset(),
+    "date": frozenset({dt.date, dt.datetime}),
+    "number": frozenset({bool, decimal.Decimal, float, int}),
+    "string": frozenset({str}),
+}
+
+# number columns write bools as 1 or 0, but auto columns of bools are written with
+# worksheet.write, as TRUE or FALSE
+_KIND_OF_TYPE = {
+    t: kind for kind, types in _KIND_TYPES.items() for t in types if t is not bool
+}
+
+Writer = typing.Callable[[int, dict], None]
+
+
+class RowWriter:
+    """Write report rows to a worksheet
+
+    Each column is compiled once, on the first row, into a function that reads the
+    value, writes it with the worksheet method for its type and tracks the column
+    width. Writing a row is then one call per column with no lookups by name.
+    """
+
+    def __init__(
+        self,
+        workbook: xlsxwriter.workbook.Workbook,
+        worksheet: xlsxwriter.worksheet.Worksheet,
+        col_names: list[str],
+        headers: list[str],
+    ) -> None:
+        self.worksheet = worksheet
+        self.col_names = col_names
+        self.formats = {
+            "money": workbook.add_format({"num_format": "$#,##0.00;[Red]$#,##0.00"}),
+            "text_wrap": workbook.add_format({"text_wrap": True}),
+        }
+        self.columns = [COLUMNS.get(name, DEFAULT_COLUMN) for name in col_names]
+        self.widths = [len(h) for h in headers]
+        # notes for the rows being written, by job number
+        self.job_notes: dict[str, str] = {}
+        self._writers: list[Writer] | None = None
+
+    @property
+    def needs_job_notes(self) -> bool:
+        return any(c.source == "job_notes" for c in self.columns)
+
+    def _compile(self, sample: dict) -> None:
+        self._writers = [
+            self._compile_column(j, name, column, sample)
+            for j, (name, column) in enumerate(
+                zip(self.col_names, self.columns, strict=True)
+            )
+        ]
+
+    def _compile_column(
+        self, j: int, name: str, column: Column, sample: dict
+    ) -> Writer:
+        ws = self.worksheet
+        widths = self.widths
+        fmt = self.formats.get(column.format)
+        if column.source == "job_notes":
+            job_notes = self.job_notes
+
+            def get(row: dict) -> str:
+                return job_notes.get(row["job_number"], "")
+        else:
+            get = operator.itemgetter(name)
+        kind = column.kind
+        if kind == "auto":
+            kind = _KIND_OF_TYPE.get(type(get(sample)), "auto")
+        types = _KIND_TYPES[kind]
+        typed = {
+            "auto": ws.write,
+            "date": ws.write_datetime,
+            "number": ws.write_number,
+            "string": ws.write_string,
+        }[kind]
+        generic = ws.write
+
+        if column.width is not None:
+            widths[j] = column.width
+
+            def write(i: int, row: dict) -> None:
+                v = get(row)
+                if type(v) in types:
+                    typed(i, j, v, fmt)
+                else:
+                    generic(i, j, v, fmt)
+
+            return write
+
+        widths[j] = max(widths[j], column.min_width)
+
+        def write_and_fit(i: int, row: dict) -> None:
+            v = get(row)
+            if type(v) in types:
+                typed(i, j, v, fmt)
+            else:
+                generic(i, j, v, fmt)
+            n = len(v) if type(v) is str else len(str(v))
+            if n > widths[j]:
+                widths[j] = n
+
+        return write_and_fit
+
+    def write_rows(self, rows: Sequence[dict], first_row: int) -> int:
+        """Write rows starting at first_row, and return the last row number written"""
+        if self._writers is None and rows:
+            self._compile(rows[0])
+        writers = self._writers
+        i = first_row - 1
+        for i, row in enumerate(rows, start=first_row):
+            for write in writers:
+                write(i, row)
+        return i
@@ -0,0 +1,156 @@
+"""Compare how fast xlsx exports write report rows, before and after columns were
+compiled into writer functions
+
+Writes synthetic sales summary rows to a worksheet with the per-cell loop that
+_make_xlsx used to run, and with _write_sheet, and prints cells per second for
+each. Run from the repository root with a config in place:
+
+    uv run python -m scripts.bench_xlsx
+"""
+
+import argparse
+import datetime as dt
+import decimal
+import io
+import time
+import typing
+
+import flask
+import xlsxwriter
+
+from e2_spy import app
+
+COLUMNS = [
+    "invoice_number",
+    "invoice_date",
+    "period",
+    "customer_code",
+    "customer_name",
+    "job_number",
+    "market",
+    "part_number",
+    "revision",
+    "qty_ordered",
+    "qty_shipped",
+    "unit",
+    "unit_price",
+    "product_code",
+    "salesman",
+    "part_description",
+    "gl_account",
+    "gl_account_description",
+    "amount",
+]
+
+
+def make_rows(n: int) -> list[dict]:
+    return [
+        {
+            "invoice_number": 100000 + i,
+            "invoice_date": dt.date(2024, 1, 1) + dt.timedelta(days=i % 365),
+            "period": 202401,
+            "customer_code": "CUST",
+            "customer_name": "Customer Name Inc",
+            "job_number": f"J{i:06d}",
+            "market": "AERO",
+            "part_number": f"P-{i}",
+            "revision": "A",
+            "qty_ordered": 10,
+            "qty_shipped": 10,
+            "unit": "EA",
+            "unit_price": decimal.Decimal("12.34"),
+            "product_code": "PC",
+            "salesman": "SM",
+            "part_description": "Some part description",
+            "gl_account": "4000.100",
+            "gl_account_description": "Sales",
+            "amount": decimal.Decimal("123.40"),
+        }
+        for i in range(n)
+    ]
+
+
+def write_per_cell(
+    workbook: xlsxwriter.Workbook,
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    data: list[dict],
+    col_names: list,
+    headers: list,
+    table_name: str,
+) -> None:
+    """Write rows the way _make_xlsx did before columns were compiled, by checking
+    the name of every column for every cell"""
+    text_wrap = workbook.add_format({"text_wrap": True})
+    money = workbook.add_format({"num_format": "$#,##0.00;[Red]$#,##0.00"})
+    col_widths = [len(h) for h in headers]
+    for i, row in enumerate(data, start=1):
+        for j, col_name in enumerate(col_names):
+            if col_name in ("amount", "unit_price"):
+                col_data = row[col_name]
+                worksheet.write_number(i, j, col_data, money)
+                col_widths[j] = max(col_widths[j], len(str(col_data)))
+            elif col_name == "gl_account":
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = max(10, len(str(col_data)))
+            elif col_name == "job_notes":
+                col_data = flask.g.db.job_notes_get(row["job_number"])
+                worksheet.write_string(i, j, col_data, text_wrap)
+                col_widths[j] = 40
+            elif col_name == "job_number":
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = max(14, len(col_data))
+            elif col_name == "part_active":
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = 9
+            elif col_name == "part_description":
+                col_data = row[col_name]
+                worksheet.write_string(i, j, col_data)
+                col_widths[j] = 100
+            else:
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = max(col_widths[j], len(str(col_data)))
+    for j, width in enumerate(col_widths):
+        worksheet.set_column(j, j, width)
+    table_options = {"name": table_name, "columns": [{"header": h} for h in headers]}
+    worksheet.add_table(0, 0, len(data), len(headers) - 1, table_options)
+
+
+def best_seconds(write: typing.Callable, rows: list[dict], repeat: int) -> float:
+    """Time writing rows to a new worksheet, without saving the workbook"""
+    best = None
+    for _ in range(repeat):
+        workbook = xlsxwriter.Workbook(
+            io.BytesIO(), {"default_date_format": "yyyy-mm-dd", "in_memory": True}
+        )
+        worksheet = workbook.add_worksheet()
+        start = time.perf_counter()
+        write(workbook, worksheet, rows, COLUMNS, COLUMNS, "Bench")
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    rows = make_rows(args.rows)
+    cells = args.rows * len(COLUMNS)
+    print(f"{args.rows:,} rows x {len(COLUMNS)} columns, best of {args.repeat}")
+    with app.app.test_request_context():
+        flask.g.db = app.get_database()
+        for name, write in [
+            ("per cell", write_per_cell),
+            ("compiled", app._write_sheet),
+        ]:
+            seconds = best_seconds(write, rows, args.repeat)
+            print(f"{name}: {seconds:.2f}s, {cells / seconds:,.0f} cells/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import pathlib
+import sys
+import tempfile
+import types
+
+import e2_spy
+
+# the app reads its settings from e2_spy.config, which is not in the repo
+config = types.ModuleType("e2_spy.config")
+_tmp = pathlib.Path(tempfile.mkdtemp())
+config.APP_DB_PATH = _tmp / "app.db"
+config.APP_LOG = _tmp / "app.log"
+config.ERR_LOG = _tmp / "stderr.log"
+config.EXPORT_CACHE_DIR = _tmp / "export-cache"
+config.EXPORT_DIR = _tmp / "exports"
+config.MIRROR_DB_PATH = _tmp / "mirror.db"
+config.PORT = 8080
+config.SLOW_QUERY_LOG = _tmp / "slow-queries.log"
+config.SLOW_QUERY_SECONDS = 2
+sys.modules["e2_spy.config"] = config
+e2_spy.config = config
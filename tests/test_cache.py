@@ -0,0 +1,49 @@
+import datetime as dt
+
+import pytest
+
+from e2_spy.db import cache
+
+
+class Reports:
+    cache_scope = ("test", "test")
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    @cache.cached(ttl=60)
+    def page(self, after: tuple | None = None) -> list:
+        self.calls.append(after)
+        return [after]
+
+    @cache.cached(ttl=60, filters=("users",))
+    def by_user(self, users: list[str]) -> list:
+        self.calls.append(users)
+        return list(users)
+
+
+@pytest.fixture
+def reports() -> Reports:
+    cache.result_cache.flush()
+    return Reports()
+
+
+def test_cursors_in_a_different_order_are_cached_apart(reports: Reports) -> None:
+    assert reports.page(after=(dt.date(2024, 3, 1), "J100")) == [
+        (dt.date(2024, 3, 1), "J100")
+    ]
+    assert reports.page(after=("J100", dt.date(2024, 3, 1))) == [
+        ("J100", dt.date(2024, 3, 1))
+    ]
+    assert reports.page(after=("J100", "J100")) == [("J100", "J100")]
+    assert reports.page(after=("J100",)) == [("J100",)]
+    assert len(reports.calls) == 4
+
+
+def test_filters_in_any_order_share_an_entry(reports: Reports) -> None:
+    reports.by_user(["b", "a"])
+    reports.by_user(["a", "b", "a"])
+    reports.by_user(("a", "b"))
+    assert reports.calls == [["b", "a"]]
+    reports.by_user(["a"])
+    assert len(reports.calls) == 2
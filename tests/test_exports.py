@@ -0,0 +1,44 @@
+import flask.testing
+import pytest
+
+from e2_spy import tasks
+from e2_spy.app import app
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> flask.testing.FlaskClient:
+    jobs = []
+    monkeypatch.setattr(tasks.scheduler, "add_job", lambda *a, **kw: jobs.append(a))
+    client = app.test_client()
+    client.jobs = jobs
+    return client
+
+
+@pytest.mark.parametrize(
+    ("export", "export_format"),
+    [
+        ("workbook_xlsx", "csv"),
+        ("workbook_xlsx", "ndjson"),
+        ("closed_jobs_xlsx", "pdf"),
+        ("closed_jobs", "xlsx"),
+        ("no_such_xlsx", "xlsx"),
+    ],
+)
+def test_exports_create_rejects_missing_routes(
+    client: flask.testing.FlaskClient, export: str, export_format: str
+) -> None:
+    response = client.post(f"/exports?export={export}&format={export_format}")
+    assert response.status_code == 404
+    assert client.jobs == []
+
+
+@pytest.mark.parametrize(
+    ("export", "export_format"),
+    [("workbook_xlsx", "xlsx"), ("closed_jobs_xlsx", "csv")],
+)
+def test_exports_create_submits_existing_routes(
+    client: flask.testing.FlaskClient, export: str, export_format: str
+) -> None:
+    response = client.post(f"/exports?export={export}&format={export_format}")
+    assert response.status_code == 302
+    assert len(client.jobs) == 1
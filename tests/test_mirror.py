@@ -0,0 +1,112 @@
+import datetime as dt
+from collections.abc import Iterator
+
+import pytest
+
+from e2_spy.db import E2Database, MirrorDatabase, cache, schedule
+
+
+class UnsyncedStore:
+    """A mirror store none of whose tables have been synced yet"""
+
+    def as_of(self, table_names: list[str]) -> None:
+        return None
+
+
+class SyncedStore:
+    """A mirror store that has synced every table and counts the queries it runs"""
+
+    def __init__(self) -> None:
+        self.queries = []
+
+    def as_of(self, table_names: list[str]) -> dt.datetime:
+        return dt.datetime(2024, 3, 1, 12, 0)
+
+    def q(self, sql: str, params: tuple = ()) -> list[dict]:
+        self.queries.append(sql)
+        return [{"product_code": "MIRROR"}]
+
+    def q_iter(self, sql: str, params: tuple = ()) -> Iterator[dict]:
+        self.queries.append(sql)
+        yield {"job_number": "J100", "current_step": "SAW"}
+
+
+@pytest.fixture
+def e2db(monkeypatch: pytest.MonkeyPatch) -> MirrorDatabase:
+    cache.result_cache.flush()
+    db = MirrorDatabase({"server": "test", "database": "test"}, store=UnsyncedStore())
+    db.queries = []
+
+    def q(sql: str, params: tuple | None = None) -> list:
+        db.queries.append((sql, params))
+        return []
+
+    monkeypatch.setattr(db, "q", q)
+    return db
+
+
+@pytest.mark.parametrize("date_closed", [dt.date(2024, 3, 1), None])
+def test_closed_jobs_falls_back_to_e2_with_e2_cursor(
+    e2db: MirrorDatabase, date_closed: dt.date | None
+) -> None:
+    e2db.closed_jobs(after=(date_closed, "J100"), limit=50)
+    [(sql, params)] = e2db.queries
+    assert "?" not in sql
+    assert "date(" not in sql
+    assert sql.count("%s") == len(params)
+    assert params[-1] == "J100"
+
+
+@pytest.mark.parametrize("date_closed", [dt.date(2024, 3, 1), None])
+def test_job_performance_falls_back_to_e2_with_e2_cursor(
+    e2db: MirrorDatabase, date_closed: dt.date | None
+) -> None:
+    start, end = dt.date(2024, 1, 1), dt.date(2024, 12, 31)
+    e2db.job_performance(start, end, after=(date_closed, "J100"), limit=50)
+    [(sql, params)] = e2db.queries
+    assert "?" not in sql
+    assert "date(" not in sql
+    assert sql.count("%s") == len(params)
+    assert params[-1] == "J100"
+
+
+def test_sales_summary_falls_back_to_e2_with_e2_cursor(e2db: MirrorDatabase) -> None:
+    start, end = dt.date(2024, 1, 1), dt.date(2024, 12, 31)
+    e2db.sales_summary(start, end, after="1001", limit=50)
+    [(sql, params)] = e2db.queries
+    assert "?" not in sql
+    assert "date(" not in sql
+    assert sql.count("%s") == len(params)
+    assert params[0] == 50
+
+
+def test_mirrored_reports_are_cached_apart_from_e2(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    cache.result_cache.flush()
+    store = SyncedStore()
+    mirror_db = MirrorDatabase({"server": "test", "database": "test"}, store=store)
+    assert mirror_db.product_codes() == ["MIRROR"]
+    assert mirror_db.product_codes() == ["MIRROR"]
+    assert len(store.queries) == 1
+    e2db = E2Database({"server": "test", "database": "test"})
+    monkeypatch.setattr(e2db, "q", lambda sql, params=None: [{"product_code": "E2"}])
+    assert e2db.product_codes() == ["E2"]
+
+
+def test_reports_read_from_a_schedule_snapshot_show_its_age(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    cache.result_cache.flush()
+    schedule.snapshots.clear()
+    cnx_details = {"server": "test", "database": "test"}
+    schedule.snapshots.refresh(MirrorDatabase(cnx_details, store=SyncedStore()))
+    e2db = MirrorDatabase(cnx_details, store=SyncedStore())
+    monkeypatch.setattr(e2db, "q", lambda sql, params=None: [{"job_number": "J100"}])
+    # the second time, the orders come from the cache
+    for _ in range(2):
+        e2db.as_of = None
+        rows = e2db.open_sales_report()
+        assert rows == [{"job_number": "J100", "current_step": "SAW"}]
+        assert e2db.as_of == dt.datetime(2024, 3, 1, 12, 0)
+    schedule.snapshots.clear()
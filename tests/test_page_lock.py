@@ -0,0 +1,86 @@
+import flask.testing
+import pytest
+
+from e2_spy.app import app, get_database
+
+
+@pytest.fixture
+def client() -> flask.testing.FlaskClient:
+    db = get_database()
+    db.u("delete from page_passwords")
+    db.u("insert into page_passwords (page_key, page_password) values ('admin', 'pw')")
+    return app.test_client()
+
+
+def _unlock(client: flask.testing.FlaskClient, next_url: str) -> str:
+    data = {"endpoint": "admin", "password": "pw", "next": next_url}
+    return client.post("/unlock", data=data).location
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/diagnostics/cache",
+        "/diagnostics/e2-pool",
+        "/diagnostics/paperless-parts",
+        "/diagnostics/queries",
+    ],
+)
+def test_diagnostics_are_locked_until_unlocked(
+    client: flask.testing.FlaskClient, path: str
+) -> None:
+    response = client.get(path)
+    assert b"You tried to view a locked page" in response.data
+    assert f'name="next" type="hidden" value="{path}"'.encode() in response.data
+    assert _unlock(client, path) == path
+    response = client.get(path)
+    assert b"You tried to view a locked page" not in response.data
+    assert response.status_code == 200
+
+
+def test_revoking_unlocks_needs_the_admin_password(
+    client: flask.testing.FlaskClient,
+) -> None:
+    epoch = get_database().page_unlocks_epoch
+    response = client.post(
+        "/settings/page-unlocks/revoke",
+        headers={"Referer": "http://localhost/settings"},
+    )
+    assert b"You tried to view a locked page" in response.data
+    assert b'name="next" type="hidden" value="/settings"' in response.data
+    assert get_database().page_unlocks_epoch == epoch
+    assert _unlock(client, "/settings") == "/settings"
+    response = client.post("/settings/page-unlocks/revoke")
+    assert response.status_code == 302
+    assert get_database().page_unlocks_epoch != epoch
+
+
+@pytest.mark.parametrize("next_url", ["https://example.com/", "//example.com/"])
+def test_unlock_only_goes_back_to_this_site(
+    client: flask.testing.FlaskClient, next_url: str
+) -> None:
+    assert _unlock(client, next_url) == "/"
+
+
+@pytest.mark.parametrize("password", [None, "", "wrong"])
+def test_a_page_without_a_password_cannot_be_unlocked(
+    client: flask.testing.FlaskClient, password: str | None
+) -> None:
+    data = {"endpoint": "income_statements", "next": "/diagnostics/e2-pool"}
+    if password is not None:
+        data["password"] = password
+    client.post("/unlock", data=data)
+    response = client.get("/income-statements")
+    assert b"You tried to view a locked page" in response.data
+
+
+@pytest.mark.parametrize("password", [None, ""])
+def test_the_admin_pages_need_a_password(
+    client: flask.testing.FlaskClient, password: str | None
+) -> None:
+    data = {"endpoint": "admin", "next": "/diagnostics/e2-pool"}
+    if password is not None:
+        data["password"] = password
+    client.post("/unlock", data=data)
+    response = client.get("/diagnostics/e2-pool")
+    assert b"You tried to view a locked page" in response.data
@@ -0,0 +1,45 @@
+import httpx
+import pytest
+
+from e2_spy import paperless
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> paperless.Client:
+    monkeypatch.setattr(paperless, "BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(paperless, "circuit_breaker", paperless.CircuitBreaker())
+    return paperless.Client("test")
+
+
+def _serve(client: paperless.Client, responses: list[httpx.Response]) -> list:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return responses.pop(0)
+
+    client.http = httpx.Client(
+        base_url="http://paperless.test", transport=httpx.MockTransport(handler)
+    )
+    return requests
+
+
+def test_get_retries_a_body_that_is_not_json(client: paperless.Client) -> None:
+    requests = _serve(
+        client,
+        [
+            httpx.Response(200, text="<html>Service Unavailable</html>"),
+            httpx.Response(200, json={"number": 1}),
+        ],
+    )
+    body_errors = paperless.metrics["body_errors"]
+    assert client.get("/quotes/public/1").json() == {"number": 1}
+    assert len(requests) == 2
+    assert paperless.metrics["body_errors"] == body_errors + 1
+    assert paperless.circuit_breaker.state == "closed"
+
+
+def test_get_gives_up_on_a_body_that_is_never_json(client: paperless.Client) -> None:
+    _serve(client, [httpx.Response(200, text="")] * paperless.MAX_ATTEMPTS)
+    with pytest.raises(paperless.PaperlessError, match="not JSON"):
+        client.get("/quotes/public/1")
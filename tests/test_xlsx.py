@@ -0,0 +1,156 @@
+import datetime as dt
+import decimal
+import io
+from collections.abc import Callable
+
+import pytest
+import xlsxwriter
+
+from e2_spy import xlsx
+
+VALUES = {
+    "str": "A-100",
+    "int": 7,
+    "decimal": decimal.Decimal("12.50"),
+    "float": 2.25,
+    "date": dt.date(2024, 3, 1),
+    "datetime": dt.datetime(2024, 3, 1, 8, 30),
+    "none": None,
+    "bool": True,
+}
+
+COLUMN_NAMES = [*xlsx.COLUMNS, "other"]
+
+JOB_NOTES = {"J1": "first note\nsecond note"}
+
+
+def _write_rows_per_cell(
+    workbook: xlsxwriter.Workbook,
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    rows: list[dict],
+    col_names: list[str],
+    headers: list[str],
+) -> list[int]:
+    """Write rows the way _make_xlsx did before columns were compiled, by checking
+    the name of every column for every cell, and return the column widths"""
+    text_wrap = workbook.add_format({"text_wrap": True})
+    money = workbook.add_format({"num_format": "$#,##0.00;[Red]$#,##0.00"})
+    col_widths = [len(h) for h in headers]
+    for i, row in enumerate(rows, start=1):
+        for j, col_name in enumerate(col_names):
+            if col_name in ("amount", "unit_price"):
+                col_data = row[col_name]
+                worksheet.write_number(i, j, col_data, money)
+                col_widths[j] = max(col_widths[j], len(str(col_data)))
+            elif col_name == "gl_account":
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = max(10, len(str(col_data)))
+            elif col_name == "job_notes":
+                col_data = JOB_NOTES.get(row["job_number"], "")
+                worksheet.write_string(i, j, col_data, text_wrap)
+                col_widths[j] = 40
+            elif col_name == "job_number":
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = max(14, len(col_data))
+            elif col_name == "part_active":
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = 9
+            elif col_name == "part_description":
+                col_data = row[col_name]
+                worksheet.write_string(i, j, col_data)
+                col_widths[j] = 100
+            else:
+                col_data = row[col_name]
+                worksheet.write(i, j, col_data)
+                col_widths[j] = max(col_widths[j], len(str(col_data)))
+    return col_widths
+
+
+def _write_rows_compiled(
+    workbook: xlsxwriter.Workbook,
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    rows: list[dict],
+    col_names: list[str],
+    headers: list[str],
+) -> list[int]:
+    writer = xlsx.RowWriter(workbook, worksheet, col_names, headers)
+    writer.job_notes.update(JOB_NOTES)
+    writer.write_rows(rows, 1)
+    return writer.widths
+
+
+def _write_rows_generic(
+    workbook: xlsxwriter.Workbook,
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    rows: list[dict],
+    col_names: list[str],
+    headers: list[str],
+) -> None:
+    """Write every value with worksheet.write, in the column's format"""
+    writer = xlsx.RowWriter(workbook, worksheet, col_names, headers)
+    for i, row in enumerate(rows, start=1):
+        for j, (name, column) in enumerate(zip(col_names, writer.columns, strict=True)):
+            fmt = writer.formats.get(column.format)
+            worksheet.write(i, j, row[name], fmt)
+
+
+def _cells(write: Callable, rows: list[dict], col_names: list[str]) -> tuple:
+    """Write rows to a new worksheet, and get what each cell holds and the column
+    widths"""
+    workbook = xlsxwriter.Workbook(io.BytesIO(), {"in_memory": True})
+    worksheet = workbook.add_worksheet()
+    widths = write(workbook, worksheet, rows, col_names, col_names)
+    strings = {i: s for s, i in workbook.str_table.string_table.items()}
+    cells = {}
+    for i, row in worksheet.table.items():
+        for j, cell in row.items():
+            fields = cell._asdict()
+            fmt = fields.pop("format")
+            if "string" in fields:
+                fields["string"] = strings[fields["string"]]
+            cells[i, j] = (
+                type(cell).__name__,
+                fields,
+                fmt and (fmt.num_format, fmt.text_wrap),
+            )
+    return cells, widths
+
+
+def _rows(name: str, values: list) -> list[dict]:
+    return [{"job_number": "J1", name: v} for v in values]
+
+
+@pytest.mark.parametrize("kind", VALUES)
+@pytest.mark.parametrize("name", COLUMN_NAMES)
+def test_compiled_writers_match_per_cell_writes(name: str, kind: str) -> None:
+    rows = _rows(name, [VALUES[kind]])
+    try:
+        expected = _cells(_write_rows_per_cell, rows, [name])
+    except TypeError:
+        # the per-cell writes could not export this value at all, the compiled
+        # writers fall back to worksheet.write for it
+        expected = _cells(_write_rows_generic, rows, [name])[0], None
+    cells, widths = _cells(_write_rows_compiled, rows, [name])
+    assert cells == expected[0]
+    if expected[1] is not None:
+        assert widths == expected[1]
+
+
+@pytest.mark.parametrize("name", COLUMN_NAMES)
+def test_compiled_writers_match_per_cell_writes_for_mixed_rows(name: str) -> None:
+    """Auto columns take their kind from the first row, values of other types in
+    later rows are still written like before"""
+    values = []
+    for v in VALUES.values():
+        try:
+            _cells(_write_rows_per_cell, _rows(name, [v]), [name])
+        except TypeError:
+            continue
+        values.append(v)
+    rows = _rows(name, values)
+    expected, _ = _cells(_write_rows_per_cell, rows, [name])
+    cells, _ = _cells(_write_rows_compiled, rows, [name])
+    assert cells == expected